@@ -21,6 +21,7 @@ Unless required by applicable law or agreed to in writing, software distributed
 language governing permissions and limitations under the License.
 
 """
+import atexit
 import configparser
 import hashlib
 import importlib.util
@@ -44,9 +45,18 @@ from werkzeug.exceptions import BadRequest
 from wtforms.validators import InputRequired, ValidationError
 from wtforms.widgets import PasswordInput
 
-from modules.character_persistent_class import CharacterPersistentClass
 from modules.kik_user import LazyKikUser
+from modules.last_request_buffer import LastRequestBuffer
+from modules.picture_ingestor import PictureIngestor
+from modules.profile_cache import ProfileCache
+from modules.profile_refresher import ProfileRefresher
 from modules.message_controller import MessageController
+from modules.kik_sender import KikMessageSender
+from modules.message_dispatcher import MessageDispatcher
+from modules.message_deduplicator import MessageDeduplicator
+from modules.rate_limiter import RateLimiter
+from modules.session_store import SessionStore
+from modules.metrics import metrics, Metrics
 from wtforms import Form, StringField, TextAreaField, SelectField
 from jinja2 import evalcontextfilter, Markup, escape
 
@@ -62,15 +72,16 @@ def picture(path):
 
 @app.route("/module_static/<path:path>", methods=["GET"])
 def module_static_file(path):
-    if custom_module is not None and hasattr(custom_module, "ModuleMessageController"):
-        message_controller = custom_module.ModuleMessageController(bot_username, config_file)
-    else:
-        message_controller = MessageController(bot_username, config_file)
     if message_controller.is_static_file(path):
         return message_controller.send_file(path)
     return BadRequest()
 
 
+def get_message_user(message: Message):
+    user_db = message_controller.character_persistent_class.get_user(message.from_user)
+    return LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(message.from_user, bot_username)
+
+
 @app.route("/incoming", methods=["POST"])
 def incoming():
     global kik_api
@@ -79,83 +90,111 @@ def incoming():
     :return: Response
     """
     # verify that this is a valid request
-    if not kik_api.verify_signature(
-            request.headers.get("X-Kik-Signature"), request.get_data()):
+    with metrics.timer("signature", Metrics.NO_COMMAND):
+        signature_valid = kik_api.verify_signature(request.headers.get("X-Kik-Signature"), request.get_data())
+    if not signature_valid:
         return Response(status=403)
 
     messages = messages_from_json(request.json["messages"])
-
+    # skip messages of a redelivered webhook, they were already processed
+    messages = [message for message in messages if not message_deduplicator.is_duplicate(message)]
+    messages = admit_messages(messages)
+
+    if profile_prefetch is True:
+        # the participants of a group are loaded before a command like ruser or Scanne-Active needs them
+        for message in messages:
+            if message.participants is not None and len(message.participants) > 1:
+                LazyKikUser.profile_refresher.prefetch(message.chat_id, message.participants)
+
+    # every chat has its own lane: messages of one chat are processed in order, different chats in parallel
+    if message_dispatcher.is_async():
+        # acknowledge the webhook immediately and let the workers process the messages and send the replies
+        for message in messages:
+            message_dispatcher.submit_message(message, process_message_in_background)
+        return Response(status=200)
+
+    futures = [message_dispatcher.submit_message(message, process_message_in_background, send=False) for message in messages]
     response_messages = []
+    for future in futures:
+        response_messages += future.result()
 
-    if custom_module is not None and hasattr(custom_module, "ModuleMessageController"):
-        message_controller = custom_module.ModuleMessageController(bot_username, config_file)
-    else:
-        message_controller = MessageController(bot_username, config_file)
+    message_sender.send(response_messages)
+    return Response(status=200)
 
+
+def admit_messages(messages: List[Message]):
+    admitted_messages = []
+    shed_messages = []
+    pending = message_dispatcher.pending()
     for message in messages:
-        # noinspection PyBroadException
-        try:
-            LazyKikUser.character_persistent_class = message_controller.character_persistent_class
-            user_db = message_controller.character_persistent_class.get_user(message.from_user)
-            user = LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(message.from_user, bot_username)
+        admission = rate_limiter.admit(message, MessageController.is_expensive_message(message), pending)
+        if admission == RateLimiter.ADMIT:
+            admitted_messages.append(message)
+            continue
+
+        # the message isn't processed - a redelivery of it may be
+        message_deduplicator.release(message)
+        if admission == RateLimiter.SHED:
             with force_locale(message_controller.get_config().get("BaseLanguage", "en")):
-                response_messages += message_controller.process_message(message, user)
-        except:
-            error_id = hashlib.md5((str(int(time.time())) + message.from_user).encode('utf-8')).hexdigest()
-            print("Message-Error: {error_id} ({bot_username})\n---\nTrace: {trace}\n---\nReq: {request}\n---\nResp: {response}".format(
-                error_id=error_id,
-                bot_username=bot_username,
-                trace=traceback.format_exc(),
-                request=json.dumps(message.__dict__, indent=4, sort_keys=True),
-                response=json.dumps(response_messages, default=lambda o: getattr(o, '__dict__', str(o)), indent=4, sort_keys=True)
-            ))
-
-            if isinstance(message, TextMessage) and len(message.body) < 100:
-                resp_keyboard = [MessageController.generate_text_response(message.body), MessageController.generate_text_response("Hilfe")]
-            else:
-                resp_keyboard = [MessageController.generate_text_response("Hilfe")]
-
-            response_messages += [TextMessage(
-                to=message.from_user,
-                chat_id=message.chat_id,
-                body=_("Leider ist ein Fehler aufgetreten. Bitte versuche es erneut.\n\n" +
-                     "Sollte der Fehler weiterhin auftreten, mach bitte einen Screenshot und sprich @{admin_user} per PM an.\n\n" +
-                     "Fehler-Informationen: {error_id}").format(
-                    error_id=error_id,
-                    admin_user=message_controller.get_config().get("Admins", "admin1").split(',')[0].strip()
-                ),
-                keyboards=[SuggestedResponseKeyboard(responses=resp_keyboard)]
-            )]
-
-        # noinspection PyBroadException
-        try:
-            kik_api.send_messages(response_messages)
-        except:
-            error_id = hashlib.md5((str(int(time.time()))).encode('utf-8')).hexdigest()
-            print("Kik-Send-Error: {error_id} ({bot_username})\n---\nTrace: {trace}\n---\nReq: {request}\n---\nResp: {response}".format(
-                error_id=error_id,
-                bot_username=bot_username,
-                trace=traceback.format_exc(),
-                request=json.dumps([m.__dict__ for m in messages], indent=4, sort_keys=True),
-                response=json.dumps(response_messages, default=lambda o: getattr(o, '__dict__', str(o)), indent=4, sort_keys=True)
-            ))
-            error_response_messages = []
-            for resp_message in response_messages: # type: Message
-                error_response_messages.append(TextMessage(
-                    to=resp_message.to,
-                    chat_id=resp_message.chat_id,
-                    body="Leider ist ein Fehler aufgetreten. Bitte versuche es erneut.\n\n"
-                     "Sollte der Fehler weiterhin auftreten, mach bitte einen Screenshot und sprich @{admin_user} per PM an.\n\n"
-                     "Fehler-Informationen: {error_id}".format(
-                        error_id=error_id,
-                        admin_user=message_controller.get_config().get("Admins", "admin1").split(',')[0].strip()
-                    ),
-                    keyboards=[SuggestedResponseKeyboard(responses=[MessageController.generate_text_response("Hilfe")])]
+                shed_messages.append(TextMessage(
+                    to=message.from_user,
+                    chat_id=message.chat_id,
+                    body=_("Du sendest gerade zu viele Befehle. Bitte warte einen Moment und versuche es dann erneut.")
                 ))
 
-            kik_api.send_messages(error_response_messages)
+    message_sender.send(shed_messages)
+    return admitted_messages
+
+
+def process_message_in_background(message: Message, send=True):
+    # flask_babel needs a request context to translate - the worker threads have none
+    with app.test_request_context():
+        response_messages = process_message(message)
+        if send is True:
+            message_sender.send(response_messages)
+    return response_messages
 
-    return Response(status=200)
+
+def process_message(message: Message):
+    # the label is refined by the controller once shortcuts like the arrows are resolved
+    metrics.set_command(MessageController.get_message_label(message))
+    # noinspection PyBroadException
+    try:
+        with metrics.timer("process"):
+            with metrics.timer("user_load"):
+                user = get_message_user(message)
+            with force_locale(message_controller.get_config().get("BaseLanguage", "en")):
+                response_messages = message_controller.process_message(message, user)
+        metrics.inc("kikbot_messages_total", {"command": metrics.get_command()})
+        message_deduplicator.mark_processed(message)
+        return response_messages
+    except:
+        metrics.inc("kikbot_message_errors_total", {"command": metrics.get_command()})
+        message_deduplicator.release(message)
+        error_id = hashlib.md5((str(int(time.time())) + message.from_user).encode('utf-8')).hexdigest()
+        print("Message-Error: {error_id} ({bot_username})\n---\nTrace: {trace}\n---\nReq: {request}".format(
+            error_id=error_id,
+            bot_username=bot_username,
+            trace=traceback.format_exc(),
+            request=json.dumps(message.__dict__, indent=4, sort_keys=True)
+        ))
+
+        if isinstance(message, TextMessage) and len(message.body) < 100:
+            resp_keyboard = [MessageController.generate_text_response(message.body), MessageController.generate_text_response("Hilfe")]
+        else:
+            resp_keyboard = [MessageController.generate_text_response("Hilfe")]
+
+        return [TextMessage(
+            to=message.from_user,
+            chat_id=message.chat_id,
+            body=_("Leider ist ein Fehler aufgetreten. Bitte versuche es erneut.\n\n" +
+                 "Sollte der Fehler weiterhin auftreten, mach bitte einen Screenshot und sprich @{admin_user} per PM an.\n\n" +
+                 "Fehler-Informationen: {error_id}").format(
+                error_id=error_id,
+                admin_user=message_controller.get_config().get("Admins", "admin1").split(',')[0].strip()
+            ),
+            keyboards=[SuggestedResponseKeyboard(responses=resp_keyboard)]
+        )]
 
 
 _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
@@ -213,18 +252,19 @@ class DebugMessageForm(Form):
             raise ValidationError('Wrong Password!')
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    allowed_ips = [ip.strip() for ip in message_controller.get_config().get("MetricsAllowedIPs", "127.0.0.1, ::1").split(",")]
+    if request.remote_addr not in allowed_ips:
+        return Response(status=403)
 
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/debug", methods=["GET", "POST"])
 def debug():
     global kik_api
 
-    if custom_module is not None and hasattr(custom_module, "ModuleMessageController"):
-        message_controller = custom_module.ModuleMessageController(bot_username, config_file)
-    else:
-        message_controller = MessageController(bot_username, config_file)
-
     log_requests = message_controller.get_config().get("LogRequests", "False")
     if app.debug is False and log_requests is not True and str(log_requests).lower() != "true":
         return Response(status=403)
@@ -331,9 +371,7 @@ def debug():
 
         if message is not None:
 
-            LazyKikUser.character_persistent_class = message_controller.character_persistent_class
-            user_db = message_controller.character_persistent_class.get_user(message.from_user)
-            user = LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(message.from_user, bot_username)
+            user = get_message_user(message)
             with force_locale(lang):
                 response_messages = message_controller.process_message(message, user)
                 print(json.dumps(response_messages, default=lambda o: getattr(o, '__dict__', str(o)), indent=4, sort_keys=True))
@@ -357,11 +395,6 @@ def debug():
 def web():
     global kik_api
 
-    if custom_module is not None and hasattr(custom_module, "ModuleMessageController"):
-        message_controller = custom_module.ModuleMessageController(bot_username, config_file)
-    else:
-        message_controller = MessageController(bot_username, config_file)
-
     log_requests = message_controller.get_config().get("LogRequests", "False")
     if app.debug is False and log_requests is not True and str(log_requests).lower() != "true":
         return Response(status=403)
@@ -401,9 +434,7 @@ def web():
         type_time=None
     )
 
-    LazyKikUser.character_persistent_class = message_controller.character_persistent_class
-    user_db = message_controller.character_persistent_class.get_user(message.from_user)
-    user = LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(message.from_user, bot_username)
+    user = get_message_user(message)
     with force_locale(lang):
         response_messages = message_controller.process_message(message, user)
         print(json.dumps(response_messages, default=lambda o: getattr(o, '__dict__', str(o)), indent=4, sort_keys=True))
@@ -453,15 +484,38 @@ if custom_module_name is not False and str(custom_module_name).lower() != "false
             bot_username=bot_username
         ))
 
-# prepare database
-if custom_module is not None and hasattr(custom_module, "ModuleCharacterPersistentClass"):
-    db_class = custom_module.ModuleCharacterPersistentClass(default_config, bot_username)
+# prepare database and the message controller - the controller is built once and shared by all requests of this process
+if custom_module is not None and hasattr(custom_module, "ModuleMessageController"):
+    message_controller = custom_module.ModuleMessageController(bot_username, config_file)
 else:
-    db_class = CharacterPersistentClass(default_config, bot_username)
-del db_class
+    message_controller = MessageController(bot_username, config_file)
+LazyKikUser.character_persistent_class = message_controller.character_persistent_class
+message_dispatcher = MessageDispatcher.init_from_config(default_config, bot_username)
+rate_limiter = RateLimiter.init_from_config(default_config, bot_username)
+message_deduplicator = MessageDeduplicator.init_from_config(default_config, message_controller.character_persistent_class, bot_username)
 
 kik_api = KikApi(bot_username, default_config.get("BotAuthCode", "abcdef01-2345-6789-abcd-ef0123456789"))
-LazyKikUser.kik_api = kik_api
+LazyKikUser.profile_cache = ProfileCache.init_from_config(default_config)
+LazyKikUser.profile_refresher = ProfileRefresher.init_from_config(default_config, kik_api, message_controller.character_persistent_class,
+                                                                  LazyKikUser.profile_cache, bot_username)
+message_sender = KikMessageSender(kik_api, message_controller.character_persistent_class, default_config, bot_username,
+                                  default_config.get("SendBatchWindow", "0"))
+message_controller.last_request_buffer = LastRequestBuffer.init_from_config(default_config, message_controller.character_persistent_class,
+                                                                          bot_username)
+message_controller.session_store = SessionStore.init_from_config(default_config, message_controller.character_persistent_class, bot_username)
+message_controller.picture_ingestor = PictureIngestor.init_from_config(default_config, message_controller.character_persistent_class,
+                                                                    message_sender, bot_username)
+profile_prefetch = default_config.get("ProfilePrefetch", "True")
+profile_prefetch = profile_prefetch is True or str(profile_prefetch).lower() == "true"
+# the exit handlers run in reverse order - the connections are closed after the last writes
+atexit.register(message_controller.character_persistent_class.connection_manager.close_all)
+atexit.register(LazyKikUser.profile_refresher.shutdown)
+atexit.register(message_controller.picture_ingestor.shutdown)
+atexit.register(message_sender.flush)
+atexit.register(message_controller.last_request_buffer.flush)
+atexit.register(message_controller.session_store.flush)
+# runs first: the acknowledged messages are processed before their replies and states are flushed
+atexit.register(message_dispatcher.shutdown)
 # For simplicity, we're going to set_configuration on startup. However, this really only needs to happen once
 # or if the configuration changes. In a production setting, you would only issue this call if you need to change
 # the configuration, and not every time the bot starts.
@@ -11,10 +11,15 @@ import copy
 from flask import send_file
 from bs4 import BeautifulSoup, NavigableString, Tag
 from modules.character_persistent_class import CharacterPersistentClass
+from modules.database_migration import Migration
 from modules.message_controller import MessageController, MessageCommand, MessageParam, CommandMessageResponse
 from datetime import timedelta
 
+QUEST_CONDITION_REGEX = re.compile(r"^(?P<func>[a-z_]+)\((?P<args>.*)\)$", re.IGNORECASE | re.MULTILINE)
+
+
 def parse_work_string(time_str, regex_str):
+    # the pattern comes from the config - re caches the compiled patterns itself
     regex = re.compile(regex_str)
     parts = regex.match(time_str.strip())
     if parts is None:
@@ -268,8 +273,39 @@ class CharacterStats:
 
 class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
+    def get_migrations(self):
+        migrations = super().get_migrations()
+        migrations["rpghelper"] = [
+            Migration(1, "Basis-Schema rpghelper", func=self.create_module_database),
+            Migration(2, "Indizes rpghelper", script=(
+                "CREATE INDEX IF NOT EXISTS character_stats_user_char ON character_stats (user_id COLLATE NOCASE, char_id);"
+                "CREATE INDEX IF NOT EXISTS character_work_user_char ON character_work (user_id, char_id, created);"
+                "CREATE INDEX IF NOT EXISTS character_money_transactions_user_char ON character_money_transactions (user_id, char_id);"
+                "CREATE INDEX IF NOT EXISTS character_quests_user_char ON character_quests (user_id, char_id, quest_id);"
+                "CREATE INDEX IF NOT EXISTS quest_parts_quest ON quest_parts (quest_id, part_num);"
+            )),
+            Migration(3, "Nutzer-Ids in Kleinbuchstaben rpghelper", script=(
+                "UPDATE character_stats SET user_id = lower(user_id);"
+                "UPDATE character_work SET user_id = lower(user_id);"
+                "UPDATE character_money_transactions SET user_id = lower(user_id);"
+                "UPDATE character_quests SET user_id = lower(user_id);"
+                "DROP INDEX IF EXISTS character_stats_user_char;"
+                "CREATE INDEX character_stats_user_char ON character_stats (user_id, char_id);"
+            )),
+        ]
+        return migrations
+
+    @staticmethod
+    def create_module_database(connection: sqlite3.Connection):
+        if Migration.table_exists(connection, "character_stats"):
+            return
+
+        sql_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rpghelper.sql")
+        Migration(0, "", script=open(sql_path, 'r').read()).apply(connection)
+
     def set_char_stat(self, user_id, stat_id, stat_points, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_first_char_id(user_id)
@@ -283,13 +319,14 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
         self.cursor.execute((
             "UPDATE character_stats "
             "SET {} = ? "
-            "WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
+            "WHERE user_id = ? AND char_id=? AND deleted IS NULL "
         ).format("stat_"+str(int(stat_id))), [stat_points, char["user_id"], char["char_id"]])
 
         return self.get_char_stats(char["user_id"], char["char_id"])
 
     def set_char_exp(self, user_id, exp, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_first_char_id(user_id)
@@ -303,7 +340,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
         self.cursor.execute((
             "UPDATE character_stats "
             "SET exp = ? "
-            "WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
+            "WHERE user_id = ? AND char_id=? AND deleted IS NULL "
         ), [exp, char["user_id"], char["char_id"]])
 
         return self.get_char_stats(char["user_id"], char["char_id"])
@@ -329,6 +366,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def get_char_stats(self, user_id, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_first_char_id(user_id)
@@ -336,7 +374,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
         self.cursor.execute((
             "SELECT * "
             "FROM character_stats "
-            "WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
+            "WHERE user_id = ? AND char_id=? AND deleted IS NULL "
             "LIMIT 1"
         ), [user_id, char_id])
 
@@ -388,6 +426,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def get_char_quests(self, user_id, char_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
         self.cursor.execute((
             "SELECT * "
             "FROM character_quests AS cq "
@@ -403,6 +442,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def get_char_quest(self, user_id, char_id, quest_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
         self.cursor.execute((
             "SELECT * "
             "FROM character_quests AS cq "
@@ -419,6 +459,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def accept_quest(self, user_id, char_id, quest_part, quest=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if quest is None:
             quest = self.get_quest(quest_part["quest_id"])
@@ -442,6 +483,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def set_char_quest_part(self, user_id, char_id, quest_part):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if int(quest_part["next_part_num"]) == -1:
             self.cursor.execute((
@@ -576,6 +618,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def start_work(self, user_id, char_id, job_id, difficulty):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "UPDATE character_work "
@@ -594,6 +637,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def current_work(self, user_id, char_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "SELECT * "
@@ -631,6 +675,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def receive_money(self, user_id, char_id, money, money_type=None, description=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "INSERT INTO character_money_transactions "
@@ -650,6 +695,7 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def get_balance(self, user_id, char_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "SELECT SUM(money) AS balance "
@@ -666,41 +712,46 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
 
     def move_char(self, from_user_id, to_user_id, from_char_id=None):
         self.connect_database()
+        from_user_id = self.normalize_user_id(from_user_id)
+        to_user_id = self.normalize_user_id(to_user_id)
 
         if from_char_id is None:
             from_char_id = self.get_min_char_id()
 
         to_char_id = CharacterPersistentClass.move_char(self, from_user_id, to_user_id, from_char_id)
+        if to_char_id is False:
+            return False
 
         data = (to_user_id, to_char_id, from_user_id, from_char_id)
         self.cursor.execute((
             "UPDATE character_stats "
             "SET user_id=?, char_id=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
             "UPDATE character_quests "
             "SET user_id=?, char_id=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
             "UPDATE character_money_transactions "
             "SET user_id=?, char_id=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
             "UPDATE character_work "
             "SET user_id=?, char_id=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         return to_char_id
 
     def remove_char(self, user_id, deletor_id, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_min_char_id()
@@ -711,19 +762,19 @@ class ModuleCharacterPersistentClass(CharacterPersistentClass):
         self.cursor.execute((
             "UPDATE character_stats "
             "SET deleted=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
             "UPDATE character_money_transactions "
             "SET deleted=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
             "UPDATE character_work "
             "SET deleted=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
 
         self.cursor.execute((
@@ -780,10 +831,9 @@ class ModuleMessageController(MessageController):
                 return importance
 
             conds = part["condition"].split("&")
-            regex = re.compile(r"^(?P<func>[a-z_]+)\((?P<args>.*)\)$", re.IGNORECASE | re.MULTILINE)
 
             for cond in conds:
-                match = regex.match(cond.strip())
+                match = QUEST_CONDITION_REGEX.match(cond.strip())
                 if match is None:
                     print("[{bot_username}] Quest: Syntax-Fehler in Condition '{cond}' im Quest {quest_id} Part {part_num}".format(
                         bot_username=self.bot_username,
@@ -2,13 +2,21 @@ import json
 import os
 import re
 import sqlite3
+import threading
 import time
 from mimetypes import guess_extension
 from pathlib import Path
 
 import requests
 
+from modules.database_connection import ConnectionManager
+from modules.database_migration import Migration, MigrationRunner
 from modules.kik_user import User
+from modules.metrics import TimedCursor
+
+
+CHAR_NAME_VALUE_REGEX = re.compile(r"^[^:\n]*name[^:\n]*:(.*)$", re.MULTILINE | re.IGNORECASE)
+CHAR_FIELD_REGEX = re.compile(r"^[ \t*_]*([^:\n*_][^:\n]{0,39}?)[ \t*_]*:(?!//)[ \t*_]*(\S[^\n]*?)[ \t*_]*$", re.MULTILINE)
 
 
 class CharacterPersistentClass:
@@ -18,25 +26,26 @@ class CharacterPersistentClass:
     STATUS_DYN_MESSAGES = 2
 
     def __init__(self, config, bot_username):
-        self.connection = None
-        self.cursor = None  # type: sqlite3.Cursor
+        self.local = threading.local()
         self.config = config
         self.bot_username = bot_username
         self.database_path = CharacterPersistentClass.get_database_path_from_config(config)
 
-        if not os.path.exists(self.database_path):
-            self.create_database()
+        self.migrate_database()
+        self.connection_manager = ConnectionManager.get(self.database_path, config)
 
-    def __del__(self):
-        if self.connection is not None:
-            self.connection.commit()
-            self.connection.close()
+    @property
+    def connection(self):
+        return self.connection_manager.get_connection(create=False)  # type: sqlite3.Connection
+
+    @property
+    def cursor(self):
+        return getattr(self.local, "cursor", None)  # type: sqlite3.Cursor
 
     def connect_database(self):
-        if self.connection is None:
-            self.connection = sqlite3.connect(self.database_path)
-            self.connection.row_factory = sqlite3.Row
-            self.cursor = self.connection.cursor()
+        # the instance is shared by all request threads - sqlite connections are not, so every thread gets its own one
+        if self.cursor is None:
+            self.local.cursor = self.connection_manager.get_connection().cursor(factory=TimedCursor)
 
     def commit(self):
         if self.connection is not None:
@@ -46,56 +55,74 @@ class CharacterPersistentClass:
     def get_min_char_id():
         return 1
 
+    @staticmethod
+    def normalize_user_id(user_id):
+        # kik user ids are case insensitive - they are stored and compared in lower case to use the indexes
+        return user_id.lower() if user_id is not None else None
+
     @staticmethod
     def get_database_path_from_config(config):
         return config.get("DatabasePath", "{home}/database.db").format(home=str(Path.home()))
 
     def get_next_fee_char_id(self, user_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
+        # the ids of deleted characters stay taken, their heads are kept as deleted
         self.cursor.execute((
-            "SELECT char_id "
-            "FROM characters "
-            "WHERE user_id=? "
-            "ORDER BY char_id "
-            "LIMIT 1 "
-        ), [user_id])
-
-        min_char_id = self.cursor.fetchone()
-        if min_char_id is None or int(min_char_id['char_id']) != self.get_min_char_id():
-            return self.get_min_char_id()
-
-        self.cursor.execute((
-            "SELECT char_id + 1 AS new_char_id "
-            "FROM characters ch "
-            "WHERE NOT EXISTS ( "
-            "    SELECT  NULL "
-            "    FROM    characters mi "
-            "    WHERE   mi.char_id = ch.char_id + 1 AND mi.user_id=ch.user_id"
-            ") AND ch.user_id=?"
-            "ORDER BY char_id "
-            "LIMIT 1 "
-        ), [user_id])
+            "SELECT CASE WHEN NOT EXISTS ("
+            "        SELECT NULL FROM character_heads WHERE user_id = ?1 AND char_id = ?2"
+            "    ) THEN ?2 ELSE ("
+            "        SELECT MIN(h.char_id) + 1 "
+            "        FROM character_heads AS h "
+            "        WHERE h.user_id = ?1 AND h.char_id >= ?2 AND NOT EXISTS ("
+            "            SELECT NULL FROM character_heads AS n WHERE n.user_id = h.user_id AND n.char_id = h.char_id + 1"
+            "        )"
+            "    ) END AS new_char_id"
+        ), [user_id, self.get_min_char_id()])
+
+        return int(self.cursor.fetchone()['new_char_id'])
+
+    def allocate_char_id(self, user_id, attempts=5):
+        """
+        Reserves the next free char_id with a placeholder head. If a parallel worker took the same id,
+        the primary key of the head fails and the next free id is tried.
 
-        next_free_char_id = self.cursor.fetchone()
-        if next_free_char_id is None:
-            return self.get_min_char_id()
-        return int(next_free_char_id['new_char_id'])
+        :rtype: int
+        """
+        for attempt in range(0, attempts):
+            char_id = self.get_next_fee_char_id(user_id)
+            try:
+                # the placeholder is replaced by the trigger as soon as a version of the character is written
+                self.cursor.execute((
+                    "INSERT INTO character_heads "
+                    "(user_id, char_id, deleted) "
+                    "VALUES (?, ?, ?)"
+                ), [user_id, char_id, int(time.time())])
+                return char_id
+            except sqlite3.IntegrityError:
+                if attempt == attempts - 1:
+                    raise
 
     def add_char(self, user_id, creator_id, text):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        creator_id = self.normalize_user_id(creator_id)
 
-        next_char_id = self.get_next_fee_char_id(user_id)
+        next_char_id = self.allocate_char_id(user_id)
         data = (user_id, next_char_id, text, creator_id, int(time.time()))
         self.cursor.execute((
             "INSERT INTO characters "
             "(user_id, char_id, text, creator_id, created) "
             "VALUES (?, ?, ?, ?, ?)"
         ), data)
+        self.update_char_indexes(user_id)
         return next_char_id
 
     def change_char(self, user_id, creator_id, text, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        creator_id = self.normalize_user_id(creator_id)
 
         if char_id is None:
             char_id = self.get_min_char_id()
@@ -109,9 +136,18 @@ class CharacterPersistentClass:
             "(user_id, char_id, text, creator_id, created) "
             "VALUES (?, ?, ?, ?, ?)"
         ), data)
+        self.update_char_indexes(user_id)
 
-    def set_char_pic(self, user_id, creator_id, pic_url, char_id=None):
+    def set_char_pic(self, user_id, creator_id, pic_url, char_id=None, http_session=None, timeout=None, max_size=None):
+        """
+        Downloads the picture and sets it for the character. Pictures larger than max_size bytes are rejected.
+
+        :type http_session: requests.Session
+        :rtype: bool
+        """
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        creator_id = self.normalize_user_id(creator_id)
 
         timestamp = int(time.time())
 
@@ -120,31 +156,40 @@ class CharacterPersistentClass:
 
         picture_path = self.config.get("PicturePath", "{home}/pictures").format(home=str(Path.home()))
         file_wo_ext = "{}/{}-{}-{}-{}".format(picture_path, user_id, creator_id, char_id, timestamp)
-        file_tmp = file_wo_ext + ".tmp"
-        with open(file_tmp, 'wb') as handle:
-            response = requests.get(pic_url, stream=True)
-
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-
-                handle.write(block)
-
-        handle.close()
-
-        if response.status_code != 200:
-            os.remove(file_tmp)
-            return False
-
+        # pictures of the same character can be downloaded at the same time
+        file_tmp = "{}-{}.tmp".format(file_wo_ext, threading.get_ident())
+        http_session = http_session if http_session is not None else requests
         try:
-            ext = guess_extension(response.headers['content-type'].split()[0].rstrip(";"))
-        except KeyError:
-            ext = ".jpg"
-
-        if ext == ".jpe":
-            ext = ".jpg"
-
-        os.rename(file_tmp, file_wo_ext + ext)
+            with http_session.get(pic_url, stream=True, timeout=timeout) as response:
+                if response.status_code != 200:
+                    return False
+                if max_size is not None and int(response.headers.get("content-length", 0)) > max_size:
+                    return False
+
+                size = 0
+                with open(file_tmp, 'wb') as handle:
+                    for block in response.iter_content(64 * 1024):
+                        size += len(block)
+                        if max_size is not None and size > max_size:
+                            break
+                        handle.write(block)
+
+                content_type = response.headers.get("content-type")
+
+            if max_size is not None and size > max_size:
+                return False
+
+            ext = guess_extension(content_type.split()[0].rstrip(";")) if content_type is not None else ".jpg"
+            if ext is None or ext == ".jpe":
+                ext = ".jpg"
+
+            os.rename(file_tmp, file_wo_ext + ext)
+        except requests.RequestException:
+            return False
+        finally:
+            # the file is only left if the download failed, e.g. the connection dropped or the disk is full
+            if os.path.exists(file_tmp):
+                os.remove(file_tmp)
 
         data = (user_id, char_id, file_wo_ext + ext, creator_id, int(time.time()))
         self.cursor.execute((
@@ -157,23 +202,33 @@ class CharacterPersistentClass:
 
     def move_char(self, from_user_id, to_user_id, from_char_id=None):
         self.connect_database()
+        from_user_id = self.normalize_user_id(from_user_id)
+        to_user_id = self.normalize_user_id(to_user_id)
 
         if from_char_id is None:
             from_char_id = self.get_min_char_id()
 
-        to_char_id = self.get_next_fee_char_id(to_user_id)
+        # the id is reserved with a head - nothing may be reserved for a character which doesn't exist
+        if self.get_char(from_user_id, from_char_id) is None:
+            return False
+
+        to_char_id = self.allocate_char_id(to_user_id)
 
         data = (to_user_id, to_char_id, from_user_id, from_char_id)
         self.cursor.execute((
             "UPDATE characters "
             "SET user_id=?, char_id=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
+        self.update_char_indexes(from_user_id)
+        self.update_char_indexes(to_user_id)
 
         return to_char_id
 
     def remove_char(self, user_id, deletor_id, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        deletor_id = self.normalize_user_id(deletor_id)
 
         if char_id is None:
             char_id = self.get_min_char_id()
@@ -185,11 +240,14 @@ class CharacterPersistentClass:
         self.cursor.execute((
             "UPDATE characters "
             "SET deletor_id=?, deleted=? "
-            "WHERE user_id LIKE ? AND char_id=?"
+            "WHERE user_id = ? AND char_id=?"
         ), data)
+        self.update_char_indexes(user_id)
 
     def remove_last_char_change(self, user_id, deletor_id, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        deletor_id = self.normalize_user_id(deletor_id)
 
         if char_id is None:
             char_id = self.get_min_char_id()
@@ -202,20 +260,20 @@ class CharacterPersistentClass:
             "UPDATE characters "
             "SET deletor_id=?, deleted=? "
             "WHERE id = ("
-            "    SELECT id "
-            "    FROM characters "
-            "    WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
-            "    ORDER BY created DESC "
-            "    LIMIT 1"
+            "    SELECT version_id "
+            "    FROM character_heads "
+            "    WHERE user_id = ? AND char_id=? AND deleted IS NULL"
             ")"
         ), data)
+        self.update_char_indexes(user_id)
 
     def get_first_char_id(self, user_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
-            "SELECT MIN(char_id) AS min_char_id " 
-            "  FROM  characters " 
+            "SELECT MIN(char_id) AS min_char_id "
+            "  FROM  character_heads "
             "  WHERE user_id = ? AND deleted IS NULL "
         ), [user_id])
 
@@ -226,38 +284,30 @@ class CharacterPersistentClass:
 
     def get_char(self, user_id, char_id=None):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_first_char_id(user_id)
 
         self.cursor.execute((
-            "SELECT id, user_id, char_id, text, creator_id, created, "
-            "    (SELECT MIN(char_id) "
-            "        FROM  characters AS c1 "
-            "        WHERE c1.user_id = c.user_id AND c1.deleted IS NULL AND c1.char_id > c.char_id) AS next_char_id, "
-            "    (SELECT MAX(char_id) "
-            "        FROM  characters AS c2 "
-            "        WHERE c2.user_id = c.user_id AND c2.deleted IS NULL AND c2.char_id < c.char_id) AS prev_char_id "
-            "FROM  characters AS c "
-            "WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
-            "ORDER BY created DESC "
-            "LIMIT 1"
+            "SELECT version_id AS id, user_id, char_id, text, creator_id, created, next_char_id, prev_char_id "
+            "FROM  character_heads "
+            "WHERE user_id = ? AND char_id=? AND deleted IS NULL"
         ), [user_id, char_id])
 
         return self.cursor.fetchone()
 
     def get_char_pic_url(self, user_id, char_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         if char_id is None:
             char_id = self.get_first_char_id(user_id)
 
         self.cursor.execute((
-            "SELECT picture_filename, active "
-            "FROM  character_pictures "
-            "WHERE user_id LIKE ? AND char_id=? AND deleted IS NULL "
-            "ORDER BY created DESC "
-            "LIMIT 1"
+            "SELECT picture_filename, picture_active AS active "
+            "FROM  character_heads "
+            "WHERE user_id = ? AND char_id=? AND picture_filename IS NOT NULL"
         ), [user_id, char_id])
 
         pic_data = self.cursor.fetchone()
@@ -275,96 +325,260 @@ class CharacterPersistentClass:
 
     def get_all_user_chars(self, user_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
-            "SELECT id, char_id, text, creator_id, MAX(created) AS created "
-            "FROM characters "
-            "WHERE user_id LIKE ? AND deleted IS NULL "
-            "GROUP BY char_id"
+            "SELECT version_id AS id, char_id, text, creator_id, created "
+            "FROM character_heads "
+            "WHERE user_id = ? AND deleted IS NULL "
+            "ORDER BY char_id"
         ), [user_id])
         chars = self.cursor.fetchall()
         return chars
 
-    def list_all_users_with_chars(self, page=1, limit=15, list_all=False):
+    def list_all_users_with_chars(self, page=1, limit=15, list_all=False, after=None, before=None):
+        """
+        Lists the users with characters, the last changed first. A page is either given by its number or by a cursor:
+        after/before are the [last_change, user_id] of the last/first entry of the neighbour page.
+        Returns up to limit + 1 rows, the additional row shows there are more.
+
+        :rtype: list[sqlite3.Row]
+        """
         self.connect_database()
 
         query = (
-            "SELECT id, user_id, MAX(char_id) AS chars_cnt, created "
-            "FROM characters "
-            "WHERE deleted IS NULL "
-            "GROUP BY user_id "
-            "ORDER BY created DESC "
+            "SELECT user_id, chars_cnt, last_change AS created "
+            "FROM user_char_summary "
         )
 
-        if list_all is False:
-            query += "LIMIT ?,? "
-
-        self.cursor.execute(query, [(page - 1) * limit, limit + 1] if list_all is False else [])
+        if list_all is True:
+            self.cursor.execute(query + "ORDER BY last_change DESC, user_id DESC")
+            return self.cursor.fetchall()
+
+        if after is not None:
+            self.cursor.execute(query + (
+                "WHERE (last_change, user_id) < (?, ?) "
+                "ORDER BY last_change DESC, user_id DESC "
+                "LIMIT ?"
+            ), [after[0], after[1], limit + 1])
+            return self.cursor.fetchall()
+
+        if before is not None:
+            self.cursor.execute(query + (
+                "WHERE (last_change, user_id) > (?, ?) "
+                "ORDER BY last_change ASC, user_id ASC "
+                "LIMIT ?"
+            ), [before[0], before[1], limit + 1])
+            return list(reversed(self.cursor.fetchall()))
+
+        self.cursor.execute(query + (
+            "ORDER BY last_change DESC, user_id DESC "
+            "LIMIT ?,?"
+        ), [(page - 1) * limit, limit + 1])
         return self.cursor.fetchall()
 
     def find_char(self, name, user_id):
+        return self.search_char(name, user_id=user_id)
+
+    @staticmethod
+    def normalize_field_value(value):
+        return " ".join(value.lower().split())
+
+    @staticmethod
+    def get_field_key(field_norm):
+        # Vorname, Nachname, Spitzname, ... are all found as "name"
+        return "name" if "name" in field_norm else field_norm
+
+    @staticmethod
+    def parse_char_fields(text):
+        """
+        The "Key: value" lines of a character sheet as (field, value) in the order of the text.
+
+        :rtype: list[tuple[str, str]]
+        """
+        return [(field.strip(), value.strip()) for field, value in CHAR_FIELD_REGEX.findall(text)]
+
+    @staticmethod
+    def get_char_names(text):
+        return "\n".join(value.strip() for value in CHAR_NAME_VALUE_REGEX.findall(text))
+
+    @staticmethod
+    def get_search_match_query(query, column):
+        # every word of the query has to be found as prefix of a word of the column
+        words = ["\"{}\"*".format(word.replace("\"", "\"\"")) for word in query.split()]
+        return "{column} : ({words})".format(column=column, words=" AND ".join(words))
+
+    def search_char(self, query, query_key="name", user_id=None, limit=None, offset=0):
+        """
+        Searches the current versions of the characters, the best matches first. With query_key "name" only
+        the name lines of the characters are searched, else the whole text.
+
+        :rtype: list[sqlite3.Row]
+        """
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
-        self.cursor.execute((
-            "SELECT id, char_id, text, creator_id, MAX(created) AS created "
-            "FROM characters "
-            "WHERE user_id=? AND deleted IS NULL AND text LIKE ? "
-            "GROUP BY user_id, char_id"
-        ), [user_id, "%"+name+"%"])
-        chars_raw = self.cursor.fetchall()
-        chars = []
-
-        for char in chars_raw:
-            if re.search(r".*?name(.*?):[^a-z]*?{}[^a-z]*?".format(re.escape(name)), char['text'], re.MULTILINE+re.IGNORECASE) is not None:
-                chars.append(char)
+        if query.strip() == "":
+            return []
 
-        return chars
+        sql = (
+            "SELECT h.version_id AS id, h.user_id, h.char_id, h.text, h.creator_id, h.created, h.prev_char_id, h.next_char_id "
+            "FROM character_search AS s "
+            "JOIN character_search_keys AS k ON k.search_id = s.rowid "
+            "JOIN character_heads AS h ON h.user_id = k.user_id AND h.char_id = k.char_id "
+            "WHERE character_search MATCH ? AND h.deleted IS NULL "
+        )
+        params = [self.get_search_match_query(query, "names" if query_key == "name" else "text")]
+
+        if user_id is not None:
+            sql += "AND k.user_id = ? "
+            params.append(user_id)
+
+        sql += "ORDER BY bm25(character_search, 10.0, 1.0) "
+        if limit is not None:
+            sql += "LIMIT ? OFFSET ?"
+            params += [limit, offset]
+
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def find_chars_by_field(self, field, value, user_id=None, limit=None, offset=0):
+        """
+        Finds the current versions of the characters with a field of the value, e.g. "Wesen" = "Vampir".
+        The field "name" matches all name fields (Vorname, Nachname, ...).
 
-    def search_char(self, query, query_key="name", user_id=None):
+        :rtype: list[sqlite3.Row]
+        """
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        field_norm = self.normalize_field_value(field)
+        column = "field_key" if field_norm == "name" else "field_norm"
+
+        sql = (
+            "SELECT h.version_id AS id, h.user_id, h.char_id, h.text, h.creator_id, h.created, h.prev_char_id, h.next_char_id "
+            "FROM character_heads AS h "
+            "WHERE h.deleted IS NULL AND EXISTS ("
+            "    SELECT 1 FROM character_fields AS f "
+            "    WHERE f.{column} = ? AND f.value_norm = ? AND f.user_id = h.user_id AND f.char_id = h.char_id"
+            ") "
+        ).format(column=column)
+        params = [field_norm, self.normalize_field_value(value)]
+
+        if user_id is not None:
+            sql += "AND h.user_id = ? "
+            params.append(user_id)
+
+        sql += "ORDER BY h.created DESC, h.user_id, h.char_id "
+        if limit is not None:
+            sql += "LIMIT ? OFFSET ?"
+            params += [limit, offset]
+
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
 
-        if user_id is None:
-            self.cursor.execute((
-                "SELECT id, user_id, char_id, text, creator_id, MAX(created) AS created "
-                "FROM characters "
-                "WHERE deleted IS NULL AND text LIKE ? "
-                "GROUP BY user_id, char_id"
-            ), ["%"+query+"%"])
+    def is_char_field(self, field):
+        """
+        Whether any current character has the field - "name" is true for all name fields.
 
-        else:
-            self.cursor.execute((
-                "SELECT id, user_id, char_id, text, creator_id, MAX(created) AS created "
-                "FROM characters "
-                "WHERE deleted IS NULL AND user_id=? AND text LIKE ? "
-                "GROUP BY user_id, char_id"
-            ), [user_id, "%" + query + "%"])
+        :rtype: bool
+        """
+        self.connect_database()
+        field_norm = self.normalize_field_value(field)
+        column = "field_key" if field_norm == "name" else "field_norm"
 
-        chars_raw = self.cursor.fetchall()
-        chars = []
+        self.cursor.execute("SELECT EXISTS (SELECT 1 FROM character_fields WHERE {column} = ?) AS found".format(column=column), [field_norm])
+        return self.cursor.fetchone()["found"] == 1
 
-        for char in chars_raw:
-            if re.search(r".*?{}(.*?):[^a-z]*?{}[^a-z]*?".format(re.escape(query_key), re.escape(query)), char['text'], re.MULTILINE | re.IGNORECASE) is not None:
-                chars.append(char)
+    def get_char_fields(self, user_id, field_key=None):
+        """
+        The fields of the current characters of the user, ordered by char_id and their position in the sheet.
 
-        return chars
+        :rtype: list[sqlite3.Row]
+        """
+        self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+
+        sql = "SELECT char_id, position, field, field_key, value FROM character_fields WHERE user_id = ? "
+        params = [user_id]
+        if field_key is not None:
+            sql += "AND field_key = ? "
+            params.append(field_key)
+        sql += "ORDER BY char_id, position"
+
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def update_char_indexes(self, user_id):
+        """
+        Parses the current characters of the user into character_fields and rebuilds their search rows.
+        """
+        self.connect_database()
+        user_id = self.normalize_user_id(user_id)
+        self.refresh_char_fields_rows(self.cursor, user_id)
+        self.refresh_char_search_rows(self.cursor, user_id)
+
+    @staticmethod
+    def refresh_char_fields_rows(cursor: sqlite3.Cursor, user_id):
+        cursor.execute("DELETE FROM character_fields WHERE user_id = ?", [user_id])
+
+        cursor.execute("SELECT char_id, text FROM character_heads WHERE user_id = ? AND deleted IS NULL", [user_id])
+        rows = []
+        for head in cursor.fetchall():
+            for position, (field, value) in enumerate(CharacterPersistentClass.parse_char_fields(head[1])):
+                field_norm = CharacterPersistentClass.normalize_field_value(field)
+                rows.append([
+                    user_id, head[0], position, field, field_norm, CharacterPersistentClass.get_field_key(field_norm),
+                    value, CharacterPersistentClass.normalize_field_value(value)
+                ])
+
+        cursor.executemany((
+            "INSERT INTO character_fields (user_id, char_id, position, field, field_norm, field_key, value, value_norm) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        ), rows)
+
+    @staticmethod
+    def refresh_char_search_rows(cursor: sqlite3.Cursor, user_id):
+        cursor.execute((
+            "DELETE FROM character_search "
+            "WHERE rowid IN (SELECT search_id FROM character_search_keys WHERE user_id = ?)"
+        ), [user_id])
+
+        # the names are taken from the parsed fields - the text isn't scanned again
+        cursor.execute((
+            "SELECT h.char_id, h.text, ("
+            "    SELECT group_concat(f.value, char(10)) FROM character_fields AS f "
+            "    WHERE f.user_id = h.user_id AND f.char_id = h.char_id AND f.field_key = 'name'"
+            ") "
+            "FROM character_heads AS h "
+            "WHERE h.user_id = ? AND h.deleted IS NULL"
+        ), [user_id])
+        for head in cursor.fetchall():
+            cursor.execute("INSERT OR IGNORE INTO character_search_keys (user_id, char_id) VALUES (?, ?)", [user_id, head[0]])
+            cursor.execute("SELECT search_id FROM character_search_keys WHERE user_id = ? AND char_id = ?", [user_id, head[0]])
+            search_id = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO character_search (rowid, names, text) VALUES (?, ?, ?)",
+                [search_id, head[2] or "", head[1]]
+            )
 
     def update_user(self, user: User, as_request=True):
         self.connect_database()
+        user_id = self.normalize_user_id(user["user_id"])
 
         if user.get_db_id() is None:
             self.cursor.execute((
                 "INSERT INTO users "
                 "(user_id, bot_id, first_name, last_name, is_user_id, is_char_id, status, authed_since, authed_by, is_admin, last_request, created) "
                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
-            ), [user["user_id"],
+            ), [user_id,
                 self.bot_username,
                 user["first_name"],
                 user["last_name"],
-                user["is_user_id"],
+                self.normalize_user_id(user["is_user_id"]),
                 user["is_char_id"],
                 user["status"],
                 user["authed_since"],
-                user["authed_by"],
+                self.normalize_user_id(user["authed_by"]),
                 user["is_admin"],
                 int(time.time()) if as_request is True else user["last_request"],
                 int(time.time())])
@@ -380,20 +594,35 @@ class CharacterPersistentClass:
                 "    authed_by = ?, "
                 "    is_admin = ?, "
                 "    last_request = ? "
-                "WHERE user_id LIKE ? AND bot_id LIKE ?"
-            ), [user["first_name"], user["last_name"], user["is_user_id"], user["is_char_id"], user["status"], user["authed_since"], user["authed_by"],
-                user["is_admin"], int(time.time()) if as_request is True else user["last_request"], user["user_id"], self.bot_username])
+                "WHERE user_id = ? AND bot_id = ?"
+            ), [user["first_name"], user["last_name"], self.normalize_user_id(user["is_user_id"]), user["is_char_id"], user["status"], user["authed_since"],
+                self.normalize_user_id(user["authed_by"]), user["is_admin"], int(time.time()) if as_request is True else user["last_request"], user_id,
+                self.bot_username])
 
+    def set_users_last_request(self, last_requests):
+        """
+        Writes the last requests of several users in one transaction - an older value never overwrites a newer one.
+
+        :type last_requests: dict[str, int]
+        """
+        self.connect_database()
 
+        self.cursor.executemany((
+            "UPDATE users "
+            "SET last_request = MAX(COALESCE(last_request, 0), ?) "
+            "WHERE user_id = ? AND bot_id = ?"
+        ), [[timestamp, self.normalize_user_id(user_id), self.bot_username] for user_id, timestamp in last_requests.items()])
+        self.commit()
 
     def get_user(self, user_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "SELECT * "
             "FROM users "
-            "WHERE user_id LIKE ? AND "
-            "    bot_id LIKE ? "
+            "WHERE user_id = ? AND "
+            "    bot_id = ? "
             "LIMIT 1"
         ), [user_id, self.bot_username])
 
@@ -401,17 +630,61 @@ class CharacterPersistentClass:
 
     def get_kik_user(self, user_id):
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "SELECT * "
             "FROM kik_user_response "
-            "WHERE user_id LIKE ? "
+            "WHERE user_id = ? "
             "ORDER BY created DESC "
             "LIMIT 1"
         ), [user_id])
 
         return self.cursor.fetchone()
 
+    def get_users(self, user_ids):
+        """
+        Loads several users with one query.
+
+        :rtype: dict[str, sqlite3.Row]
+        """
+        self.connect_database()
+        user_ids = list(set(self.normalize_user_id(user_id) for user_id in user_ids))
+        if len(user_ids) == 0:
+            return {}
+
+        self.cursor.execute((
+            "SELECT * "
+            "FROM users "
+            "WHERE bot_id = ? AND user_id IN ({})"
+        ).format(", ".join("?" * len(user_ids))), [self.bot_username] + user_ids)
+
+        return {row["user_id"]: row for row in self.cursor.fetchall()}
+
+    def get_kik_users(self, user_ids):
+        """
+        Loads the newest profile of several users with one query.
+
+        :rtype: dict[str, sqlite3.Row]
+        """
+        self.connect_database()
+        user_ids = list(set(self.normalize_user_id(user_id) for user_id in user_ids))
+        if len(user_ids) == 0:
+            return {}
+
+        self.cursor.execute((
+            "SELECT r.* "
+            "FROM kik_user_response AS r "
+            "WHERE r.user_id IN ({}) AND r.id = ("
+            "    SELECT r2.id FROM kik_user_response AS r2 "
+            "    WHERE r2.user_id = r.user_id "
+            "    ORDER BY r2.created DESC, r2.id DESC "
+            "    LIMIT 1"
+            ")"
+        ).format(", ".join("?" * len(user_ids))), user_ids)
+
+        return {row["user_id"]: row for row in self.cursor.fetchall()}
+
     def add_kik_user_data(self, user_id, kik_user):
         """
 
@@ -419,6 +692,7 @@ class CharacterPersistentClass:
         :type kik_user: kik.User
         """
         self.connect_database()
+        user_id = self.normalize_user_id(user_id)
 
         self.cursor.execute((
             "INSERT INTO kik_user_response "
@@ -443,7 +717,7 @@ class CharacterPersistentClass:
             self.cursor.execute((
                 "UPDATE static_messages "
                 "SET response = ? "
-                "WHERE command LIKE ? "
+                "WHERE command = ? COLLATE NOCASE "
             ), [response, command])
 
         return self.get_static_message(command)
@@ -456,7 +730,7 @@ class CharacterPersistentClass:
             self.cursor.execute((
                 "UPDATE static_messages "
                 "SET response_keyboards = ? "
-                "WHERE command LIKE ? "
+                "WHERE command = ? COLLATE NOCASE "
             ), [json.dumps(keyboard), command])
 
         return self.get_static_message(command)
@@ -469,7 +743,7 @@ class CharacterPersistentClass:
             self.cursor.execute((
                 "UPDATE static_messages "
                 "SET alt_commands = ? "
-                "WHERE command LIKE ? "
+                "WHERE command = ? COLLATE NOCASE "
             ), [json.dumps(alt_commands), command])
 
         return self.get_static_message(command)
@@ -480,12 +754,163 @@ class CharacterPersistentClass:
         self.cursor.execute((
             "SELECT * "
             "FROM static_messages "
-            "WHERE command LIKE ? OR alt_commands LIKE ? "
+            "WHERE command = ? COLLATE NOCASE "
             "LIMIT 1"
-        ), [command, "%\""+command+"\"%"])
+        ), [command])
+
+        static_message = self.cursor.fetchone()
+        if static_message is not None:
+            return static_message
+
+        # the aliases are only stored as json list - they are searched only if no command matches
+        self.cursor.execute((
+            "SELECT * "
+            "FROM static_messages "
+            "WHERE alt_commands LIKE ? ESCAPE '\\' "
+            "LIMIT 1"
+        ), ["%\"" + command.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "\"%"])
 
         return self.cursor.fetchone()
 
+    def add_outbox_messages(self, messages):
+        """
+
+        :type messages: list[kik.messages.Message]
+        """
+        self.connect_database()
+
+        created = time.time()
+        self.cursor.executemany((
+            "INSERT INTO kik_outbox "
+            "(bot_id, user_id, message, created, next_attempt) "
+            "VALUES (?, ?, ?, ?, ?) "
+        ), [[self.bot_username, str(message.to).lower(), json.dumps(message.to_json()), created, created] for message in messages])
+        self.commit()
+
+    def get_pending_outbox_messages(self, limit=250):
+        self.connect_database()
+
+        self.cursor.execute((
+            "SELECT * "
+            "FROM kik_outbox "
+            "WHERE bot_id = ? AND "
+            "    sent IS NULL AND "
+            "    failed IS NULL "
+            "ORDER BY id "
+            "LIMIT ?"
+        ), [self.bot_username, limit])
+
+        return self.cursor.fetchall()
+
+    def set_outbox_messages_sent(self, outbox_ids):
+        self.connect_database()
+
+        self.cursor.executemany((
+            "UPDATE kik_outbox "
+            "SET sent = ? "
+            "WHERE id = ?"
+        ), [[int(time.time()), outbox_id] for outbox_id in outbox_ids])
+        self.commit()
+
+    def set_outbox_message_retry(self, outbox_id, attempts, next_attempt, error, failed=False):
+        self.connect_database()
+
+        self.cursor.execute((
+            "UPDATE kik_outbox "
+            "SET attempts = ?, "
+            "    next_attempt = ?, "
+            "    last_error = ?, "
+            "    failed = ? "
+            "WHERE id = ?"
+        ), [attempts, next_attempt, error, int(time.time()) if failed else None, outbox_id])
+        self.commit()
+
+    def remove_sent_outbox_messages(self, older_than):
+        self.connect_database()
+
+        self.cursor.execute((
+            "DELETE FROM kik_outbox "
+            "WHERE bot_id = ? AND "
+            "    sent IS NOT NULL AND "
+            "    sent < ?"
+        ), [self.bot_username, older_than])
+        self.commit()
+
+    def is_processed_message(self, message_id):
+        self.connect_database()
+
+        self.cursor.execute((
+            "SELECT 1 "
+            "FROM processed_messages "
+            "WHERE message_id = ? AND bot_id = ?"
+        ), [message_id, self.bot_username])
+
+        return self.cursor.fetchone() is not None
+
+    def add_processed_message(self, message_id):
+        """
+        Remembers the message id as processed.
+
+        :return: False if the message was processed already
+        :rtype: bool
+        """
+        self.connect_database()
+
+        self.cursor.execute((
+            "INSERT OR IGNORE INTO processed_messages "
+            "(message_id, bot_id, created) "
+            "VALUES (?, ?, ?) "
+        ), [message_id, self.bot_username, int(time.time())])
+        added = self.cursor.rowcount == 1
+        self.commit()
+
+        return added
+
+    def remove_processed_messages(self, older_than):
+        self.connect_database()
+
+        self.cursor.execute((
+            "DELETE FROM processed_messages "
+            "WHERE bot_id = ? AND "
+            "    created < ?"
+        ), [self.bot_username, older_than])
+        self.commit()
+
+    def get_session(self, user_id, chat_id, updated_since):
+        self.connect_database()
+
+        self.cursor.execute((
+            "SELECT state, updated "
+            "FROM sessions "
+            "WHERE bot_id = ? AND user_id = ? AND chat_id = ? AND updated >= ?"
+        ), [self.bot_username, self.normalize_user_id(user_id), chat_id, updated_since])
+
+        return self.cursor.fetchone()
+
+    def set_sessions(self, sessions):
+        """
+
+        :type sessions: list[tuple[str, str, str, int]]
+        """
+        self.connect_database()
+
+        self.cursor.executemany((
+            "INSERT OR REPLACE INTO sessions "
+            "(bot_id, user_id, chat_id, state, updated) "
+            "VALUES (?, ?, ?, ?, ?)"
+        ), [[self.bot_username, self.normalize_user_id(user_id), chat_id, state, updated] for user_id, chat_id, state, updated in sessions])
+        self.commit()
+
+    def remove_sessions(self, older_than):
+        self.connect_database()
+
+        self.cursor.execute((
+            "DELETE FROM sessions "
+            "WHERE bot_id = ? AND "
+            "    updated < ?"
+        ), [self.bot_username, older_than])
+        self.commit()
+
     def get_all_static_messages(self):
         self.connect_database()
 
@@ -496,13 +921,339 @@ class CharacterPersistentClass:
 
         return self.cursor.fetchall()
 
-    def create_database(self):
-        print("Datenbank {} nicht vorhanden - Datenbank wird anglegt.".format(os.path.basename(self.database_path)))
-        connection = sqlite3.connect(self.database_path)
+    def get_migrations(self):
+        """
+        The migrations of each scope, custom modules add their own scope.
+
+        :rtype: dict[str, list[Migration]]
+        """
+        return {
+            "core": [
+                Migration(1, "Basis-Schema", func=self.create_database),
+                Migration(2, "Postausgang und verarbeitete Nachrichten", script=(
+                    "CREATE TABLE IF NOT EXISTS kik_outbox ("
+                    "    id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    "    bot_id TEXT NOT NULL,"
+                    "    user_id TEXT NOT NULL,"
+                    "    message TEXT NOT NULL,"
+                    "    attempts INTEGER DEFAULT 0 NOT NULL,"
+                    "    next_attempt REAL NOT NULL,"
+                    "    last_error TEXT,"
+                    "    created REAL NOT NULL,"
+                    "    sent INTEGER,"
+                    "    failed INTEGER"
+                    ");"
+                    "CREATE INDEX IF NOT EXISTS kik_outbox_pending ON kik_outbox (bot_id, sent, failed, id);"
+                    "CREATE TABLE IF NOT EXISTS processed_messages ("
+                    "    message_id TEXT NOT NULL,"
+                    "    bot_id TEXT NOT NULL,"
+                    "    created INTEGER NOT NULL,"
+                    "    PRIMARY KEY (message_id, bot_id)"
+                    ");"
+                )),
+                # migration 4 replaces the user id indexes - the ids are compared by equality since then
+                Migration(3, "Indizes", script=(
+                    "CREATE INDEX IF NOT EXISTS characters_user_char ON characters (user_id COLLATE NOCASE, char_id, created);"
+                    "CREATE INDEX IF NOT EXISTS character_pictures_user_char ON character_pictures (user_id COLLATE NOCASE, char_id, created);"
+                    "CREATE INDEX IF NOT EXISTS users_user_bot ON users (user_id COLLATE NOCASE, bot_id COLLATE NOCASE);"
+                    "CREATE INDEX IF NOT EXISTS kik_user_response_user ON kik_user_response (user_id COLLATE NOCASE, created);"
+                    "CREATE INDEX IF NOT EXISTS static_messages_command ON static_messages (command COLLATE NOCASE);"
+                )),
+                Migration(4, "Nutzer-Ids in Kleinbuchstaben", script=(
+                    # users could have been stored twice with a different case - the newest row is kept
+                    "DELETE FROM users WHERE id NOT IN (SELECT MAX(id) FROM users GROUP BY lower(user_id), bot_id);"
+                    "UPDATE users SET user_id = lower(user_id), is_user_id = lower(is_user_id), authed_by = lower(authed_by);"
+                    "UPDATE characters SET user_id = lower(user_id), creator_id = lower(creator_id), deletor_id = lower(deletor_id);"
+                    "UPDATE character_pictures SET user_id = lower(user_id), creator_id = lower(creator_id), deletor_id = lower(deletor_id);"
+                    "UPDATE kik_user_response SET user_id = lower(user_id);"
+                    "DROP INDEX IF EXISTS characters_user_char;"
+                    "DROP INDEX IF EXISTS character_pictures_user_char;"
+                    "DROP INDEX IF EXISTS users_user_bot;"
+                    "DROP INDEX IF EXISTS kik_user_response_user;"
+                    "CREATE INDEX characters_user_char ON characters (user_id, char_id, created);"
+                    "CREATE INDEX character_pictures_user_char ON character_pictures (user_id, char_id, created);"
+                    "CREATE INDEX users_user_bot ON users (user_id, bot_id);"
+                    "CREATE INDEX kik_user_response_user ON kik_user_response (user_id, created);"
+                )),
+                Migration(5, "Aktuelle Charakter-Versionen", func=self.create_char_heads),
+                Migration(6, "Übersicht der Nutzer mit Charakteren", func=self.create_user_char_summary),
+                Migration(7, "Volltextsuche", func=self.create_char_search),
+                Migration(8, "Felder der Steckbriefe", func=self.create_char_fields),
+                # the status of the users is kept per chat since then - the old status in users isn't used anymore
+                Migration(9, "Sitzungen", script=(
+                    "CREATE TABLE sessions ("
+                    "    bot_id TEXT NOT NULL,"
+                    "    user_id TEXT NOT NULL,"
+                    "    chat_id TEXT NOT NULL,"
+                    "    state TEXT NOT NULL,"
+                    "    updated INTEGER NOT NULL,"
+                    "    PRIMARY KEY (bot_id, user_id, chat_id)"
+                    ");"
+                    "CREATE INDEX sessions_updated ON sessions (bot_id, updated);"
+                )),
+            ]
+        }
+
+    @staticmethod
+    def get_char_heads_refresh_sql(user_id):
+        """
+        Statements which rebuild the heads of all characters of a user. Used for the initial fill with a parameter
+        for the user_id.
+
+        :rtype: list[str]
+        """
+        return [
+            "DELETE FROM character_heads WHERE user_id = {user_id};".format(user_id=user_id),
+            (
+                "INSERT INTO character_heads (user_id, char_id, version_id, text, creator_id, created) "
+                "SELECT c.user_id, c.char_id, c.id, c.text, c.creator_id, c.created "
+                "FROM characters AS c "
+                "WHERE c.user_id = {user_id} AND c.deleted IS NULL AND c.id = ("
+                "    SELECT c2.id "
+                "    FROM characters AS c2 "
+                "    WHERE c2.user_id = c.user_id AND c2.char_id = c.char_id AND c2.deleted IS NULL "
+                "    ORDER BY c2.created DESC, c2.id DESC "
+                "    LIMIT 1"
+                ");"
+            ).format(user_id=user_id),
+            # characters without any version left stay as deleted heads - their char_id is still taken
+            (
+                "INSERT OR IGNORE INTO character_heads (user_id, char_id, deleted) "
+                "SELECT user_id, char_id, MAX(deleted) "
+                "FROM characters "
+                "WHERE user_id = {user_id} "
+                "GROUP BY user_id, char_id;"
+            ).format(user_id=user_id),
+            (
+                "UPDATE character_heads "
+                "SET prev_char_id = ("
+                "        SELECT MAX(h.char_id) FROM character_heads AS h "
+                "        WHERE h.user_id = character_heads.user_id AND h.deleted IS NULL AND h.char_id < character_heads.char_id), "
+                "    next_char_id = ("
+                "        SELECT MIN(h.char_id) FROM character_heads AS h "
+                "        WHERE h.user_id = character_heads.user_id AND h.deleted IS NULL AND h.char_id > character_heads.char_id) "
+                "WHERE user_id = {user_id};"
+            ).format(user_id=user_id),
+            CharacterPersistentClass.get_char_head_picture_sql(user_id),
+        ]
+
+    @staticmethod
+    def get_char_head_refresh_sql(user_id, char_id):
+        """
+        Statements which rebuild the head of one character and the links of its neighbours. Used by the triggers
+        with the user_id and char_id of OLD or NEW.
+
+        :rtype: list[str]
+        """
+        # the neighbours are looked up by the primary key, the heads of the other characters stay untouched
+        neighbour_sql = (
+            "SELECT {func}(h.char_id) FROM character_heads AS h "
+            "WHERE h.user_id = {user_id} AND h.deleted IS NULL AND h.char_id {op} {char_id}"
+        )
+        return [
+            "DELETE FROM character_heads WHERE user_id = {user_id} AND char_id = {char_id};".format(user_id=user_id, char_id=char_id),
+            (
+                "INSERT INTO character_heads (user_id, char_id, version_id, text, creator_id, created) "
+                "SELECT user_id, char_id, id, text, creator_id, created "
+                "FROM characters "
+                "WHERE user_id = {user_id} AND char_id = {char_id} AND deleted IS NULL "
+                "ORDER BY created DESC, id DESC "
+                "LIMIT 1;"
+            ).format(user_id=user_id, char_id=char_id),
+            # characters without any version left stay as deleted heads - their char_id is still taken
+            (
+                "INSERT OR IGNORE INTO character_heads (user_id, char_id, deleted) "
+                "SELECT user_id, char_id, MAX(deleted) "
+                "FROM characters "
+                "WHERE user_id = {user_id} AND char_id = {char_id} "
+                "GROUP BY user_id, char_id;"
+            ).format(user_id=user_id, char_id=char_id),
+            (
+                "UPDATE character_heads "
+                "SET prev_char_id = ("
+                "        SELECT MAX(h.char_id) FROM character_heads AS h "
+                "        WHERE h.user_id = character_heads.user_id AND h.deleted IS NULL AND h.char_id < character_heads.char_id), "
+                "    next_char_id = ("
+                "        SELECT MIN(h.char_id) FROM character_heads AS h "
+                "        WHERE h.user_id = character_heads.user_id AND h.deleted IS NULL AND h.char_id > character_heads.char_id) "
+                "WHERE user_id = {user_id} AND char_id IN ({char_id}, ({prev}), ({next}));"
+            ).format(
+                user_id=user_id,
+                char_id=char_id,
+                prev=neighbour_sql.format(func="MAX", user_id=user_id, op="<", char_id=char_id),
+                next=neighbour_sql.format(func="MIN", user_id=user_id, op=">", char_id=char_id)
+            ),
+            CharacterPersistentClass.get_char_head_picture_sql(user_id, char_id),
+        ]
+
+    @staticmethod
+    def get_char_head_picture_sql(user_id, char_id=None):
+        picture_query = (
+            "SELECT p.{column} FROM character_pictures AS p "
+            "WHERE p.user_id = character_heads.user_id AND p.char_id = character_heads.char_id AND p.deleted IS NULL "
+            "ORDER BY p.created DESC, p.id DESC "
+            "LIMIT 1"
+        )
+        return (
+            "UPDATE character_heads "
+            "SET picture_filename = ({picture_filename}), "
+            "    picture_active = ({picture_active}) "
+            "WHERE user_id = {user_id}{char_id};"
+        ).format(
+            picture_filename=picture_query.format(column="picture_filename"),
+            picture_active=picture_query.format(column="active"),
+            user_id=user_id,
+            char_id=" AND char_id = {}".format(char_id) if char_id is not None else ""
+        )
+
+    @staticmethod
+    def create_char_search(connection: sqlite3.Connection):
+        connection.execute((
+            "CREATE TABLE character_search_keys ("
+            "    search_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            "    user_id TEXT NOT NULL,"
+            "    char_id INTEGER NOT NULL,"
+            "    UNIQUE (user_id, char_id)"
+            ")"
+        ))
+        connection.execute("CREATE VIRTUAL TABLE character_search USING fts5(names, text, tokenize = 'unicode61 remove_diacritics 2')")
+
+        # migration 8 rebuilds the rows with the names of character_fields, which doesn't exist yet
+        cursor = connection.cursor()
+        for user in connection.execute("SELECT DISTINCT user_id FROM character_heads WHERE deleted IS NULL").fetchall():
+            cursor.execute("SELECT char_id, text FROM character_heads WHERE user_id = ? AND deleted IS NULL", [user[0]])
+            for head in cursor.fetchall():
+                cursor.execute("INSERT OR IGNORE INTO character_search_keys (user_id, char_id) VALUES (?, ?)", [user[0], head[0]])
+                cursor.execute("SELECT search_id FROM character_search_keys WHERE user_id = ? AND char_id = ?", [user[0], head[0]])
+                search_id = cursor.fetchone()[0]
+                cursor.execute(
+                    "INSERT INTO character_search (rowid, names, text) VALUES (?, ?, ?)",
+                    [search_id, CharacterPersistentClass.get_char_names(head[1]), head[1]]
+                )
+
+    @staticmethod
+    def create_char_fields(connection: sqlite3.Connection):
+        connection.execute((
+            "CREATE TABLE character_fields ("
+            "    user_id TEXT NOT NULL,"
+            "    char_id INTEGER NOT NULL,"
+            "    position INTEGER NOT NULL,"
+            "    field TEXT NOT NULL,"
+            "    field_norm TEXT NOT NULL,"
+            "    field_key TEXT NOT NULL,"
+            "    value TEXT NOT NULL,"
+            "    value_norm TEXT NOT NULL,"
+            "    PRIMARY KEY (user_id, char_id, position)"
+            ")"
+        ))
+        connection.execute("CREATE INDEX character_fields_field_value ON character_fields (field_norm, value_norm)")
+        connection.execute("CREATE INDEX character_fields_key_value ON character_fields (field_key, value_norm)")
+
         cursor = connection.cursor()
+        for user in connection.execute("SELECT DISTINCT user_id FROM character_heads WHERE deleted IS NULL").fetchall():
+            CharacterPersistentClass.refresh_char_fields_rows(cursor, user[0])
+            CharacterPersistentClass.refresh_char_search_rows(cursor, user[0])
+
+    @staticmethod
+    def create_user_char_summary(connection: sqlite3.Connection):
+        connection.execute((
+            "CREATE TABLE user_char_summary ("
+            "    user_id TEXT PRIMARY KEY,"
+            "    chars_cnt INTEGER NOT NULL,"
+            "    last_change INTEGER NOT NULL"
+            ")"
+        ))
+        connection.execute("CREATE INDEX user_char_summary_last_change ON user_char_summary (last_change, user_id)")
+
+        # the heads are maintained by triggers themselves - the summary follows them
+        add_sql = (
+            "INSERT OR IGNORE INTO user_char_summary (user_id, chars_cnt, last_change) VALUES (NEW.user_id, 0, NEW.created); "
+            "UPDATE user_char_summary "
+            "SET chars_cnt = chars_cnt + 1, "
+            "    last_change = MAX(last_change, NEW.created) "
+            "WHERE user_id = NEW.user_id;"
+        )
+        # only the removal of the newest head needs the maximum of the remaining heads
+        remove_sql = (
+            "UPDATE user_char_summary "
+            "SET chars_cnt = chars_cnt - 1, "
+            "    last_change = CASE WHEN OLD.created < last_change THEN last_change ELSE COALESCE(("
+            "        SELECT MAX(h.created) FROM character_heads AS h WHERE h.user_id = OLD.user_id AND h.deleted IS NULL"
+            "    ), 0) END "
+            "WHERE user_id = OLD.user_id; "
+            "DELETE FROM user_char_summary WHERE user_id = OLD.user_id AND chars_cnt <= 0;"
+        )
+        update_event = "AFTER UPDATE OF user_id, created, deleted ON character_heads"
+        triggers = [
+            ("character_heads_summary_insert", "AFTER INSERT ON character_heads WHEN NEW.deleted IS NULL", add_sql),
+            ("character_heads_summary_delete", "AFTER DELETE ON character_heads WHEN OLD.deleted IS NULL", remove_sql),
+            ("character_heads_summary_update_old", update_event + " WHEN OLD.deleted IS NULL", remove_sql),
+            ("character_heads_summary_update_new", update_event + " WHEN NEW.deleted IS NULL", add_sql),
+        ]
+        for name, event, statements in triggers:
+            connection.execute("CREATE TRIGGER {} {} BEGIN {} END".format(name, event, statements))
+
+        connection.execute((
+            "INSERT INTO user_char_summary (user_id, chars_cnt, last_change) "
+            "SELECT user_id, COUNT(*), MAX(created) "
+            "FROM character_heads "
+            "WHERE deleted IS NULL "
+            "GROUP BY user_id"
+        ))
 
-        cursor.executescript(open('database.sql', 'r').read())
+    @staticmethod
+    def create_char_heads(connection: sqlite3.Connection):
+        connection.execute((
+            "CREATE TABLE character_heads ("
+            "    user_id TEXT NOT NULL,"
+            "    char_id INTEGER NOT NULL,"
+            "    version_id INTEGER,"
+            "    text TEXT,"
+            "    creator_id TEXT,"
+            "    created INTEGER,"
+            "    prev_char_id INTEGER,"
+            "    next_char_id INTEGER,"
+            "    picture_filename TEXT,"
+            "    picture_active INTEGER,"
+            "    deleted INTEGER,"
+            "    PRIMARY KEY (user_id, char_id)"
+            ")"
+        ))
+
+        # only the head of the changed character is rebuilt, the old head only if the row was moved
+        triggers = [
+            ("characters_heads_insert", "AFTER INSERT ON characters", "NEW"),
+            ("characters_heads_update", "AFTER UPDATE ON characters", "NEW"),
+            ("characters_heads_update_old", "AFTER UPDATE ON characters WHEN OLD.user_id IS NOT NEW.user_id OR OLD.char_id IS NOT NEW.char_id", "OLD"),
+            ("characters_heads_delete", "AFTER DELETE ON characters", "OLD"),
+        ]
+        for name, event, row in triggers:
+            statements = CharacterPersistentClass.get_char_head_refresh_sql(row + ".user_id", row + ".char_id")
+            connection.execute("CREATE TRIGGER {} {} BEGIN {} END".format(name, event, " ".join(statements)))
+
+        picture_triggers = [
+            ("character_pictures_heads_insert", "AFTER INSERT ON character_pictures", ["NEW"]),
+            ("character_pictures_heads_update", "AFTER UPDATE ON character_pictures", ["OLD", "NEW"]),
+            ("character_pictures_heads_delete", "AFTER DELETE ON character_pictures", ["OLD"]),
+        ]
+        for name, event, rows in picture_triggers:
+            statements = [CharacterPersistentClass.get_char_head_picture_sql(row + ".user_id", row + ".char_id") for row in rows]
+            connection.execute("CREATE TRIGGER {} {} BEGIN {} END".format(name, event, " ".join(statements)))
+
+        for user in connection.execute("SELECT DISTINCT user_id FROM characters").fetchall():
+            for statement in CharacterPersistentClass.get_char_heads_refresh_sql("?"):
+                connection.execute(statement, [user[0]] * statement.count("?"))
+
+    def migrate_database(self):
+        runner = MigrationRunner(self.database_path, self.bot_username)
+        for scope, migrations in self.get_migrations().items():
+            runner.run(scope, migrations)
+
+    def create_database(self, connection: sqlite3.Connection):
+        # databases created before the migrations already have the base schema
+        if Migration.table_exists(connection, "characters"):
+            return
 
-        connection.commit()
-        connection.close()
+        print("Datenbank {} nicht vorhanden - Datenbank wird anglegt.".format(os.path.basename(self.database_path)))
+        Migration(0, "", script=open('database.sql', 'r').read()).apply(connection)
         print("Datenbank {} angelegt".format(os.path.basename(self.database_path)))
@@ -0,0 +1,109 @@
+import sqlite3
+import threading
+import weakref
+
+
+class ConnectionHolder:
+    """
+    Keeps the connection of a thread in its thread local - the holder is dropped when the thread ends.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+
+class ConnectionManager:
+    """
+    Keeps one SQLite connection per thread and database for the life of the thread. The connections use WAL,
+    so readers don't block the writer and the writer doesn't block readers.
+    """
+
+    managers = {}
+    managers_lock = threading.Lock()
+
+    def __init__(self, database_path, busy_timeout=5000, mmap_size=268435456, cache_size=-16000):
+        self.database_path = database_path
+        self.busy_timeout = int(busy_timeout)
+        self.mmap_size = int(mmap_size)
+        self.cache_size = int(cache_size)
+        self.local = threading.local()
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.wal_enabled = False
+
+    @staticmethod
+    def get(database_path, config=None):
+        """
+        Returns the manager of the database - all persistence classes of a database share one manager.
+
+        :rtype: ConnectionManager
+        """
+        with ConnectionManager.managers_lock:
+            manager = ConnectionManager.managers.get(database_path)
+            if manager is None:
+                config = config if config is not None else {}
+                manager = ConnectionManager(
+                    database_path,
+                    config.get("DatabaseBusyTimeout", "5000"),
+                    config.get("DatabaseMmapSize", "268435456"),
+                    config.get("DatabaseCacheSize", "-16000")
+                )
+                ConnectionManager.managers[database_path] = manager
+            return manager
+
+    def get_connection(self, create=True):
+        """
+
+        :rtype: sqlite3.Connection
+        """
+        holder = getattr(self.local, "holder", None)
+        if holder is None and create is True:
+            holder = ConnectionHolder(self.connect())
+            # flask starts a thread per request - the connection is closed with the thread, not at exit
+            weakref.finalize(holder, self.release, holder.connection)
+            self.local.holder = holder
+        return holder.connection if holder is not None else None
+
+    def connect(self):
+        # the busy timeout waits for a running write transaction instead of failing with "database is locked"
+        # check_same_thread is off only to close the connections at exit - otherwise a connection stays in its thread
+        connection = sqlite3.connect(self.database_path, timeout=self.busy_timeout / 1000, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        if self.wal_enabled is False:
+            # the journal mode is stored in the database file, the other pragmas are per connection
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.wal_enabled = True
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout={:d}".format(self.busy_timeout))
+        connection.execute("PRAGMA mmap_size={:d}".format(self.mmap_size))
+        connection.execute("PRAGMA cache_size={:d}".format(self.cache_size))
+
+        with self.lock:
+            self.connections.add(connection)
+        return connection
+
+    def release(self, connection: sqlite3.Connection):
+        with self.lock:
+            if connection not in self.connections:
+                return
+            self.connections.discard(connection)
+
+        # noinspection PyBroadException
+        try:
+            connection.commit()
+            connection.close()
+        except:
+            pass
+
+    def close_all(self):
+        with self.lock:
+            connections = self.connections
+            self.connections = set()
+
+        for connection in connections:
+            # noinspection PyBroadException
+            try:
+                connection.commit()
+                connection.close()
+            except:
+                pass
@@ -0,0 +1,95 @@
+import sqlite3
+import time
+
+
+class Migration:
+    """
+    A step of the schema of a scope ("core" or a custom module). The step is either a sql script or
+    a function which gets the connection.
+    """
+
+    def __init__(self, version, description, script=None, func=None):
+        self.version = version
+        self.description = description
+        self.script = script
+        self.func = func
+
+    def apply(self, connection: sqlite3.Connection):
+        if self.func is not None:
+            self.func(connection)
+        if self.script is not None:
+            for statement in Migration.split_statements(self.script):
+                connection.execute(statement)
+
+    @staticmethod
+    def split_statements(script):
+        # executescript commits on its own - the statements are executed one by one to keep them in one transaction
+        statements = []
+        statement = ""
+        for part in script.split(";"):
+            statement += part + ";"
+            if sqlite3.complete_statement(statement):
+                if statement.strip() != ";":
+                    statements.append(statement.strip())
+                statement = ""
+        return statements
+
+    @staticmethod
+    def table_exists(connection: sqlite3.Connection, table):
+        return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [table]).fetchone() is not None
+
+
+class MigrationRunner:
+    """
+    Brings the schema of a database up to date. The applied version of each scope is kept in the table schema_version,
+    every migration runs in its own transaction.
+    """
+
+    def __init__(self, database_path, bot_username):
+        self.database_path = database_path
+        self.bot_username = bot_username
+
+    @staticmethod
+    def get_version(connection: sqlite3.Connection, scope):
+        row = connection.execute("SELECT version FROM schema_version WHERE scope = ?", [scope]).fetchone()
+        return row[0] if row is not None else 0
+
+    def run(self, scope, migrations):
+        connection = sqlite3.connect(self.database_path, isolation_level=None)
+        try:
+            connection.execute((
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "    scope TEXT PRIMARY KEY,"
+                "    version INTEGER NOT NULL,"
+                "    updated INTEGER NOT NULL"
+                ")"
+            ))
+
+            for migration in sorted(migrations, key=lambda m: m.version):
+                if migration.version <= self.get_version(connection, scope):
+                    continue
+
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    # another process could have applied it in the meantime
+                    if migration.version <= self.get_version(connection, scope):
+                        connection.execute("ROLLBACK")
+                        continue
+
+                    print("[{bot_username}] Datenbank-Migration {scope} {version}: {description}".format(
+                        bot_username=self.bot_username,
+                        scope=scope,
+                        version=migration.version,
+                        description=migration.description
+                    ))
+                    migration.apply(connection)
+                    connection.execute(
+                        "INSERT OR REPLACE INTO schema_version (scope, version, updated) VALUES (?, ?, ?)",
+                        [scope, migration.version, int(time.time())]
+                    )
+                    connection.execute("COMMIT")
+                except:
+                    connection.execute("ROLLBACK")
+                    raise
+        finally:
+            connection.close()
@@ -0,0 +1,164 @@
+import json
+import random
+import threading
+import time
+import traceback
+from typing import List
+
+from kik import KikApi, KikError
+from kik.messages import Message, messages_from_json
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.metrics import metrics
+
+
+class KikMessageSender:
+    """
+    Replies are written to the outbox table first and delivered by a separate sender thread. If Kik can't be reached,
+    the messages stay in the outbox and are retried with an exponential backoff, so a failing send never blocks
+    a request thread and no reply gets lost.
+    """
+
+    # Kik accepts up to 25 messages per call, with a limit of 5 messages per user
+    MAX_MESSAGES_PER_CALL = 25
+    MAX_MESSAGES_PER_USER = 5
+
+    def __init__(self, kik_api: KikApi, character_persistent_class: CharacterPersistentClass, config, bot_username,
+                 send_window_ms=0):
+        self.kik_api = kik_api
+        self.character_persistent_class = character_persistent_class
+        self.config = config
+        self.bot_username = bot_username
+        self.send_window = max(0, int(send_window_ms)) / 1000
+        self.retry_base = float(config.get("SendRetryBase", "2"))
+        self.retry_max = float(config.get("SendRetryMax", "300"))
+        self.max_attempts = int(config.get("SendMaxAttempts", "8"))
+        self.poll_interval = 1
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.last_cleanup = 0
+
+        self.thread = threading.Thread(target=self.run, name="kik-sender", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def pack_batches(messages: List[Message]):
+        """
+        Packs the messages into the fewest batches within Kik's limits. The order of the messages of each user is kept.
+
+        :rtype: List[List[Message]]
+        """
+        batches = []
+        batch_user_counts = []
+        min_batch = {}
+
+        for message in messages:
+            user = str(message.to).lower()
+            batch_id = min_batch.get(user, 0)
+            while batch_id < len(batches) and (len(batches[batch_id]) >= KikMessageSender.MAX_MESSAGES_PER_CALL or
+                                               batch_user_counts[batch_id].get(user, 0) >= KikMessageSender.MAX_MESSAGES_PER_USER):
+                batch_id += 1
+
+            if batch_id == len(batches):
+                batches.append([])
+                batch_user_counts.append({})
+
+            batches[batch_id].append(message)
+            batch_user_counts[batch_id][user] = batch_user_counts[batch_id].get(user, 0) + 1
+            min_batch[user] = batch_id
+
+        return batches
+
+    def send(self, messages: List[Message]):
+        if len(messages) == 0:
+            return
+
+        with metrics.timer("send"):
+            self.character_persistent_class.add_outbox_messages(messages)
+        self.event.set()
+
+    def get_retry_delay(self, attempts):
+        # exponential backoff with jitter, so the retries of many messages don't hit Kik at the same moment
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def run(self):
+        while True:
+            self.event.wait(self.poll_interval)
+            if self.event.is_set():
+                self.event.clear()
+                time.sleep(self.send_window)
+
+            # noinspection PyBroadException
+            try:
+                self.flush()
+            except:
+                print("[{bot_username}] Kik-Sender-Error:\n---\nTrace: {trace}".format(
+                    bot_username=self.bot_username,
+                    trace=traceback.format_exc()
+                ))
+
+    def flush(self):
+        with self.lock:
+            now = time.time()
+            blocked_users = set()
+            messages = []
+            outbox_entries = {}
+            for row in self.character_persistent_class.get_pending_outbox_messages():
+                # later messages of a user have to wait for the retry of an earlier one to keep their order
+                if row["user_id"] in blocked_users or row["next_attempt"] > now:
+                    blocked_users.add(row["user_id"])
+                    continue
+
+                message = messages_from_json([json.loads(row["message"])])[0]
+                outbox_entries[id(message)] = row
+                messages.append(message)
+
+            for batch in self.pack_batches(messages):
+                self.send_batch(batch, [outbox_entries[id(message)] for message in batch])
+
+            if now - self.last_cleanup > 3600:
+                self.character_persistent_class.remove_sent_outbox_messages(now - 86400)
+                self.last_cleanup = now
+
+    @staticmethod
+    def is_rejected(error: Exception):
+        # a 4xx is caused by the messages themselves - sending them again doesn't help, except for the rate limit
+        return isinstance(error, KikError) and 400 <= error.status_code < 500 and error.status_code != 429
+
+    def send_batch(self, batch: List[Message], entries):
+        try:
+            with metrics.timer("kik_api"):
+                self.kik_api.send_messages(batch)
+        except Exception as e:
+            metrics.inc("kikbot_kik_send_errors_total")
+            error = "{}: {}".format(type(e).__name__, str(e))
+            print("[{bot_username}] Kik-Send-Error ({count} messages): {error}".format(
+                bot_username=self.bot_username,
+                count=len(batch),
+                error=error
+            ))
+
+            if self.is_rejected(e) and len(batch) > 1:
+                # the batch is split until the rejected message is alone - the others are sent anyway
+                middle = len(batch) // 2
+                self.send_batch(batch[:middle], entries[:middle])
+                self.send_batch(batch[middle:], entries[middle:])
+                return
+
+            for entry in entries:
+                attempts = entry["attempts"] + 1
+                failed = attempts >= self.max_attempts or self.is_rejected(e)
+                if failed:
+                    print("[{bot_username}] Kik-Send-Error: message {id} to {user_id} dropped after {attempts} attempts".format(
+                        bot_username=self.bot_username,
+                        id=entry["id"],
+                        user_id=entry["user_id"],
+                        attempts=attempts
+                    ))
+                self.character_persistent_class.set_outbox_message_retry(
+                    entry["id"], attempts, time.time() + self.get_retry_delay(attempts), error, failed)
+            return
+
+        self.character_persistent_class.set_outbox_messages_sent([entry["id"] for entry in entries])
+        metrics.inc("kikbot_sent_messages_total", value=len(batch))
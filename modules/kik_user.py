@@ -2,13 +2,16 @@ import json
 import time
 from random import randrange
 
-from kik import KikApi, KikError
+from modules.profile_cache import ProfileCache
 
 
 class User:
 
     def __init__(self, user_db):
         self.user_db = dict(user_db)
+        self.loaded_user_db = dict(user_db)
+        self.session_store = None  # type: SessionStore
+        self.session_chat_id = None
 
     def __getitem__(self, item):
         return self.__getattr__(item)
@@ -18,7 +21,20 @@ class User:
             return self.user_db[item]
         return None
 
+    def bind_session(self, session_store, chat_id):
+        """
+        Keeps the status of the user in the chat in the session store instead of users.status.
+
+        :type session_store: SessionStore
+        """
+        self.session_store = session_store
+        self.session_chat_id = chat_id
+
     def update_status(self, status, status_data=None):
+        if self.session_store is not None:
+            self.session_store.set(self.get_user_id(), self.session_chat_id, status, status_data)
+            return
+
         status_obj = {
             'status': status,
             'data': status_data
@@ -26,10 +42,23 @@ class User:
         self.user_db["status"] = json.dumps(status_obj)
 
     def get_status_obj(self):
-        if "status" in self.user_db:
+        if self.session_store is not None:
+            state = self.session_store.get(self.get_user_id(), self.session_chat_id)
+            return state.get_status_obj() if state is not None else None
+
+        if self.user_db.get("status") is not None:
             return json.loads(self.user_db["status"])
         return None
 
+    def is_changed(self):
+        """
+        Checks if anything but last_request changed since the user was loaded.
+
+        :rtype: bool
+        """
+        changed_keys = set(self.user_db.keys()) | set(self.loaded_user_db.keys())
+        return any(self.user_db.get(key) != self.loaded_user_db.get(key) for key in changed_keys if key != "last_request")
+
     def get_db_id(self):
         if "id" in self.user_db:
             return self.user_db["id"]
@@ -72,8 +101,10 @@ class User:
 
 
 class LazyKikUser(User):
-    kik_api = None  # type: KikApi
     character_persistent_class = None  # type: CharacterPersistentClass
+    profile_refresher = None  # type: ProfileRefresher
+    profile_cache = ProfileCache()
+    max_age = 6 * 60 * 60
     accepted_attrs = [
             "first_name",
             "last_name",
@@ -95,23 +126,80 @@ class LazyKikUser(User):
     def init_new_user(user_id, bot_id=None):
         return LazyKikUser({"user_id": user_id, "bot_id": bot_id, "is_admin": 0})
 
+    @staticmethod
+    def init_many(user_ids, bot_id=None, load_users=True):
+        """
+        Creates the users with their profiles by one query for the users and one for the profiles which are not
+        cached. Stale profiles are used and refreshed in the background, only missing profiles are waited for.
+        Without load_users only the profiles are loaded, e.g. for the names.
+
+        :rtype: dict[str, LazyKikUser]
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        users_db = LazyKikUser.character_persistent_class.get_users(user_ids) if load_users is True else {}
+        profiles = LazyKikUser.profile_cache.get_many(user_ids, LazyKikUser.character_persistent_class.get_kik_users)
+
+        users = {}
+        for user_id in user_ids:
+            user_db = users_db.get(user_id.lower())
+            user = LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(user_id, bot_id)
+            user.set_kik_user_db(profiles.get(user_id.lower()))
+            user.kik_user_loaded = True
+            users[user_id] = user
+
+        LazyKikUser.refresh_kik_users(list(users.values()))
+        return users
+
+    @staticmethod
+    def refresh_kik_users(users):
+        """
+
+        :type users: list[LazyKikUser]
+        """
+        if LazyKikUser.profile_refresher is None:
+            raise BaseException("profile_refresher not set!")
+
+        missing_users = []
+        for user in users:
+            if user.kik_user_refreshed is True or user.is_kik_user_stale() is False:
+                continue
+            user.kik_user_refreshed = True
+            if user.kik_user_db is None:
+                missing_users.append(user)
+            else:
+                LazyKikUser.profile_refresher.refresh(user.get_user_id())
+
+        if len(missing_users) != 0:
+            profiles = LazyKikUser.profile_refresher.fetch([user.get_user_id() for user in missing_users])
+            for user in missing_users:
+                user.set_kik_user_db(profiles.get(user.get_user_id().lower()))
+
     def __init__(self, user_db):
         User.__init__(self, user_db)
         self.kik_user_db = None
+        self.kik_user_loaded = False
+        self.kik_user_refreshed = False
+
+    def is_kik_user_stale(self):
+        return self.kik_user_db is None or int(time.time()) > self.kik_user_db["created"] + self.max_age
 
     def refresh_kik_user(self):
-        if self.kik_api is None:
-            raise BaseException("kik_api not set!")
+        if self.kik_user_loaded is False:
+            user_id = self.get_user_id()
+            self.set_kik_user_db(self.profile_cache.get_many([user_id], self.character_persistent_class.get_kik_users)[user_id.lower()])
+            self.kik_user_loaded = True
 
-        if self.kik_user_db is None:
-            self.set_kik_user_db(self.character_persistent_class.get_kik_user(self.get_user_id()))
+        self.refresh_kik_users([self])
 
-        if self.kik_user_db is None or int(time.time()) > self.kik_user_db["created"] + 6 * 60 * 60:
-            try:
-                print("Get Kik User " + self.get_user_id())
-                self.set_kik_user_db(self.character_persistent_class.add_kik_user_data(self.get_user_id(), self.kik_api.get_user(self.get_user_id())))
-            except KikError:
-                pass
+    def is_changed(self):
+        """
+        Also checks the name of the Kik profile, the stored name of the user follows the profile.
+
+        :rtype: bool
+        """
+        if User.is_changed(self) is True:
+            return True
+        return self["first_name"] != self.loaded_user_db.get("first_name") or self["last_name"] != self.loaded_user_db.get("last_name")
 
     def set_kik_user_db(self, kik_user_db):
         if kik_user_db is None:
@@ -163,29 +251,25 @@ class LazyRandomKikUser:
 
     accepted_attrs = ["rand", "rand_wo_sender"]
 
-    def __init__(self, user_ids, sender_user, alt_user_id, character_persistence_class):
+    def __init__(self, user_ids, sender_user, alt_user_id, character_persistent_class):
         self.user_ids = user_ids
         self.sender_user = sender_user
         self.alt_user_id = alt_user_id
-        self.character_persistence_class = character_persistence_class # type: CharacterPersistentClass
+        self.character_persistent_class = character_persistent_class  # type: CharacterPersistentClass
 
     def __getitem__(self, item):
         return self.__getattr__(item)
 
     def __getattr__(self, item):
         if item not in LazyRandomKikUser.accepted_attrs:
-            user_db = self.character_persistent_class.get_user(self.alt_user_id)
-            return LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(self.alt_user_id)
+            return LazyKikUser.init_many([self.alt_user_id])[self.alt_user_id]
 
         user_ids = self.user_ids
         if item == "rand_wo_sender":
             user_ids = list(filter(lambda x: x != self.sender_user.get_user_id(), user_ids))
 
         if len(user_ids) == 0:
-            user_db = self.character_persistent_class.get_user(self.alt_user_id)
-            return LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(self.alt_user_id)
-
-        random_index = randrange(0, len(self.user_ids))
-        user_db = self.character_persistent_class.get_user(self.user_ids[random_index])
-        return LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(self.user_ids[random_index])
+            return LazyKikUser.init_many([self.alt_user_id])[self.alt_user_id]
 
+        user_id = user_ids[randrange(0, len(user_ids))]
+        return LazyKikUser.init_many([user_id])[user_id]
@@ -0,0 +1,67 @@
+import threading
+import time
+import traceback
+
+from modules.character_persistent_class import CharacterPersistentClass
+
+
+class LastRequestBuffer:
+    """
+    Collects the last_request updates of the users and writes them in one transaction per flush interval. A message
+    which changes nothing else about its user doesn't need an own write and commit.
+    """
+
+    def __init__(self, character_persistent_class: CharacterPersistentClass, bot_username, flush_interval_ms=300):
+        self.character_persistent_class = character_persistent_class
+        self.bot_username = bot_username
+        self.flush_interval = max(10, int(flush_interval_ms)) / 1000
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, name="last-request-buffer", daemon=True)
+        self.thread.start()
+
+    def bump(self, user_id, timestamp=None):
+        timestamp = int(timestamp if timestamp is not None else time.time())
+        user_id = user_id.lower()
+        with self.lock:
+            self.pending[user_id] = max(timestamp, self.pending.get(user_id, 0))
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            # noinspection PyBroadException
+            try:
+                self.flush()
+            except:
+                print("[{bot_username}] Last-Request-Error:\n---\nTrace: {trace}".format(
+                    bot_username=self.bot_username,
+                    trace=traceback.format_exc()
+                ))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+
+            if len(pending) == 0:
+                return
+
+            try:
+                self.character_persistent_class.set_users_last_request(pending)
+            except:
+                # the updates are tried again with the next flush
+                with self.lock:
+                    for user_id, timestamp in pending.items():
+                        self.pending[user_id] = max(timestamp, self.pending.get(user_id, 0))
+                raise
+
+    @staticmethod
+    def init_from_config(config, character_persistent_class: CharacterPersistentClass, bot_username):
+        return LastRequestBuffer(
+            character_persistent_class,
+            bot_username,
+            config.get("LastRequestFlushInterval", "300")
+        )
@@ -2,6 +2,7 @@ import configparser
 import datetime
 import json
 import random
+import threading
 import time
 from typing import Union
 
@@ -14,6 +15,11 @@ from werkzeug.exceptions import BadRequest
 
 from modules.character_persistent_class import CharacterPersistentClass
 from modules.kik_user import User, LazyKikUser, LazyRandomKikUser
+from modules.metrics import metrics
+
+FIELD_QUERY_REGEX = re.compile(r"^\s*([^=:]+?)\s*[=:]\s*(\S.*?)\s*$")
+DICE_TERM_REGEX = re.compile(r"^(([0-9]+\s*([×x\*]\s*)?)?D\s*)?[0-9]+(\s*\+\s*(([0-9]+\s*([×x\*]\s*)?)?D\s*)?[0-9]+)*$", re.MULTILINE | re.IGNORECASE)
+DICE_REGEX = re.compile(r"^((([0-9]+)\s*([×x\*]\s*)?)?D\s*)?([0-9]+)$", re.MULTILINE | re.IGNORECASE)
 
 
 class MessageParam:
@@ -124,6 +130,20 @@ class MessageParam:
         return MessageParam(name, MessageParam.CONST_REGEX_NUM, required=required, validate_in_message=validate_in_message,
                             examples=range(1, 4) if examples is None else examples)
 
+    @staticmethod
+    def init_page(name="page", required=False, validate_in_message=False, examples=None):
+        # the page is marked with "Seite" - a number alone can belong to the text of a parameter before it
+        name = name.strip()
+
+        def get_value_cb(name, param_values):
+            if name + "_num" in param_values and param_values[name + "_num"] is not None:
+                return int(param_values[name + "_num"])
+            return None
+
+        return MessageParam(name, r"(seite|page)\s+(?P<{name}_num>[0-9]+)".format(name=name), required=required,
+                            validate_in_message=validate_in_message, examples=["Seite 1", "Seite 2"] if examples is None else examples,
+                            get_value_callback=get_value_cb, default_value=1)
+
     @staticmethod
     def init_duration_minutes(name="duration", required=False, validate_in_message=False, examples=None):
 
@@ -196,7 +216,7 @@ class MessageParam:
 class MessageCommand:
 
 
-    def __init__(self, params: list, command_de, command_en, command_alts=None, help_command=None, hidden=False, require_admin=False, require_auth=False, require_group=False, require_self: Union[bool, str]=False):
+    def __init__(self, params: list, command_de, command_en, command_alts=None, help_command=None, hidden=False, require_admin=False, require_auth=False, require_group=False, require_self: Union[bool, str]=False, expensive=False):
         """
 
         :param params:
@@ -209,8 +229,10 @@ class MessageCommand:
         :param require_auth: The command can executed only when the message.user is authed, admin or message.chat_id is authed group or any other require condition is complied
         :param require_group: The command can executed only when the message.user is admin or message.chat_id is authed or any other require condition is complied
         :param require_self: The command can executed only when the message.user is admin or the given value of parameter is None or message.user or any other require condition is complied
+        :param expensive: The command is costly to execute and has a smaller rate limit
         """
         self.hidden = hidden
+        self.expensive = expensive
         if help_command is not None:
             self.help_command = help_command
         elif require_admin is False:
@@ -231,6 +253,8 @@ class MessageCommand:
             MessageParam("command", MessageParam.CONST_REGEX_COMMAND, required=True, examples=self.get_all_command_names())
         ]
         self.params.extend(params)
+        self.regex = None
+        self.command_regex = None
 
     def is_admin_only(self):
         return self.require_admin
@@ -247,6 +271,9 @@ class MessageCommand:
     def is_hidden(self):
         return self.hidden
 
+    def is_expensive(self):
+        return self.expensive
+
     def get_all_command_names(self):
         all_commands = set()
         all_commands.add(self.command["de"])
@@ -256,6 +283,22 @@ class MessageCommand:
 
     def add_param(self, param: MessageParam):
         self.params.append(param)
+        self.regex = None
+        self.command_regex = None
+
+    def compile(self):
+        self.regex = re.compile(self.get_regex(), re.IGNORECASE | re.MULTILINE)
+        self.command_regex = re.compile(r"^\s*{}.*$".format(self.params[0].get_regex(True)), re.IGNORECASE | re.MULTILINE)
+
+    def get_compiled_regex(self):
+        if self.regex is None:
+            self.compile()
+        return self.regex
+
+    def get_compiled_command_regex(self):
+        if self.command_regex is None:
+            self.compile()
+        return self.command_regex
 
     def get_regex(self):
         base_regex = ""
@@ -265,8 +308,7 @@ class MessageCommand:
         return r"^\s*{}\s*$".format(base_regex)
 
     def get_command(self, message_string):
-        regex = re.compile(r"^\s*{}.*$".format(self.params[0].get_regex(True)), re.IGNORECASE | re.MULTILINE)
-        match = regex.match(message_string.strip())
+        match = self.get_compiled_command_regex().match(message_string.strip())
         if match is None:
             return ""
         return match.group("command")
@@ -404,8 +446,7 @@ class MessageCommand:
                 "forced_message":           message_body_c
             }
 
-            regex = re.compile(self.get_regex(), re.IGNORECASE | re.MULTILINE)
-            match = regex.match(message_body_c.strip())
+            match = self.get_compiled_regex().match(message_body_c.strip())
             if match is None:
                 params_ = {i: x for i, x in enumerate(self.params)}
                 params_["command"] = self.get_command(message_body_c)
@@ -458,11 +499,13 @@ class MessageCommandDB(MessageCommand):
                          require_admin=False,
                          require_auth=False
                          )
+        # a new MessageCommandDB is only created if the db row has changed
+        self.compile()
 
     def get_regex(self):
         if len(self.params) == 1:
             return r"^\s*{}\s*.*?$".format(self.params[0].get_regex(True))
-        return super(MessageCommand).get_regex()
+        return super().get_regex()
 
 class AdditionalActions:
 
@@ -598,14 +641,83 @@ class CommandMessageResponse(MessageResponse):
         return self.command
 
 
+class CommandRegistry:
+    """
+    Keeps all registered commands in the order of their registration and a case-folded index of every command name,
+    localized name and alias. On duplicate names the first registered command wins, like the former linear scan.
+    """
+
+    def __init__(self):
+        self.entries = list()
+        self.index = dict()
+        self.fallback = None
+
+    @staticmethod
+    def normalize(command):
+        return str(command).strip().casefold()
+
+    @staticmethod
+    def get_names(cmds):
+        names = []
+        for lang_id, cmd_text in cmds.items():
+            if lang_id != "_alts":
+                names.append(cmd_text)
+            else:
+                names.extend(cmd_text)
+        return names
+
+    def add_to_index(self, index, entry):
+        if entry["cmds"] is None:
+            return
+        for name in self.get_names(entry["cmds"]):
+            index.setdefault(self.normalize(name), entry)
+
+    def rebuild_index(self):
+        index = dict()
+        for entry in self.entries:
+            self.add_to_index(index, entry)
+        # swap the whole dict, so lookups of other threads never see a half built index
+        self.index = index
+
+    def append(self, entry):
+        self.entries.append(entry)
+        if entry["cmds"] is None:
+            self.fallback = entry
+        self.add_to_index(self.index, entry)
+
+    def replace(self, old_entry, new_entry):
+        self.entries[self.entries.index(old_entry)] = new_entry
+        self.rebuild_index()
+
+    def remove(self, entry):
+        self.entries.remove(entry)
+        self.rebuild_index()
+
+    def lookup(self, command):
+        return self.index.get(self.normalize(command))
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        return self.entries[item]
+
+
 class MessageController:
-    methods = list()
+    methods = CommandRegistry()
     static_method = None
+    static_commands_lock = threading.Lock()
 
     def __init__(self, bot_username, config_file):
         self.config = self.read_config(config_file)
         self.bot_username = bot_username
         self.character_persistent_class = CharacterPersistentClass(self.config, bot_username)
+        self.last_request_buffer = None  # type: LastRequestBuffer
+        self.session_store = None  # type: SessionStore
+        self.picture_ingestor = None  # type: PictureIngestor
         self.update_static_commands()
 
     @staticmethod
@@ -629,6 +741,9 @@ class MessageController:
         if log_requests is True or str(log_requests).lower() == "true":
             print(message.__dict__)
 
+        if self.session_store is not None:
+            user.bind_session(self.session_store, message.chat_id)
+
         response_messages = []
         user_command_status = CharacterPersistentClass.STATUS_NONE
         user_command_status_data = None
@@ -677,32 +792,35 @@ class MessageController:
             #
             if message_body == u"\U00002B05\U0000FE0F":
                 status_obj = user.get_status_obj()
-                if status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'left' in status_obj['data']:
+                if status_obj is not None and status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'left' in status_obj['data']:
                     message_body = status_obj['data']['left'].lower()
                     message_body_c = status_obj['data']['left']
 
             elif message_body == u"\U000027A1\U0000FE0F":
                 status_obj = user.get_status_obj()
-                if status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'right' in status_obj['data']:
+                if status_obj is not None and status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'right' in status_obj['data']:
                     message_body = status_obj['data']['right'].lower()
                     message_body_c = status_obj['data']['right']
             elif message_body == u"\U0001F504":
                 status_obj = user.get_status_obj()
-                if status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'redo' in status_obj['data']:
+                if status_obj is not None and status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'redo' in status_obj['data']:
                     message_body = status_obj['data']['redo'].lower()
                     message_body_c = status_obj['data']['redo']
             elif message_body.strip()[0] == "@":
                 status_obj = user.get_status_obj()
-                if status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'add_user_id' in status_obj['data']:
+                if status_obj is not None and status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and 'add_user_id' in status_obj['data']:
                     message_body = status_obj['data']['add_user_id'].lower().format(message_body.strip()[1:])
                     message_body_c = status_obj['data']['add_user_id'].format(message_body_c.strip()[1:])
 
             message_command = message_body.split(None, 1)[0]
             if message_command != "":
-                method = self.get_command_method(message_command)
-                response_messages, user_command_status, user_command_status_data = method(
-                    self, message, message_body, message_body_c, response_messages, user_command_status, user_command_status_data, user
-                )
+                with metrics.timer("command_lookup"):
+                    method = self.get_command_method(message_command)
+                    metrics.set_command(self.get_command_label(message_command))
+                with metrics.timer("handler"):
+                    response_messages, user_command_status, user_command_status_data = method(
+                        self, message, message_body, message_body_c, response_messages, user_command_status, user_command_status_data, user
+                    )
             else:
                 response_messages.append(TextMessage(
                     to=message.from_user,
@@ -721,28 +839,45 @@ class MessageController:
                 ))
 
             else:
-                success = self.character_persistent_class.set_char_pic(status_obj['data']['user_id'], self.get_from_userid(message), message.pic_url, status_obj['data']['char_id'])
-                if success is True:
-                    body = _("Alles klar! Das Bild wurde gesetzt. Bitte melde dich bei @{} damit das Bild bestätigt werden kann. "
-                             "Dies ist notwendig, da Kik eine Zero-Tolerance-Policy gegenüber evtl. anstößigen Bildern hat.".format(
+                char_user_id = status_obj['data']['user_id']
+                char_id = status_obj['data']['char_id']
+                # the replies are built here - the translations need the request context, which the ingestor has not
+                success_messages = [TextMessage(
+                    to=message.from_user,
+                    chat_id=message.chat_id,
+                    body=_("Alles klar! Das Bild wurde gesetzt. Bitte melde dich bei @{} damit das Bild bestätigt werden kann. "
+                           "Dies ist notwendig, da Kik eine Zero-Tolerance-Policy gegenüber evtl. anstößigen Bildern hat.").format(
                         self.config.get("Admins", "admin1").split(',')[0].strip()
-                    ))
-                    show_resp = self.generate_text_response_user_char("Anzeigen", status_obj['data']['user_id'], status_obj['data']['char_id'], message)
-                else:
-                    body = _("Beim hochladen ist ein Fehler aufgetreten. Bitte versuche es erneut.")
-                    show_resp = self.generate_text_response_user_char("Bild-setzen", status_obj['data']['user_id'], status_obj['data']['char_id'], message)
-                    user_command_status = status_obj['status']
-                    user_command_status_data = status_obj['data']
-
-                response_messages.append(TextMessage(
+                    ),
+                    keyboards=[SuggestedResponseKeyboard(responses=[
+                        self.generate_text_response_user_char("Anzeigen", char_user_id, char_id, message),
+                        MessageController.generate_text_response("Liste")
+                    ])]
+                )]
+                error_messages = [TextMessage(
                     to=message.from_user,
                     chat_id=message.chat_id,
-                    body=body,
+                    body=_("Beim hochladen ist ein Fehler aufgetreten. Bitte versuche es erneut."),
                     keyboards=[SuggestedResponseKeyboard(responses=[
-                        show_resp,
+                        self.generate_text_response_user_char("Bild-setzen", char_user_id, char_id, message),
                         MessageController.generate_text_response("Liste")
                     ])]
-                ))
+                )]
+
+                if self.picture_ingestor is not None and self.picture_ingestor.submit(
+                        char_user_id, self.get_from_userid(message), message.pic_url, char_id, success_messages, error_messages):
+                    response_messages.append(TextMessage(
+                        to=message.from_user,
+                        chat_id=message.chat_id,
+                        body=_("Bild wird verarbeitet. Du bekommst eine Nachricht, sobald das Bild gesetzt wurde.")
+                    ))
+                elif self.picture_ingestor is None and self.character_persistent_class.set_char_pic(
+                        char_user_id, self.get_from_userid(message), message.pic_url, char_id) is True:
+                    response_messages += success_messages
+                else:
+                    response_messages += error_messages
+                    user_command_status = status_obj['status']
+                    user_command_status_data = status_obj['data']
 
         # If its not a text message, give them another chance to use the suggested responses
         else:
@@ -758,7 +893,12 @@ class MessageController:
         # 5 messages per user).
 
         user.update_status(user_command_status, user_command_status_data)
-        self.character_persistent_class.update_user(user)
+        if self.last_request_buffer is not None and user.get_db_id() is not None and user.is_changed() is False:
+            # only last_request changed - it is written with the next flush of the buffer
+            self.last_request_buffer.bump(user.get_user_id())
+        else:
+            self.character_persistent_class.update_user(user)
+        # commits the changes of the command, without any it doesn't write anything
         self.character_persistent_class.commit()
         return response_messages
 
@@ -899,12 +1039,13 @@ class MessageController:
         elif pic_url is not None:
             response.add_response_message(PictureResponseMessage(pic_url))
 
+        names = self.get_names_of_users([char_data["user_id"], char_data["creator_id"]], append_user_id=True)
         body = _("{char_text}\n\n---\nCharakter von {from_user}\nErstellt von {creator_user}\nErstellt am {created:%d.%m.%Y %H:%M}{appendix}").format(
             char_text=str(char_data["text"]).format(
                 user=response.get_user()
             ),
-            from_user=self.get_name(char_data["user_id"], append_user_id=True),
-            creator_user=self.get_name(char_data['creator_id'], append_user_id=True),
+            from_user=names[char_data["user_id"]],
+            creator_user=names[char_data['creator_id']],
             created=datetime.datetime.fromtimestamp(char_data['created']),
             appendix=body_char_appendix,
         )
@@ -943,40 +1084,47 @@ class MessageController:
         return splitted_messages
 
     def get_name(self, user_id, append_user_id=False):
-        user_db = self.character_persistent_class.get_user(user_id)
-        user = LazyKikUser.init(user_db) if user_db is not None else LazyKikUser.init_new_user(user_id, self.bot_username)
-        if append_user_id is True:
-            return user["name_and_id"]
-        else:
-            return user["name_or_id"]
+        return self.get_names_of_users([user_id], append_user_id)[user_id]
+
+    def get_names_of_users(self, user_ids, append_user_id=False):
+        """
+        Resolves the names of all users of a response at once.
+
+        :rtype: dict[str, str]
+        """
+        users = LazyKikUser.init_many(user_ids, self.bot_username, load_users=False)
+        return {user_id: user["name_and_id" if append_user_id is True else "name_or_id"] for user_id, user in users.items()}
 
     def update_static_commands(self):
+        with MessageController.static_commands_lock:
+            self._update_static_commands()
+
+    def _update_static_commands(self):
         all_static_methods = self.character_persistent_class.get_all_static_messages()
-        current_static_methods = {obj["cmds"].db_id: (cmd_id, obj) for cmd_id, obj in enumerate(MessageController.methods) if isinstance(obj["cmds"], MessageCommandDB)}
+        current_static_methods = {obj["cmds"].db_id: obj for obj in MessageController.methods if isinstance(obj["cmds"], MessageCommandDB)}
 
         for db_row in all_static_methods:
             # update
             if db_row["id"] in current_static_methods:
-                (cmd_id, obj) = current_static_methods[db_row["id"]]
+                obj = current_static_methods.pop(db_row["id"])
                 if obj["cmds"].db_row != db_row:
                     commands = MessageCommandDB(db_row)
-                    obj["func"] = commands.get_method(MessageController.static_method)
-                    obj["cmds"] = commands
-                    MessageController.methods[cmd_id] = obj
-                current_static_methods.pop(db_row["id"], None)
+                    MessageController.methods.replace(obj, {
+                        "func": commands.get_method(MessageController.static_method),
+                        "cmds": commands
+                    })
 
             # insert
             else:
                 commands = MessageCommandDB(db_row)
                 MessageController.methods.append({
-                "func": commands.get_method(MessageController.static_method),
-                "cmds": commands
-            })
+                    "func": commands.get_method(MessageController.static_method),
+                    "cmds": commands
+                })
 
         # delete
-        for csm in current_static_methods:
-            MessageController.methods.remove(csm)
-
+        for obj in current_static_methods.values():
+            MessageController.methods.remove(obj)
 
     @staticmethod
     def is_aliased(message):
@@ -997,52 +1145,60 @@ class MessageController:
         return message.from_user.lower() in [x.strip().lower() for x in self.config.get("Admins", "admin1").split(',')]
 
     @staticmethod
-    def get_command_id(command):
-        cmd = str(command).strip().lower()
-        for cmd_id, obj in enumerate(MessageController.methods):
-            langs = obj["cmds"]
-            if langs is None:
-                continue
-
-            for lang_id, cmd_text in langs.items():
-                if lang_id != "_alts":
-                    if cmd_text.lower() == cmd:
-                        return cmd_id
-                else:
-                    for cmd_alt_text in cmd_text:
-                        if cmd_alt_text.lower() == cmd:
-                            return cmd_id
+    def get_command_method(command):
+        entry = MessageController.methods.lookup(command)
+        if entry is not None:
+            return entry["func"]
 
+        if MessageController.methods.fallback is not None:
+            return MessageController.methods.fallback["func"]
         return None
 
     @staticmethod
-    def get_command_method(command):
-        cmd = str(command).strip().lower()
-        none_func = None
-        for cmd_id, obj in enumerate(MessageController.methods):
-            langs = obj["cmds"]
-            if (langs is None):
-                none_func = obj["func"]
-                continue
-
-            for lang_id, cmd_text in langs.items():
-                if lang_id != "_alts":
-                    if cmd_text.lower() == cmd:
-                        return obj["func"]
-                else:
-                    for cmd_alt_text in cmd_text:
-                        if cmd_alt_text.lower() == cmd:
-                            return obj["func"]
+    def get_command(command):
+        entry = MessageController.methods.lookup(command)
+        if entry is None:
+            return None
 
-        return none_func
+        return entry['cmds'] # type: Union[dict, MessageCommand]
 
     @staticmethod
-    def get_command(command):
-        command_id = MessageController.get_command_id(command)
-        if command_id is None:
-            return None
+    def get_command_label(command):
+        """
+        Name of the command for the metrics - the static commands and unknown input each share one label to keep
+        the number of labels small.
+
+        :rtype: str
+        """
+        command = MessageController.get_command(command)
+        if command is None:
+            return "unknown"
+        if isinstance(command, MessageCommandDB):
+            return "static"
+        if isinstance(command, MessageCommand):
+            return command.command["de"]
+        return command["de"]
+
+    @staticmethod
+    def get_message_label(message: Message):
+        """
+        Label of the message for the metrics before its command is looked up.
+
+        :rtype: str
+        """
+        if not isinstance(message, TextMessage):
+            return str(message.type)
+        if message.body is None or message.body.strip() == "":
+            return "unknown"
+        return MessageController.get_command_label(message.body.split(None, 1)[0])
+
+    @staticmethod
+    def is_expensive_message(message: Message):
+        if not isinstance(message, TextMessage) or message.body is None or message.body.strip() == "":
+            return False
 
-        return MessageController.methods[command_id]['cmds'] # type: Union[dict, MessageCommand]
+        command = MessageController.get_command(message.body.split(None, 1)[0])
+        return isinstance(command, MessageCommand) and command.is_expensive()
 
     @staticmethod
     def get_command_text(command_str):
@@ -1060,6 +1216,9 @@ class MessageController:
     def add_method(commands):
         def add_method_decore(func):
 
+            if isinstance(commands, MessageCommand):
+                commands.compile()
+
             MessageController.methods.append({
                 "func": func if isinstance(commands, MessageCommand) is False else commands.get_method(func),
                 "cmds": commands
@@ -1129,11 +1288,15 @@ class MessageController:
 
         if linked_char_id is None and len(chars) > 1 and params[key] is None and use_first is False:
 
+            name_fields = {}
+            for field in self.character_persistent_class.get_char_fields(user_id, "name"):
+                name_fields.setdefault(field["char_id"], []).append("{}: {}".format(field["field"], field["value"]))
+
             chars_txt = ""
             for char in chars:
                 if chars_txt != "":
                     chars_txt += "\n---\n\n"
-                char_names = "\n".join(re.findall(r".*?name.*?:.*?\S+?.*", char["text"]))
+                char_names = "\n".join(name_fields.get(char["char_id"], []))
                 if char_names == "":
                     char_names = _("Im Steckbrief wurden keine Namen gefunden")
                 chars_txt += _("*Charakter {char_id}*\n{char_names}").format(
@@ -1424,6 +1587,16 @@ def msg_cmd_move(self, message, message_body, message_body_c, response_messages,
 
         if selected_from_user == self.get_from_userid(message):
             to_char_id = self.character_persistent_class.move_char(selected_from_user, selected_to_user, char_id)
+            if to_char_id is False:
+                response_messages.append(TextMessage(
+                    to=message.from_user,
+                    chat_id=message.chat_id,
+                    body=_("Der Charakter mit der Id {} konnte nicht gefunden werden.").format(
+                        char_id if char_id is not None else CharacterPersistentClass.get_min_char_id()
+                    ),
+                    keyboards=[SuggestedResponseKeyboard(responses=[MessageController.generate_text_response("Liste")])]
+                ))
+                return response_messages, user_command_status, user_command_status_data
 
             if char_id is not None and char_id != CharacterPersistentClass.get_min_char_id():
                 body = _("Du hast erfolgreich deinen {from_char_id}. Charakter auf @{to_user_id} ({to_char_id}.) verschoben.").format(
@@ -1451,6 +1624,16 @@ def msg_cmd_move(self, message, message_body, message_body_c, response_messages,
 
         elif self.is_admin(message):
             to_char_id = self.character_persistent_class.move_char(selected_from_user, selected_to_user, char_id)
+            if to_char_id is False:
+                response_messages.append(TextMessage(
+                    to=message.from_user,
+                    chat_id=message.chat_id,
+                    body=_("Der Charakter mit der Id {} konnte nicht gefunden werden.").format(
+                        char_id if char_id is not None else CharacterPersistentClass.get_min_char_id()
+                    ),
+                    keyboards=[SuggestedResponseKeyboard(responses=[MessageController.generate_text_response("Liste")])]
+                ))
+                return response_messages, user_command_status, user_command_status_data
 
             if char_id is not None and char_id != CharacterPersistentClass.get_min_char_id():
                 body = _("Du hast erfolgreich den {from_char_id}. Charakter von @{from_user_id} auf @{to_user_id} ({to_char_id}.) verschoben.").format(
@@ -1612,32 +1795,62 @@ def msg_cmd_delete_last(self, message, message_body, message_body_c, response_me
 #
 msg_cmd_search_command = MessageCommand([
     MessageParam.init_user_id(required=False),
-    MessageParam("name", MessageParam.CONST_REGEX_TEXT, examples=["Jan", "Mafu", "Aiden"], required=True),
-], "Suche", "search", require_auth=True)
+    MessageParam("name", r".+?", examples=["Jan", "Mafu", "Aiden", "Wesen = Vampir"], required=True),
+    MessageParam.init_page(),
+], "Suche", "search", require_auth=True, expensive=True)
 @MessageController.add_method(msg_cmd_search_command)
 def msg_cmd_search(response: CommandMessageResponse):
     message_controller = response.get_message_controller()
     character_persistent_class = message_controller.character_persistent_class  # type: CharacterPersistentClass
     user_id = response.get_value("user_id")
     plain_user_id = user_id[1:].lower() if user_id is not None else None
-
-    chars = character_persistent_class.search_char(response.get_value("name"), user_id=plain_user_id)
+    page = max(1, int(response.get_value("page")))
+    name = response.get_value("name")
+    limit = 10
+
+    # "Wesen = Vampir" searches a field of the sheets instead of the full text - unknown fields are just text
+    field_query = FIELD_QUERY_REGEX.match(name)
+    if field_query is not None and character_persistent_class.is_char_field(field_query.group(1)):
+        chars = character_persistent_class.find_chars_by_field(
+            field_query.group(1), field_query.group(2), user_id=plain_user_id, limit=limit + 1, offset=(page - 1) * limit
+        )
+    else:
+        chars = character_persistent_class.search_char(name, user_id=plain_user_id, limit=limit + 1, offset=(page - 1) * limit)
 
     if len(chars) == 0:
         response.add_response_message(_("Für die Suchanfrage wurden keine Charaktere gefunden."))
         response.set_suggestions(["Liste"])
         return response
 
-    if len(chars) == 1:
+    if len(chars) == 1 and page == 1:
         response = message_controller.create_char_messages(chars[0], response)
         return response
 
     suggestions = []
-    for char in chars:
+    dyn_message_data = {}
+    search_command = "Suche {}".format(user_id + " " if user_id is not None else "")
+    if page != 1:
+        dyn_message_data['left'] = "{}{} Seite {}".format(search_command, name, page - 1)
+        suggestions.append(u"\U00002B05\U0000FE0F")
+    if len(chars) > limit:
+        dyn_message_data['right'] = "{}{} Seite {}".format(search_command, name, page + 1)
+        suggestions.append(u"\U000027A1\U0000FE0F")
+
+    for char in chars[:limit]:
         suggestions.append(message_controller.generate_text_user_char("Anzeigen", char['user_id'], char['char_id'], response.get_orig_message()))
     suggestions.append("Liste")
 
-    response.add_response_message(_("Es wurden mehrere Charaktere gefunden, die deiner Suchanfrage entsprechen."))
+    body = _("Es wurden mehrere Charaktere gefunden, die deiner Suchanfrage entsprechen.")
+    if dyn_message_data != {}:
+        response.user_command_status = CharacterPersistentClass.STATUS_DYN_MESSAGES
+        response.user_command_status_data = dyn_message_data
+        body += _("\n\n(Seite {page} - weitere Ergebnisse: {icon_left} und {icon_right} zum navigieren)").format(
+            page=page,
+            icon_left=u"\U00002B05\U0000FE0F",
+            icon_right=u"\U000027A1\U0000FE0F"
+        )
+
+    response.add_response_message(body)
     response.set_suggestions(suggestions)
     return response
 
@@ -1860,7 +2073,7 @@ def msg_admin_cmd_unauth(response: CommandMessageResponse):
 # Befehl scan-active
 #
 scan_active_command = MessageCommand([
-], "Scanne-Active", "scan-active", [], require_admin=True)
+], "Scanne-Active", "scan-active", [], require_admin=True, expensive=True)
 @MessageController.add_method(scan_active_command)
 def scan_active(response: CommandMessageResponse):
     message_controller = response.get_message_controller()  # type: MessageController
@@ -2088,7 +2301,7 @@ def command_info(response: CommandMessageResponse):
 #
 msg_cmd_list_command = MessageCommand([
     MessageParam("page", MessageParam.CONST_REGEX_NUM, examples=range(1,4), default_value=1)
-], "Liste", "list", require_auth=True)
+], "Liste", "list", require_auth=True, expensive=True)
 @MessageController.add_method(msg_cmd_list_command)
 def msg_cmd_list(response: CommandMessageResponse):
     message_controller = response.get_message_controller()
@@ -2096,19 +2309,36 @@ def msg_cmd_list(response: CommandMessageResponse):
     page = int(response.get_value("page"))
     limit = 15
 
-    chars = character_persistent_class.list_all_users_with_chars(page)
-    user_ids = [item['user_id'] for item in chars[:limit]]
+    # pages reached by the arrows are read by the cursor stored in the status data, others by their number
+    status_obj = response.get_user().get_status_obj()
+    cursor = None
+    if status_obj is not None and status_obj['status'] == CharacterPersistentClass.STATUS_DYN_MESSAGES and status_obj['data'] is not None:
+        cursor = status_obj['data'].get('list_cursor', {}).get(str(page))
+
+    if cursor is not None and cursor[0] == "before":
+        # the page we came from follows this one
+        chars = character_persistent_class.list_all_users_with_chars(limit=limit, before=cursor[1:])[-limit:]
+        has_more = True
+    elif cursor is not None:
+        chars = character_persistent_class.list_all_users_with_chars(limit=limit, after=cursor[1:])
+        has_more = len(chars) > limit
+    else:
+        chars = character_persistent_class.list_all_users_with_chars(page)
+        has_more = len(chars) > limit
+    chars = chars[:limit]
+    user_ids = [item['user_id'] for item in chars]
+    user_names = message_controller.get_names_of_users(user_ids)
 
     bodys = [_("Liste aller Nutzer mit Charakteren:\n--- Seite {page} ---\n").format(page=page)]
     number = (page - 1) * limit + 1
-    for char in chars[:limit]:
+    for char in chars:
         bodys.append(_("{consecutive_number}.: {user_name}\n" +
               "Nutzername: @{user_id}\n" +
               "Anz. Charaktere: {chars_cnt}\n" +
               "letzte Änderung: {last_change:%d.%m.%Y}"
               ).format(
             consecutive_number=number,
-            user_name=message_controller.get_name(char['user_id']),
+            user_name=user_names[char['user_id']],
             user_id=char['user_id'],
             chars_cnt=char['chars_cnt'],
             last_change=datetime.datetime.fromtimestamp(char['created'])
@@ -2118,12 +2348,18 @@ def msg_cmd_list(response: CommandMessageResponse):
 
     suggestions = list()
     dyn_message_data = {}
+    list_cursor = {}
     if page != 1:
         dyn_message_data['left'] = "Liste {}".format(page - 1)
         suggestions.append(u"\U00002B05\U0000FE0F")
-    if len(chars) > limit:
+        if len(chars) > 0:
+            list_cursor[str(page - 1)] = ["before", chars[0]['created'], chars[0]['user_id']]
+    if has_more:
         dyn_message_data['right'] = "Liste {}".format(page + 1)
         suggestions.append(u"\U000027A1\U0000FE0F")
+        list_cursor[str(page + 1)] = ["after", chars[-1]['created'], chars[-1]['user_id']]
+    if list_cursor != {}:
+        dyn_message_data['list_cursor'] = list_cursor
 
     if dyn_message_data != {}:
         response.user_command_status = CharacterPersistentClass.STATUS_DYN_MESSAGES
@@ -2247,7 +2483,7 @@ def msg_cmd_more_examples(response: CommandMessageResponse):
 #
 dice_command = MessageCommand([
     MessageParam("term", MessageParam.CONST_REGEX_TEXT, examples=["3", "4", "12", "24", "Rot, Grün, Blau", "10D6", "20D12", "20D12 + 10D8", "100D6"])
-], "Würfeln", "dice", ["Würfel", u"\U0001F3B2", "roll"])
+], "Würfeln", "dice", ["Würfel", u"\U0001F3B2", "roll"], expensive=True)
 coin_command = MessageCommand([], "Münze", "coin")
 @MessageController.add_method(dice_command)
 @MessageController.add_method(coin_command)
@@ -2273,13 +2509,12 @@ def msg_cmd_roll(response: CommandMessageResponse):
             result = str(random.randint(1, count))
             thing = _("Der Würfel zeigt")
             body = "{}: {}".format(thing, result)
-        elif re.search(r"^(([0-9]+\s*([×x\*]\s*)?)?D\s*)?[0-9]+(\s*\+\s*(([0-9]+\s*([×x\*]\s*)?)?D\s*)?[0-9]+)*$", term,
-                       re.MULTILINE + re.IGNORECASE) is not None:
+        elif DICE_TERM_REGEX.search(term) is not None:
             dices = str(term).split("+")
             results = list()
             result_int = 0
             for dice in dices:
-                match = re.search(r"^((([0-9]+)\s*([×x\*]\s*)?)?D\s*)?([0-9]+)$", dice.strip(), re.MULTILINE + re.IGNORECASE)
+                match = DICE_REGEX.search(dice.strip())
                 if match.group(1) is None:
                     res = int(match.group(5))
                     result_int += res
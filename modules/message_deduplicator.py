@@ -0,0 +1,70 @@
+import time
+
+from kik.messages import Message
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.ttl_cache import TTLCache
+
+
+class MessageDeduplicator:
+    """
+    Kik redelivers a webhook if the bot answers too slowly. The ids of the processed messages are remembered,
+    so a redelivered message doesn't execute its command a second time. A message is stored as processed only
+    after it was processed successfully.
+    """
+
+    def __init__(self, character_persistent_class: CharacterPersistentClass, bot_username, max_size=10000, ttl=600,
+                 persistent=False):
+        self.character_persistent_class = character_persistent_class
+        self.bot_username = bot_username
+        self.ttl = int(ttl)
+        self.persistent = persistent
+        self.cache = TTLCache(max_size, ttl)
+        self.last_cleanup = 0
+
+    def is_duplicate(self, message: Message):
+        """
+        Checks if the message was processed or is being processed. The message is claimed by this process until it
+        is marked as processed or released again.
+
+        :rtype: bool
+        """
+        if message.id is None:
+            return False
+
+        if self.cache.add(message.id) is False:
+            return True
+
+        if self.persistent is True:
+            now = time.time()
+            if now - self.last_cleanup > self.ttl:
+                self.last_cleanup = now
+                self.character_persistent_class.remove_processed_messages(now - self.ttl)
+
+            # the table also knows the messages processed before a restart or by another process
+            if self.character_persistent_class.is_processed_message(message.id):
+                return True
+
+        return False
+
+    def mark_processed(self, message: Message):
+        if message.id is not None and self.persistent is True:
+            self.character_persistent_class.add_processed_message(message.id)
+
+    def release(self, message: Message):
+        """
+        Forgets a message which wasn't processed, so a redelivery of it is processed.
+        """
+        if message.id is not None:
+            self.cache.remove(message.id)
+
+    @staticmethod
+    def init_from_config(config, character_persistent_class: CharacterPersistentClass, bot_username):
+        persistent = config.get("MessageDedupPersistent", "False")
+        return MessageDeduplicator(
+            character_persistent_class,
+            bot_username,
+            config.get("MessageDedupSize", "10000"),
+            config.get("MessageDedupTTL", "600"),
+            persistent is True or str(persistent).lower() == "true"
+        )
@@ -0,0 +1,105 @@
+import queue
+import threading
+import traceback
+import zlib
+from concurrent.futures import Future
+
+
+class MessageLane:
+    """
+    A single worker thread with its own queue. All jobs of a lane are executed strictly in the order they were submitted.
+    """
+
+    def __init__(self, name):
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs) -> Future:
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            future, func, args, kwargs = job
+            if future.set_running_or_notify_cancel() is False:
+                continue
+
+            # noinspection PyBroadException
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self, wait=True):
+        self.queue.put(None)
+        if wait is True:
+            self.thread.join()
+
+
+class MessageDispatcher:
+    """
+    Distributes the messages on a fixed number of lanes by their chat (or sender). Messages of the same chat are
+    processed one after another in the order they arrived, different chats are processed in parallel.
+    """
+
+    def __init__(self, bot_username, worker_count=4, async_processing=False):
+        self.bot_username = bot_username
+        self.async_processing = async_processing
+        self.lanes = [MessageLane("message-lane-{}".format(i)) for i in range(0, max(1, int(worker_count)))]
+
+    @staticmethod
+    def get_lane_key(message):
+        return message.chat_id if message.chat_id is not None else message.from_user
+
+    def get_lane(self, key) -> MessageLane:
+        return self.lanes[zlib.crc32(str(key).encode("utf-8")) % len(self.lanes)]
+
+    def submit(self, key, func, *args, **kwargs) -> Future:
+        future = self.get_lane(key).submit(func, *args, **kwargs)
+        future.add_done_callback(self.log_error)
+        return future
+
+    def submit_message(self, message, func, *args, **kwargs) -> Future:
+        return self.submit(self.get_lane_key(message), func, message, *args, **kwargs)
+
+    def is_async(self):
+        return self.async_processing
+
+    def pending(self):
+        return sum(lane.pending() for lane in self.lanes)
+
+    def log_error(self, future: Future):
+        if future.cancelled() or future.exception() is None:
+            return
+
+        error = future.exception()
+        print("[{bot_username}] Worker-Error:\n---\nTrace: {trace}".format(
+            bot_username=self.bot_username,
+            trace="".join(traceback.format_exception(type(error), error, error.__traceback__))
+        ))
+
+    def shutdown(self, wait=True):
+        # the lanes finish the messages queued before the stop - all lanes are stopped first to drain them in parallel
+        for lane in self.lanes:
+            lane.stop(wait=False)
+        if wait is True:
+            for lane in self.lanes:
+                lane.thread.join()
+
+    @staticmethod
+    def init_from_config(config, bot_username):
+        async_processing = config.get("AsyncProcessing", "False")
+        return MessageDispatcher(
+            bot_username,
+            config.get("ProcessingWorkers", "4"),
+            async_processing is True or str(async_processing).lower() == "true"
+        )
@@ -0,0 +1,107 @@
+import bisect
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the processing stages, labeled by the command which is currently processed
+    by the thread. Rendered in the Prometheus text format.
+    """
+
+    BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+    NO_COMMAND = "-"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {}
+        self.histograms = {}
+
+    def set_command(self, command):
+        self.local.command = command
+
+    def get_command(self):
+        return getattr(self.local, "command", None) or Metrics.NO_COMMAND
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, command=None):
+        key = (stage, command if command is not None else self.get_command())
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(Metrics.BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(Metrics.BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, stage, command=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, command)
+
+    @staticmethod
+    def format_labels(labels):
+        return "{" + ",".join("{}=\"{}\"".format(
+            key, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        ) for key, value in labels) + "}"
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(value[0]), value[1], value[2]) for key, value in self.histograms.items()}
+
+        lines = []
+        for name in sorted(set(key[0] for key in counters)):
+            lines.append("# TYPE {} counter".format(name))
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append("{}{} {}".format(name, Metrics.format_labels(labels), value))
+
+        name = "kikbot_stage_seconds"
+        lines.append("# HELP {} Time spent in the processing stages per command".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for (stage, command), (buckets, total, count) in sorted(histograms.items()):
+            labels = [("stage", stage), ("command", command)]
+            cumulative = 0
+            for bound, bucket_count in zip(Metrics.BUCKETS + ["+Inf"], buckets):
+                cumulative += bucket_count
+                lines.append("{}_bucket{} {}".format(name, Metrics.format_labels(labels + [("le", bound)]), cumulative))
+            lines.append("{}_sum{} {}".format(name, Metrics.format_labels(labels), total))
+            lines.append("{}_count{} {}".format(name, Metrics.format_labels(labels), count))
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor which records the time spent in SQLite as the stage "sqlite".
+    """
+
+    def execute(self, *args, **kwargs):
+        with metrics.timer("sqlite"):
+            return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with metrics.timer("sqlite"):
+            return super().executemany(*args, **kwargs)
+
+    def fetchone(self):
+        with metrics.timer("sqlite"):
+            return super().fetchone()
+
+    def fetchall(self):
+        with metrics.timer("sqlite"):
+            return super().fetchall()
@@ -0,0 +1,99 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import requests
+from kik.messages import Message
+from requests.adapters import HTTPAdapter
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.kik_sender import KikMessageSender
+from modules.metrics import metrics
+
+
+class PictureIngestor:
+    """
+    Downloads the pictures of the characters in a bounded pool of background threads with a shared http session.
+    The request is answered immediately, the result is sent as a follow-up message.
+    """
+
+    def __init__(self, character_persistent_class: CharacterPersistentClass, message_sender: KikMessageSender, bot_username,
+                 max_workers=2, max_pending=50, timeout=10, max_size=5242880):
+        self.character_persistent_class = character_persistent_class
+        self.message_sender = message_sender
+        self.bot_username = bot_username
+        self.max_workers = int(max_workers)
+        self.max_pending = int(max_pending)
+        self.timeout = float(timeout)
+        self.max_size = int(max_size)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="picture-ingestor")
+        self.pending = 0
+        self.futures = set()
+        self.lock = threading.Lock()
+
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.http_session.mount("http://", adapter)
+        self.http_session.mount("https://", adapter)
+
+    def submit(self, user_id, creator_id, pic_url, char_id, success_messages: List[Message], error_messages: List[Message]):
+        """
+        Queues the picture. The messages are sent depending on the result.
+
+        :return: False if too many pictures are waiting already
+        :rtype: bool
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                metrics.inc("kikbot_pictures_total", {"result": "rejected"})
+                return False
+            self.pending += 1
+            future = self.executor.submit(self.run, user_id, creator_id, pic_url, char_id, success_messages, error_messages)
+            self.futures.add(future)
+
+        future.add_done_callback(self.futures.discard)
+        return True
+
+    def run(self, user_id, creator_id, pic_url, char_id, success_messages, error_messages):
+        success = False
+        # noinspection PyBroadException
+        try:
+            with metrics.timer("picture", "Bild-setzen"):
+                success = self.character_persistent_class.set_char_pic(
+                    user_id, creator_id, pic_url, char_id, self.http_session, self.timeout, self.max_size
+                )
+                self.character_persistent_class.commit()
+        except:
+            if self.character_persistent_class.connection is not None:
+                self.character_persistent_class.connection.rollback()
+            print("[{bot_username}] Picture-Error:\n---\nTrace: {trace}".format(
+                bot_username=self.bot_username,
+                trace=traceback.format_exc()
+            ))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+        metrics.inc("kikbot_pictures_total", {"result": "set" if success is True else "failed"})
+        self.message_sender.send(success_messages if success is True else error_messages)
+
+    def shutdown(self):
+        # shutdown(cancel_futures=True) needs python 3.9 - the waiting pictures are cancelled one by one
+        with self.lock:
+            for future in list(self.futures):
+                future.cancel()
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def init_from_config(config, character_persistent_class: CharacterPersistentClass, message_sender: KikMessageSender,
+                         bot_username):
+        return PictureIngestor(
+            character_persistent_class,
+            message_sender,
+            bot_username,
+            config.get("PictureWorkers", "2"),
+            config.get("PictureMaxPending", "50"),
+            config.get("PictureTimeout", "10"),
+            config.get("PictureMaxSize", "5242880")
+        )
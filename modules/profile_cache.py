@@ -0,0 +1,64 @@
+from modules.ttl_cache import TTLCache
+
+
+class ProfileCache:
+    """
+    Kik profiles by user id, shared by all requests of the process. An entry is the newest stored profile or None
+    if no profile is stored. Failed requests of a profile are remembered separately, so they are not repeated
+    until the failure expired.
+    """
+
+    MISSING = TTLCache.MISSING
+
+    def __init__(self, max_size=10000, ttl=600, failure_ttl=600):
+        self.profiles = TTLCache(max_size, ttl, lru=True)
+        self.failures = TTLCache(max_size, failure_ttl)
+
+    def get(self, user_id):
+        """
+
+        :return: the profile, None if the user has no profile or ProfileCache.MISSING if the user isn't cached
+        """
+        return self.profiles.get(user_id.lower(), ProfileCache.MISSING)
+
+    def get_many(self, user_ids, load):
+        """
+        Returns the cached profiles, the missing ones are loaded with one call of load(user_ids).
+
+        :type load: (list[str]) -> dict[str, sqlite3.Row]
+        :rtype: dict[str, dict|None]
+        """
+        profiles = {}
+        missing_user_ids = []
+        for user_id in user_ids:
+            profile = self.get(user_id)
+            if profile is ProfileCache.MISSING:
+                missing_user_ids.append(user_id.lower())
+            else:
+                profiles[user_id.lower()] = profile
+
+        if len(missing_user_ids) != 0:
+            loaded = load(missing_user_ids)
+            for user_id in missing_user_ids:
+                profiles[user_id] = self.set(user_id, loaded.get(user_id))
+
+        return profiles
+
+    def set(self, user_id, profile):
+        profile = dict(profile) if profile is not None else None
+        self.profiles.set(user_id.lower(), profile)
+        return profile
+
+    def set_failed(self, user_id):
+        self.failures.set(user_id.lower(), True)
+
+    def is_failed(self, user_id):
+        return user_id.lower() in self.failures
+
+    @staticmethod
+    def init_from_config(config):
+        return ProfileCache(
+            config.get("ProfileCacheSize", "10000"),
+            config.get("ProfileCacheTTL", "600"),
+            config.get("ProfileRefreshFailureTTL", "600")
+        )
@@ -0,0 +1,189 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from kik import KikApi, KikError
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.kik_user import LazyKikUser
+from modules.metrics import metrics
+from modules.profile_cache import ProfileCache
+from modules.ttl_cache import TTLCache
+
+
+class ProfileRefresher:
+    """
+    Fetches Kik profiles in a bounded pool of background threads and stores them in the database and the profile
+    cache. Requests for a user whose profile is already being fetched get the running request, users whose request
+    failed are not requested again until the failure expired.
+    """
+
+    def __init__(self, kik_api: KikApi, character_persistent_class: CharacterPersistentClass, profile_cache: ProfileCache,
+                 bot_username, max_workers=4, max_pending=1000, wait_timeout=2, max_prefetch=2, prefetch_interval=300):
+        self.kik_api = kik_api
+        self.character_persistent_class = character_persistent_class
+        self.profile_cache = profile_cache
+        self.bot_username = bot_username
+        self.max_pending = int(max_pending)
+        self.wait_timeout = float(wait_timeout)
+        self.executor = ThreadPoolExecutor(max_workers=int(max_workers), thread_name_prefix="profile-refresher")
+        self.in_flight = {}  # type: dict[str, Future]
+        self.lock = threading.Lock()
+        # prefetching only uses a part of the workers - the requests waiting for a profile use the rest
+        self.max_prefetch = int(max_prefetch)
+        self.prefetching = 0
+        self.prefetched_chats = TTLCache(10000, int(prefetch_interval))
+        # the prefetch of a chat waits for the cache and the database, not for a worker of the refreshes
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-prefetch")
+        self.prefetch_futures = set()
+
+    def refresh(self, user_id):
+        """
+        Requests the profile of the user in the background.
+
+        :rtype: Future|None
+        """
+        user_id = user_id.lower()
+        if self.profile_cache.is_failed(user_id):
+            return None
+
+        with self.lock:
+            future = self.in_flight.get(user_id)
+            if future is not None:
+                return future
+            if len(self.in_flight) >= self.max_pending:
+                metrics.inc("kikbot_profile_refresh_total", {"result": "skipped"})
+                return None
+
+            future = self.executor.submit(self.run, user_id)
+            self.in_flight[user_id] = future
+            return future
+
+    def fetch(self, user_ids):
+        """
+        Requests the profiles and waits for them - for users who have no stored profile at all.
+
+        :rtype: dict[str, dict]
+        """
+        futures = {user_id: self.refresh(user_id) for user_id in user_ids}
+        futures = {user_id: future for user_id, future in futures.items() if future is not None}
+        if len(futures) == 0:
+            return {}
+
+        # one deadline for all users - the ones not done by then are shown by their id
+        done, not_done = wait(futures.values(), timeout=self.wait_timeout)
+        profiles = {}
+        for user_id, future in futures.items():
+            if future not in done or future.cancelled() or future.exception() is not None:
+                continue
+            profile = future.result()
+            if profile is not None:
+                profiles[user_id] = profile
+        return profiles
+
+    def prefetch(self, chat_id, user_ids):
+        """
+        Warms the profiles of the participants of a group in the background, at most once per prefetch interval
+        and chat.
+        """
+        if self.max_prefetch <= 0 or not user_ids or self.prefetched_chats.add(chat_id) is False:
+            return
+
+        with self.lock:
+            if self.prefetching >= self.max_prefetch:
+                # the chat is tried again with the next message
+                self.prefetched_chats.remove(chat_id)
+                return
+            future = self.prefetch_executor.submit(self.run_prefetch, chat_id, list(user_ids))
+            self.prefetch_futures.add(future)
+        future.add_done_callback(self.prefetch_futures.discard)
+
+    def run_prefetch(self, chat_id, user_ids):
+        # noinspection PyBroadException
+        try:
+            profiles = self.profile_cache.get_many(user_ids, self.character_persistent_class.get_kik_users)
+            now = time.time()
+            stale_user_ids = [
+                user_id for user_id, profile in profiles.items()
+                if (profile is None or now > profile["created"] + LazyKikUser.max_age) and not self.profile_cache.is_failed(user_id)
+            ]
+
+            for user_id in stale_user_ids:
+                with self.lock:
+                    prefetch_full = self.prefetching >= self.max_prefetch
+                    if not prefetch_full:
+                        self.prefetching += 1
+                if prefetch_full:
+                    self.prefetched_chats.remove(chat_id)
+                    break
+
+                future = self.refresh(user_id)
+                if future is None:
+                    self.prefetch_done()
+                    continue
+                future.add_done_callback(self.prefetch_done)
+                metrics.inc("kikbot_profile_prefetch_total")
+        except Exception as e:
+            self.prefetched_chats.remove(chat_id)
+            print("[{bot_username}] Profile der Gruppe {chat_id} konnten nicht geladen werden: {error}".format(
+                bot_username=self.bot_username,
+                chat_id=chat_id,
+                error=e
+            ))
+
+    def prefetch_done(self, future=None):
+        with self.lock:
+            self.prefetching -= 1
+
+    def run(self, user_id):
+        try:
+            print("[{bot_username}] Get Kik User {user_id}".format(bot_username=self.bot_username, user_id=user_id))
+            with metrics.timer("kik_api", "profile_refresh"):
+                kik_user = self.kik_api.get_user(user_id)
+
+            profile = self.character_persistent_class.add_kik_user_data(user_id, kik_user)
+            self.character_persistent_class.commit()
+            metrics.inc("kikbot_profile_refresh_total", {"result": "refreshed"})
+            return self.profile_cache.set(user_id, profile)
+        except KikError:
+            self.profile_cache.set_failed(user_id)
+            metrics.inc("kikbot_profile_refresh_total", {"result": "failed"})
+            return None
+        except Exception as e:
+            self.profile_cache.set_failed(user_id)
+            metrics.inc("kikbot_profile_refresh_total", {"result": "failed"})
+            print("[{bot_username}] Kik User {user_id} konnte nicht aktualisiert werden: {error}".format(
+                bot_username=self.bot_username,
+                user_id=user_id,
+                error=e
+            ))
+            return None
+        finally:
+            with self.lock:
+                self.in_flight.pop(user_id, None)
+
+    def shutdown(self):
+        # shutdown(cancel_futures=True) needs python 3.9 - the waiting refreshes are cancelled one by one
+        with self.lock:
+            for future in list(self.prefetch_futures):
+                future.cancel()
+            for user_id, future in list(self.in_flight.items()):
+                if future.cancel():
+                    self.in_flight.pop(user_id, None)
+        self.prefetch_executor.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def init_from_config(config, kik_api: KikApi, character_persistent_class: CharacterPersistentClass,
+                         profile_cache: ProfileCache, bot_username):
+        return ProfileRefresher(
+            kik_api,
+            character_persistent_class,
+            profile_cache,
+            bot_username,
+            config.get("ProfileRefreshWorkers", "4"),
+            config.get("ProfileRefreshMaxPending", "1000"),
+            config.get("ProfileRefreshWaitTimeout", "2"),
+            config.get("ProfilePrefetchMaxConcurrent", "2"),
+            config.get("ProfilePrefetchInterval", "300")
+        )
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from kik.messages import Message
+
+from modules.metrics import metrics
+from modules.ttl_cache import TTLCache
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now if now is not None else time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """
+    Admission control with token buckets per user and per chat. Expensive commands additionally take a token
+    of a smaller bucket of the user. A rate of 0 disables the bucket.
+    """
+
+    ADMIT = 0
+    SHED = 1  # answer with a short canned reply instead of processing the message
+    DROP = 2  # ignore the message completely, the server is too busy even for the canned reply
+
+    def __init__(self, bot_username, user_rate=1.0, user_burst=10, chat_rate=3.0, chat_burst=30, expensive_rate=0.2,
+                 expensive_burst=3, max_pending=100, max_keys=10000):
+        self.bot_username = bot_username
+        self.limits = {
+            "user": (float(user_rate), float(user_burst)),
+            "chat": (float(chat_rate), float(chat_burst)),
+            "expensive": (float(expensive_rate), float(expensive_burst))
+        }
+        self.max_pending = int(max_pending)
+        # a bucket is only forgotten once it is full again - a drained one would come back full
+        self.buckets = {}
+        self.cleanup_interval = 60
+        self.last_cleanup = time.time()
+        self.notified = TTLCache(max_keys, 60)
+        self.lock = threading.Lock()
+
+    def get_bucket(self, kind, key, now=None):
+        rate, burst = self.limits[kind]
+        if rate <= 0 or key is None:
+            return None
+
+        bucket = self.buckets.get((kind, key))
+        if bucket is None:
+            # a new bucket is refilled with the same now - a later timestamp would take a part of its first token
+            bucket = TokenBucket(rate, burst, now)
+            self.buckets[(kind, key)] = bucket
+        return bucket
+
+    def remove_full_buckets(self, now):
+        for key, bucket in list(self.buckets.items()):
+            if bucket.is_full(now):
+                del self.buckets[key]
+
+    def admit(self, message: Message, expensive=False, pending=0):
+        """
+        Decides if the message may be processed. All buckets have to have a token left, only then tokens are taken.
+
+        :rtype: int
+        """
+        now = time.time()
+        with self.lock:
+            if now - self.last_cleanup > self.cleanup_interval:
+                self.last_cleanup = now
+                self.remove_full_buckets(now)
+
+            buckets = [self.get_bucket("user", message.from_user, now), self.get_bucket("chat", message.chat_id, now)]
+            if expensive is True:
+                buckets.append(self.get_bucket("expensive", message.from_user, now))
+            buckets = [bucket for bucket in buckets if bucket is not None]
+
+            for bucket in buckets:
+                bucket.refill(now)
+
+            if all(bucket.tokens >= 1 for bucket in buckets):
+                for bucket in buckets:
+                    bucket.tokens -= 1
+                metrics.inc("kikbot_rate_limit_total", {"result": "admitted", "expensive": str(expensive).lower()})
+                return RateLimiter.ADMIT
+
+            if 0 < self.max_pending <= pending or self.notified.add(message.from_user) is False:
+                # the user already got a canned reply recently - don't flood the chat with them
+                metrics.inc("kikbot_rate_limit_total", {"result": "dropped", "expensive": str(expensive).lower()})
+                return RateLimiter.DROP
+
+            metrics.inc("kikbot_rate_limit_total", {"result": "shed", "expensive": str(expensive).lower()})
+            return RateLimiter.SHED
+
+    @staticmethod
+    def init_from_config(config, bot_username):
+        return RateLimiter(
+            bot_username,
+            config.get("RateLimitUserRate", "1"),
+            config.get("RateLimitUserBurst", "10"),
+            config.get("RateLimitChatRate", "3"),
+            config.get("RateLimitChatBurst", "30"),
+            config.get("RateLimitExpensiveRate", "0.2"),
+            config.get("RateLimitExpensiveBurst", "3"),
+            config.get("RateLimitMaxPending", "100")
+        )
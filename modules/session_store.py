@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+import traceback
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.ttl_cache import TTLCache
+
+
+class SessionState:
+    """
+    The command status of a user in a chat, e.g. the targets of the navigation shortcuts.
+    """
+
+    __slots__ = ["status", "data", "updated"]
+
+    def __init__(self, status=CharacterPersistentClass.STATUS_NONE, data=None, updated=None):
+        self.status = status
+        self.data = data
+        self.updated = int(updated if updated is not None else time.time())
+
+    def is_empty(self):
+        return self.status == CharacterPersistentClass.STATUS_NONE and self.data is None
+
+    def get_status_obj(self):
+        return {"status": self.status, "data": self.data}
+
+    def encode(self):
+        return json.dumps([self.status, self.data], separators=(",", ":"), ensure_ascii=False)
+
+    @staticmethod
+    def decode(state, updated):
+        status, data = json.loads(state)
+        return SessionState(status, data, updated)
+
+
+class SessionStore:
+    """
+    The session states by (user_id, chat_id) in a bounded cache. Changed states are written to the table sessions
+    every flush interval, states older than the ttl are forgotten.
+
+    Some statuses belong to the user in all chats, e.g. set-picture: the command is sent in a group, the picture
+    in the direct chat. They are kept with an empty chat_id until the next status of the user replaces them.
+    """
+
+    USER_STATUSES = [CharacterPersistentClass.STATUS_SET_PICTURE]
+    USER_CHAT_ID = ""
+
+    def __init__(self, character_persistent_class: CharacterPersistentClass, bot_username, max_size=10000, ttl=86400,
+                 flush_interval_ms=1000):
+        self.character_persistent_class = character_persistent_class
+        self.bot_username = bot_username
+        self.ttl = int(ttl)
+        self.flush_interval = max(10, int(flush_interval_ms)) / 1000
+        # a cached None means the user has no session in the chat
+        self.cache = TTLCache(max_size, self.ttl, lru=True)
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_cleanup = 0
+
+        self.thread = threading.Thread(target=self.run, name="session-store", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def get_key(user_id, chat_id):
+        return user_id.lower(), chat_id
+
+    def get(self, user_id, chat_id):
+        """
+
+        :rtype: SessionState|None
+        """
+        state = self.get_state(user_id, SessionStore.USER_CHAT_ID)
+        if state is not None and not state.is_empty():
+            return state
+        return self.get_state(user_id, chat_id)
+
+    def get_state(self, user_id, chat_id):
+        key = self.get_key(user_id, chat_id)
+        state = self.cache.get(key, TTLCache.MISSING)
+        if state is not TTLCache.MISSING:
+            return state
+
+        row = self.character_persistent_class.get_session(key[0], key[1], int(time.time()) - self.ttl)
+        state = SessionState.decode(row["state"], row["updated"]) if row is not None else None
+        self.cache.set(key, state)
+        return state
+
+    def set(self, user_id, chat_id, status, data=None):
+        if status in SessionStore.USER_STATUSES:
+            self.set_state(user_id, SessionStore.USER_CHAT_ID, status, data)
+            self.set_state(user_id, chat_id, CharacterPersistentClass.STATUS_NONE)
+        else:
+            self.set_state(user_id, SessionStore.USER_CHAT_ID, CharacterPersistentClass.STATUS_NONE)
+            self.set_state(user_id, chat_id, status, data)
+
+    def set_state(self, user_id, chat_id, status, data=None):
+        current = self.get_state(user_id, chat_id)
+        state = SessionState(status, data)
+        # most commands don't have a status - there is nothing to write if there was none before either
+        if (current is None and state.is_empty()) or (current is not None and current.status == status and current.data == data):
+            return
+
+        key = self.get_key(user_id, chat_id)
+        with self.lock:
+            self.cache.set(key, state)
+            self.dirty[key] = state
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            # noinspection PyBroadException
+            try:
+                self.flush()
+            except:
+                print("[{bot_username}] Session-Error:\n---\nTrace: {trace}".format(
+                    bot_username=self.bot_username,
+                    trace=traceback.format_exc()
+                ))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                dirty = self.dirty
+                self.dirty = {}
+
+            if len(dirty) != 0:
+                try:
+                    self.character_persistent_class.set_sessions([
+                        (user_id, chat_id, state.encode(), state.updated) for (user_id, chat_id), state in dirty.items()
+                    ])
+                except:
+                    # newer states which were set in the meantime win
+                    with self.lock:
+                        for key, state in dirty.items():
+                            self.dirty.setdefault(key, state)
+                    raise
+
+            now = time.time()
+            if now - self.last_cleanup > 3600:
+                self.last_cleanup = now
+                self.character_persistent_class.remove_sessions(int(now) - self.ttl)
+
+    @staticmethod
+    def init_from_config(config, character_persistent_class: CharacterPersistentClass, bot_username):
+        return SessionStore(
+            character_persistent_class,
+            bot_username,
+            config.get("SessionCacheSize", "10000"),
+            config.get("SessionTTL", "86400"),
+            config.get("SessionFlushInterval", "1000")
+        )
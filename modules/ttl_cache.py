@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A thread safe, size bounded cache. Entries expire after ttl seconds, if the cache is full
+    the least recently set entry is dropped - with lru the least recently used one.
+    """
+
+    MISSING = object()
+
+    def __init__(self, max_size=1000, ttl=600, lru=False):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.lru = lru
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, TTLCache.MISSING)
+            if entry is TTLCache.MISSING:
+                return default
+
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return default
+            if self.lru is True:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self._set(key, value)
+
+    def add(self, key, value=True):
+        """
+        Sets the value only if the key is not cached yet.
+
+        :return: True if the value was added, False if the key was already cached
+        :rtype: bool
+        """
+        with self.lock:
+            entry = self.entries.get(key, TTLCache.MISSING)
+            if entry is not TTLCache.MISSING and entry[1] >= time.time():
+                return False
+            self._set(key, value)
+            return True
+
+    def _set(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = (value, time.time() + self.ttl)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key, TTLCache.MISSING) is not TTLCache.MISSING
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,40 @@
+""" Benchmark for the command lookup of the MessageController.
+
+Registers an increasing number of dummy commands (like a custom module does) and measures the lookup time
+of a command registered first, one registered last and an unknown command. The time per lookup should
+stay the same, regardless of the number of registered commands.
+
+Run with: python -m test.benchmark_command_registry
+"""
+import timeit
+
+from modules.message_controller import CommandRegistry, MessageCommand
+
+
+def build_registry(count):
+    registry = CommandRegistry()
+    registry.append({"func": None, "cmds": {"de": "Hilfe", "en": "help", "_alts": ["?", "h"]}})
+    for i in range(0, count):
+        registry.append({
+            "func": None,
+            "cmds": MessageCommand([], "Befehl-{}".format(i), "command-{}".format(i), ["cmd-{}".format(i), "c{}".format(i)])
+        })
+    return registry
+
+
+def main():
+    runs = 100000
+    print("{:>8} {:>12} {:>12} {:>12}".format("commands", "first (µs)", "last (µs)", "unknown (µs)"))
+    for count in [10, 50, 100, 500, 1000]:
+        registry = build_registry(count)
+        last = "CMD-{}".format(count - 1)
+        times = [
+            timeit.timeit(lambda: registry.lookup("hilfe"), number=runs),
+            timeit.timeit(lambda: registry.lookup(last), number=runs),
+            timeit.timeit(lambda: registry.lookup("unbekannt"), number=runs),
+        ]
+        print("{:>8} {:>12.3f} {:>12.3f} {:>12.3f}".format(count, *[t / runs * 1000000 for t in times]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+""" Base class for tests with a database. Run from the root of the repository, the base schema is read
+from database.sql. """
+import os
+import shutil
+import tempfile
+import unittest
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.database_connection import ConnectionManager
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """ Base class for tests with a new database in a temporary directory"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {
+            "DatabasePath": os.path.join(self.directory, "database.db"),
+            "PicturePath": self.directory
+        }
+        self.cpc = CharacterPersistentClass(self.config, "testbot")
+
+    def tearDown(self):
+        self.cpc.connection_manager.close_all()
+        with ConnectionManager.managers_lock:
+            ConnectionManager.managers.pop(self.cpc.database_path, None)
+        shutil.rmtree(self.directory)
+
+    def query(self, sql, params=None):
+        self.cpc.connect_database()
+        return [tuple(row) for row in self.cpc.connection.execute(sql, params if params is not None else [])]
@@ -0,0 +1,281 @@
+""" Unittests for the database of the characters. Run from the root of the repository, the base schema is read
+from database.sql. """
+import sqlite3
+
+import mock
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.database_migration import Migration, MigrationRunner
+from test.database_test_case import DatabaseTestCase
+
+
+class MigrationTests(DatabaseTestCase):
+    """ Migration and MigrationRunner test class"""
+
+    def test_all_core_migrations_applied(self):
+        versions = [migration.version for migration in self.cpc.get_migrations()["core"]]
+
+        self.assertEqual(self.query("SELECT version FROM schema_version WHERE scope = 'core'"), [(max(versions),)])
+        self.assertEqual(len(versions), len(set(versions)))
+
+    def test_migrations_run_once(self):
+        updated = self.query("SELECT updated FROM schema_version WHERE scope = 'core'")
+        self.cpc.connection.execute("UPDATE schema_version SET updated = 0 WHERE scope = 'core'")
+        self.cpc.commit()
+
+        CharacterPersistentClass(self.config, "testbot")
+        self.assertNotEqual(updated, [(0,)])
+        self.assertEqual(self.query("SELECT updated FROM schema_version WHERE scope = 'core'"), [(0,)])
+
+    def test_scope_with_script_and_func(self):
+        migrations = [
+            Migration(2, "Spalte", func=lambda connection: connection.execute("ALTER TABLE test_table ADD COLUMN value TEXT")),
+            Migration(1, "Tabelle", script="CREATE TABLE test_table (id INTEGER PRIMARY KEY); CREATE INDEX test_index ON test_table (id);"),
+        ]
+        MigrationRunner(self.cpc.database_path, "testbot").run("test", migrations)
+
+        self.assertEqual(self.query("SELECT version FROM schema_version WHERE scope = 'test'"), [(2,)])
+        self.assertEqual([row[1] for row in self.query("PRAGMA table_info(test_table)")], ["id", "value"])
+
+    def test_failed_migration_is_rolled_back(self):
+        migrations = [
+            Migration(1, "Tabelle", script="CREATE TABLE test_table (id INTEGER PRIMARY KEY);"),
+            Migration(2, "Fehler", script="CREATE TABLE test_table_2 (id INTEGER); INSERT INTO missing_table VALUES (1);"),
+        ]
+        with self.assertRaises(sqlite3.OperationalError):
+            MigrationRunner(self.cpc.database_path, "testbot").run("test", migrations)
+
+        self.assertEqual(self.query("SELECT version FROM schema_version WHERE scope = 'test'"), [(1,)])
+        self.assertFalse(Migration.table_exists(self.cpc.connection, "test_table_2"))
+
+    def test_split_statements(self):
+        statements = Migration.split_statements(
+            "CREATE TABLE a (id INTEGER); CREATE TRIGGER t AFTER INSERT ON a BEGIN DELETE FROM a; END; ;"
+        )
+        self.assertEqual(len(statements), 2)
+
+
+class CharacterHeadsTests(DatabaseTestCase):
+    """ character_heads and user_char_summary test class"""
+
+    def get_heads(self, user_id):
+        return self.query((
+            "SELECT char_id, text, prev_char_id, next_char_id "
+            "FROM character_heads "
+            "WHERE user_id = ? AND deleted IS NULL "
+            "ORDER BY char_id"
+        ), [user_id])
+
+    def assert_summary(self):
+        """ The summary has to be the same as the aggregate of the heads"""
+        self.assertEqual(
+            self.query("SELECT user_id, chars_cnt, last_change FROM user_char_summary ORDER BY user_id"),
+            self.query((
+                "SELECT user_id, COUNT(*), MAX(created) "
+                "FROM character_heads "
+                "WHERE deleted IS NULL "
+                "GROUP BY user_id "
+                "ORDER BY user_id"
+            ))
+        )
+
+    def test_add(self):
+        self.assertEqual(self.cpc.add_char("User", "user", "Name: Jan"), 1)
+        self.assertEqual(self.cpc.add_char("user", "user", "Name: Mafu"), 2)
+
+        self.assertEqual(self.get_heads("user"), [(1, "Name: Jan", None, 2), (2, "Name: Mafu", 1, None)])
+        self.assertEqual(self.query("SELECT user_id, chars_cnt FROM user_char_summary"), [("user", 2)])
+        self.assert_summary()
+
+    def test_change(self):
+        self.cpc.add_char("user", "user", "Name: Jan")
+        first_version = self.cpc.get_char("user", 1)["id"]
+        self.cpc.change_char("user", "admin", "Name: Jan Janssen", 1)
+
+        char = self.cpc.get_char("user", 1)
+        self.assertEqual(char["text"], "Name: Jan Janssen")
+        self.assertEqual(char["creator_id"], "admin")
+        self.assertNotEqual(char["id"], first_version)
+        self.assertFalse(self.cpc.change_char("user", "user", "Name: Aiden", 2))
+        self.assert_summary()
+
+    def test_remove_last_change(self):
+        self.cpc.add_char("user", "user", "Name: Jan")
+        self.cpc.change_char("user", "user", "Name: Jan Janssen", 1)
+        self.cpc.remove_last_char_change("user", "user", 1)
+
+        self.assertEqual(self.cpc.get_char("user", 1)["text"], "Name: Jan")
+        self.assert_summary()
+
+    def test_remove_relinks_neighbours(self):
+        for name in ["Jan", "Mafu", "Aiden"]:
+            self.cpc.add_char("user", "user", "Name: " + name)
+        self.cpc.remove_char("user", "user", 2)
+
+        self.assertIsNone(self.cpc.get_char("user", 2))
+        self.assertEqual(self.get_heads("user"), [(1, "Name: Jan", None, 3), (3, "Name: Aiden", 1, None)])
+        self.assertEqual(self.query("SELECT chars_cnt FROM user_char_summary WHERE user_id = 'user'"), [(2,)])
+        self.assert_summary()
+
+    def test_remove_all(self):
+        self.cpc.add_char("user", "user", "Name: Jan")
+        self.cpc.remove_char("user", "user", 1)
+
+        self.assertEqual(self.get_heads("user"), [])
+        self.assertEqual(self.query("SELECT * FROM user_char_summary"), [])
+
+    def test_move(self):
+        self.cpc.add_char("from", "from", "Name: Jan")
+        self.cpc.add_char("from", "from", "Name: Mafu")
+        self.cpc.add_char("to", "to", "Name: Aiden")
+
+        self.assertEqual(self.cpc.move_char("from", "to", 1), 2)
+        self.assertEqual(self.get_heads("from"), [(2, "Name: Mafu", None, None)])
+        self.assertEqual(self.get_heads("to"), [(1, "Name: Aiden", None, 2), (2, "Name: Jan", 1, None)])
+        self.assert_summary()
+
+    def test_picture(self):
+        self.cpc.add_char("user", "user", "Name: Jan")
+        self.cpc.connection.execute((
+            "INSERT INTO character_pictures (user_id, char_id, picture_filename, creator_id, created, active) "
+            "VALUES ('user', 1, '/pictures/jan.jpg', 'user', 1, 1)"
+        ))
+
+        self.assertEqual(self.cpc.get_char_pic_url("user", 1), "{}:{}/picture/jan.jpg".format("www.example.com", "8080"))
+        self.cpc.change_char("user", "user", "Name: Jan Janssen", 1)
+        self.assertEqual(self.query("SELECT picture_filename FROM character_heads WHERE user_id = 'user'"), [("/pictures/jan.jpg",)])
+
+    def test_triggers_match_a_rebuild(self):
+        for name in ["Jan", "Mafu", "Aiden", "Rin"]:
+            self.cpc.add_char("from", "from", "Name: " + name)
+        self.cpc.add_char("to", "to", "Name: Kai")
+        self.cpc.change_char("from", "from", "Name: Mafu Mafuyu", 2)
+        self.cpc.remove_char("from", "from", 3)
+        self.cpc.move_char("from", "to", 4)
+        self.cpc.remove_last_char_change("from", "from", 2)
+        # the links of deleted heads aren't read, those heads only keep their char_id taken
+        heads_sql = "SELECT * FROM character_heads WHERE deleted IS NULL ORDER BY user_id, char_id"
+        ids_sql = "SELECT user_id, char_id FROM character_heads ORDER BY user_id, char_id"
+        heads, ids = self.query(heads_sql), self.query(ids_sql)
+
+        for user_id in ["from", "to"]:
+            for statement in CharacterPersistentClass.get_char_heads_refresh_sql("?"):
+                self.cpc.connection.execute(statement, [user_id] * statement.count("?"))
+        self.assertEqual(heads, self.query(heads_sql))
+        self.assertEqual(ids, self.query(ids_sql))
+        self.assert_summary()
+
+    def test_last_change_of_remaining_heads(self):
+        with mock.patch("time.time", return_value=100):
+            self.cpc.add_char("user", "user", "Name: Jan")
+        with mock.patch("time.time", return_value=200):
+            self.cpc.add_char("user", "user", "Name: Mafu")
+        with mock.patch("time.time", return_value=300):
+            self.cpc.change_char("user", "user", "Name: Mafuyu", 2)
+        self.assertEqual(self.query("SELECT chars_cnt, last_change FROM user_char_summary"), [(2, 300)])
+        self.cpc.remove_char("user", "user", 2)
+
+        self.assertEqual(self.query("SELECT chars_cnt, last_change FROM user_char_summary"), [(1, 100)])
+        self.assert_summary()
+
+
+class AllocateCharIdTests(DatabaseTestCase):
+    """ CharacterPersistentClass.allocate_char_id test class"""
+
+    def test_sequential(self):
+        self.cpc.connect_database()
+        self.assertEqual(self.cpc.allocate_char_id("user"), 1)
+        # the reserved id isn't given out again, even without a version of the character
+        self.assertEqual(self.cpc.allocate_char_id("user"), 2)
+        self.assertEqual(self.cpc.allocate_char_id("other"), 1)
+
+    def test_deleted_ids_stay_taken(self):
+        for name in ["Jan", "Mafu"]:
+            self.cpc.add_char("user", "user", "Name: " + name)
+        self.cpc.remove_char("user", "user", 2)
+
+        self.assertEqual(self.cpc.add_char("user", "user", "Name: Aiden"), 3)
+
+    def test_gap_is_filled(self):
+        for name in ["Jan", "Mafu", "Aiden"]:
+            self.cpc.add_char("user", "user", "Name: " + name)
+        self.cpc.move_char("user", "other", 2)
+
+        self.assertEqual(self.cpc.add_char("user", "user", "Name: Wesen"), 2)
+        self.assertEqual(self.cpc.add_char("user", "user", "Name: Vampir"), 4)
+
+    def test_taken_id_is_retried(self):
+        self.cpc.add_char("user", "user", "Name: Jan")
+        # a parallel worker reserved the id between the lookup and the insert
+        with mock.patch.object(self.cpc, "get_next_fee_char_id", side_effect=[1, 2]):
+            self.assertEqual(self.cpc.allocate_char_id("user"), 2)
+
+        with mock.patch.object(self.cpc, "get_next_fee_char_id", return_value=1):
+            with self.assertRaises(sqlite3.IntegrityError):
+                self.cpc.allocate_char_id("user")
+
+    def test_move_missing(self):
+        self.cpc.add_char("to", "to", "Name: Aiden")
+
+        self.assertFalse(self.cpc.move_char("from", "to", 1))
+        # no id is reserved for a character which isn't there
+        self.assertEqual(self.query("SELECT char_id FROM character_heads WHERE user_id = 'to'"), [(1,)])
+
+
+class CharacterSearchTests(DatabaseTestCase):
+    """ Full text and field search test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.cpc.add_char("user1", "user1", "Vorname: Jan\nNachname: Janssen\nWesen: Vampir\nBild: http://example.com/jan.jpg")
+        self.cpc.add_char("user1", "user1", "Name: Mafu\nWesen: Werwolf\nMag Vampire nicht.")
+        self.cpc.add_char("user2", "user2", "**Name:** Aíden\nWesen: vampir")
+        self.cpc.commit()
+
+    def search(self, query, **kwargs):
+        return sorted((row["user_id"], row["char_id"]) for row in self.cpc.search_char(query, **kwargs))
+
+    def find(self, field, value, **kwargs):
+        return sorted((row["user_id"], row["char_id"]) for row in self.cpc.find_chars_by_field(field, value, **kwargs))
+
+    def test_search_names(self):
+        self.assertEqual(self.search("jan"), [("user1", 1)])
+        self.assertEqual(self.search("Janss"), [("user1", 1)])
+        self.assertEqual(self.search("aiden"), [("user2", 1)])
+        self.assertEqual(self.search("vampir"), [])
+        self.assertEqual(self.search("mafu", user_id="user2"), [])
+
+    def test_search_text(self):
+        self.assertEqual(self.search("vampir", query_key="text"), [("user1", 1), ("user1", 2), ("user2", 1)])
+        self.assertEqual(self.search("", query_key="text"), [])
+
+    def test_search_follows_changes(self):
+        self.cpc.change_char("user1", "user1", "Name: Mafuyu", 2)
+        self.cpc.remove_char("user2", "user2", 1)
+
+        self.assertEqual(self.search("mafuyu"), [("user1", 2)])
+        self.assertEqual(self.search("aiden"), [])
+
+    def test_find_by_field(self):
+        self.assertEqual(self.find("Wesen", "VAMPIR"), [("user1", 1), ("user2", 1)])
+        self.assertEqual(self.find("wesen", "vampir", user_id="user2"), [("user2", 1)])
+        self.assertEqual(self.find("Name", "janssen"), [("user1", 1)])
+        self.assertEqual(self.find("Wesen", "Mensch"), [])
+
+    def test_fields(self):
+        self.assertTrue(self.cpc.is_char_field("wesen"))
+        self.assertTrue(self.cpc.is_char_field("Name"))
+        self.assertFalse(self.cpc.is_char_field("Uhrzeit"))
+        self.assertFalse(self.cpc.is_char_field("http"))
+        self.assertEqual(
+            [(row["char_id"], row["value"]) for row in self.cpc.get_char_fields("user1", "name")],
+            [(1, "Jan"), (1, "Janssen"), (2, "Mafu")]
+        )
+
+    def test_fields_follow_changes(self):
+        self.cpc.change_char("user1", "user1", "Name: Mafu\nWesen: Mensch", 2)
+        self.cpc.move_char("user2", "user1", 1)
+
+        self.assertEqual(self.find("Wesen", "Werwolf"), [])
+        self.assertEqual(self.find("Wesen", "Mensch"), [("user1", 2)])
+        self.assertEqual(self.find("Wesen", "Vampir"), [("user1", 1), ("user1", 3)])
@@ -0,0 +1,51 @@
+""" Unittests for the command lookup of the MessageController. """
+import unittest
+
+from modules.message_controller import CommandRegistry, MessageCommand
+
+
+class CommandRegistryTests(unittest.TestCase):
+    """ CommandRegistry test class"""
+
+    def setUp(self):
+        self.registry = CommandRegistry()
+        self.help_entry = {"func": None, "cmds": {"de": "Hilfe", "en": "help", "_alts": ["?", "h"]}}
+        self.list_entry = {"func": None, "cmds": MessageCommand([], "Liste", "list", ["l"])}
+        self.fallback_entry = {"func": None, "cmds": None}
+        self.registry.append(self.help_entry)
+        self.registry.append(self.list_entry)
+        self.registry.append(self.fallback_entry)
+
+    def test_lookup_localized_names_and_aliases(self):
+        self.assertIs(self.registry.lookup("Hilfe"), self.help_entry)
+        self.assertIs(self.registry.lookup("help"), self.help_entry)
+        self.assertIs(self.registry.lookup("?"), self.help_entry)
+        self.assertIs(self.registry.lookup("list"), self.list_entry)
+        self.assertIs(self.registry.lookup("l"), self.list_entry)
+
+    def test_lookup_is_case_insensitive(self):
+        self.assertIs(self.registry.lookup("  HILFE "), self.help_entry)
+        self.assertIs(self.registry.lookup("LiStE"), self.list_entry)
+
+    def test_lookup_unknown_command(self):
+        self.assertIsNone(self.registry.lookup("unbekannt"))
+        self.assertIs(self.registry.fallback, self.fallback_entry)
+
+    def test_first_registered_command_wins(self):
+        duplicate = {"func": None, "cmds": {"de": "Hilfe", "en": "help2", "_alts": []}}
+        self.registry.append(duplicate)
+
+        self.assertIs(self.registry.lookup("hilfe"), self.help_entry)
+        self.assertIs(self.registry.lookup("help2"), duplicate)
+
+    def test_replace_and_remove(self):
+        new_help_entry = {"func": None, "cmds": {"de": "Hilfe", "en": "help", "_alts": []}}
+        self.registry.replace(self.help_entry, new_help_entry)
+
+        self.assertIs(self.registry.lookup("hilfe"), new_help_entry)
+        self.assertIsNone(self.registry.lookup("h"))
+        self.assertIs(list(self.registry)[0], new_help_entry)
+
+        self.registry.remove(self.list_entry)
+        self.assertIsNone(self.registry.lookup("liste"))
+        self.assertEqual(list(self.registry), [new_help_entry, self.fallback_entry])
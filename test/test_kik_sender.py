@@ -0,0 +1,170 @@
+""" Unittests for the batching of the KikMessageSender. """
+import time
+import unittest
+
+from kik import KikError
+from kik.messages import TextMessage
+
+from modules.kik_sender import KikMessageSender
+from test.database_test_case import DatabaseTestCase
+
+
+class PackBatchesTests(unittest.TestCase):
+    """ KikMessageSender.pack_batches test class"""
+
+    @staticmethod
+    def get_messages(user_counts):
+        """ Gets the messages for the users, the messages of a user numbered in their order"""
+        messages = []
+        for user, count in user_counts:
+            for i in range(0, count):
+                messages.append(TextMessage(to=user, chat_id="chat", body="{}-{}".format(user, i)))
+        return messages
+
+    def assert_within_limits(self, batches):
+        for batch in batches:
+            self.assertLessEqual(len(batch), KikMessageSender.MAX_MESSAGES_PER_CALL)
+            users = [str(message.to).lower() for message in batch]
+            for user in set(users):
+                self.assertLessEqual(users.count(user), KikMessageSender.MAX_MESSAGES_PER_USER)
+
+    def test_empty(self):
+        self.assertEqual(KikMessageSender.pack_batches([]), [])
+
+    def test_limit_per_call(self):
+        messages = self.get_messages([("user{}".format(i), 1) for i in range(0, 60)])
+        batches = KikMessageSender.pack_batches(messages)
+
+        self.assertEqual([len(batch) for batch in batches], [25, 25, 10])
+        self.assert_within_limits(batches)
+
+    def test_limit_per_user(self):
+        messages = self.get_messages([("user", 12)])
+        batches = KikMessageSender.pack_batches(messages)
+
+        self.assertEqual([len(batch) for batch in batches], [5, 5, 2])
+        self.assertEqual([message.body for batch in batches for message in batch], [message.body for message in messages])
+
+    def test_other_users_fill_up_batches(self):
+        messages = self.get_messages([("busy", 7), ("other1", 3), ("other2", 3)])
+        batches = KikMessageSender.pack_batches(messages)
+
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(len(batches[0]), 11)
+        self.assert_within_limits(batches)
+
+    def test_order_per_user_is_kept(self):
+        messages = self.get_messages([("a", 9), ("B", 2), ("b", 6), ("c", 30)])
+        batches = KikMessageSender.pack_batches(messages)
+        self.assert_within_limits(batches)
+
+        sent = [message for batch in batches for message in batch]
+        self.assertEqual(len(sent), len(messages))
+        for user in ["a", "b", "c"]:
+            self.assertEqual(
+                [message.body for message in sent if message.to.lower() == user],
+                [message.body for message in messages if message.to.lower() == user]
+            )
+
+
+class FakeKikApi:
+    """ Records the sent batches, batches with a message in reject_bodies fail with a 400"""
+
+    def __init__(self, error=None, reject_bodies=None):
+        self.error = error
+        self.reject_bodies = reject_bodies if reject_bodies is not None else []
+        self.batches = []
+
+    def send_messages(self, messages):
+        self.batches.append([message.body for message in messages])
+        if self.error is not None:
+            raise self.error
+        if any(message.body in self.reject_bodies for message in messages):
+            raise KikError("Bad Request", 400)
+
+
+class ManualKikMessageSender(KikMessageSender):
+    """ A sender without the background thread - the tests flush themselves"""
+
+    def run(self):
+        pass
+
+
+class OutboxTests(DatabaseTestCase):
+    """ KikMessageSender outbox test class"""
+
+    def get_sender(self, kik_api):
+        return ManualKikMessageSender(kik_api, self.cpc, {"SendMaxAttempts": "3"}, "testbot")
+
+    def add_messages(self, user_counts):
+        self.cpc.add_outbox_messages(PackBatchesTests.get_messages(user_counts))
+
+    def get_outbox(self):
+        return self.query("SELECT user_id, attempts, sent IS NOT NULL, failed IS NOT NULL FROM kik_outbox ORDER BY id")
+
+    def test_sent(self):
+        kik_api = FakeKikApi()
+        self.add_messages([("user{}".format(i), 2) for i in range(0, 15)])
+        self.get_sender(kik_api).flush()
+
+        self.assertEqual([len(batch) for batch in kik_api.batches], [25, 5])
+        self.assertTrue(all(sent == 1 for user_id, attempts, sent, failed in self.get_outbox()))
+
+        self.get_sender(kik_api).flush()
+        self.assertEqual(len(kik_api.batches), 2)
+
+    def test_retry_with_backoff(self):
+        kik_api = FakeKikApi(KikError("Internal Server Error", 500))
+        sender = self.get_sender(kik_api)
+        self.add_messages([("user", 2)])
+
+        sender.flush()
+        self.assertEqual(self.get_outbox(), [("user", 1, 0, 0), ("user", 1, 0, 0)])
+        self.assertTrue(all(row[0] > time.time() for row in self.query("SELECT next_attempt FROM kik_outbox")))
+
+        # the messages wait for their next attempt
+        sender.flush()
+        self.assertEqual(len(kik_api.batches), 1)
+
+        kik_api.error = None
+        self.cpc.connection.execute("UPDATE kik_outbox SET next_attempt = 0")
+        self.cpc.commit()
+        sender.flush()
+        self.assertEqual(self.get_outbox(), [("user", 1, 1, 0), ("user", 1, 1, 0)])
+
+    def test_failed_after_max_attempts(self):
+        kik_api = FakeKikApi(KikError("Internal Server Error", 500))
+        sender = self.get_sender(kik_api)
+        self.add_messages([("user", 1)])
+
+        for i in range(0, 3):
+            self.cpc.connection.execute("UPDATE kik_outbox SET next_attempt = 0")
+            self.cpc.commit()
+            sender.flush()
+
+        self.assertEqual(self.get_outbox(), [("user", 3, 0, 1)])
+        sender.flush()
+        self.assertEqual(len(kik_api.batches), 3)
+
+    def test_later_messages_of_user_wait(self):
+        kik_api = FakeKikApi()
+        sender = self.get_sender(kik_api)
+        self.add_messages([("user", 1), ("other", 1)])
+        self.cpc.connection.execute("UPDATE kik_outbox SET next_attempt = ? WHERE id = 1", [time.time() + 60])
+        self.cpc.commit()
+        self.add_messages([("user", 1)])
+
+        sender.flush()
+        self.assertEqual(kik_api.batches, [["other-0"]])
+
+    def test_rejected_batch_is_split(self):
+        kik_api = FakeKikApi(reject_bodies=["user3-0"])
+        self.add_messages([("user{}".format(i), 1) for i in range(0, 10)])
+        self.get_sender(kik_api).flush()
+
+        outbox = self.get_outbox()
+        self.assertEqual([row for row in outbox if row[3] == 1], [("user3", 1, 0, 1)])
+        self.assertEqual(len([row for row in outbox if row[2] == 1]), 9)
+        # the batch is halved until the rejected message is alone
+        self.assertIn(["user3-0"], kik_api.batches)
+        self.assertLess(len(kik_api.batches), 10)
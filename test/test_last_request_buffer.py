@@ -0,0 +1,93 @@
+""" Unittests for the buffered writes of the last requests. """
+import mock
+from kik import User as KikUser
+
+from modules.kik_user import LazyKikUser, User
+from modules.last_request_buffer import LastRequestBuffer
+from modules.profile_cache import ProfileCache
+from test.database_test_case import DatabaseTestCase
+
+
+class LastRequestBufferTests(DatabaseTestCase):
+    """ LastRequestBuffer test class"""
+
+    def setUp(self):
+        super().setUp()
+        # the background thread doesn't flush during the tests
+        self.buffer = LastRequestBuffer(self.cpc, "testbot", flush_interval_ms=3600000)
+        for user_id in ["user1", "user2"]:
+            self.cpc.update_user(User({"user_id": user_id, "bot_id": "testbot", "is_admin": 0}), as_request=False)
+        self.cpc.commit()
+
+    def get_last_requests(self):
+        return dict(self.query("SELECT user_id, last_request FROM users ORDER BY user_id"))
+
+    def test_flush_writes_the_newest_request(self):
+        self.buffer.bump("User1", 200)
+        self.buffer.bump("user1", 100)
+        self.buffer.bump("user2", 300)
+        self.assertEqual(self.get_last_requests(), {"user1": None, "user2": None})
+
+        self.buffer.flush()
+        self.assertEqual(self.get_last_requests(), {"user1": 200, "user2": 300})
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_older_request_doesnt_overwrite(self):
+        self.buffer.bump("user1", 200)
+        self.buffer.flush()
+        self.buffer.bump("user1", 100)
+        self.buffer.flush()
+
+        self.assertEqual(self.get_last_requests()["user1"], 200)
+
+    def test_failed_flush_is_repeated(self):
+        self.buffer.bump("user1", 200)
+        with mock.patch.object(self.cpc, "set_users_last_request", side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+        self.buffer.bump("user1", 100)
+
+        self.buffer.flush()
+        self.assertEqual(self.get_last_requests()["user1"], 200)
+
+
+class UserChangedTests(DatabaseTestCase):
+    """ User.is_changed test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.cpc.update_user(User({"user_id": "user1", "bot_id": "testbot", "first_name": "Jan", "last_name": "Janssen", "is_admin": 0}))
+        self.cpc.commit()
+        self.profile_cache = ProfileCache()
+        self.patch = mock.patch.multiple(LazyKikUser, character_persistent_class=self.cpc, profile_cache=self.profile_cache,
+                                         profile_refresher=mock.Mock(**{"fetch.return_value": {}}))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        super().tearDown()
+
+    def test_last_request_isnt_a_change(self):
+        user = LazyKikUser.init(self.cpc.get_user("user1"))
+        user.user_db["last_request"] = 100
+
+        self.assertFalse(user.is_changed())
+
+    def test_status_is_a_change(self):
+        user = LazyKikUser.init(self.cpc.get_user("user1"))
+        user.update_status(1)
+
+        self.assertTrue(user.is_changed())
+
+    def test_same_profile_name_isnt_a_change(self):
+        self.cpc.add_kik_user_data("user1", KikUser("Jan", "Janssen"))
+
+        self.assertFalse(LazyKikUser.init(self.cpc.get_user("user1")).is_changed())
+
+    def test_changed_profile_name_is_a_change(self):
+        self.cpc.add_kik_user_data("user1", KikUser("Jannik", "Janssen"))
+
+        user = LazyKikUser.init(self.cpc.get_user("user1"))
+        self.assertTrue(user.is_changed())
+        self.cpc.update_user(user)
+        self.assertEqual(self.cpc.get_user("user1")["first_name"], "Jannik")
@@ -0,0 +1,128 @@
+""" Unittests for the commands of the MessageController. """
+import json
+import os
+import unittest
+
+import mock
+import regex as re
+from flask import Flask
+from flask_babel import Babel
+from kik.messages import PictureMessage, TextMessage
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.kik_user import User
+from modules.message_controller import CommandMessageResponse, MessageController, msg_cmd_list, msg_cmd_list_command, msg_cmd_search_command
+from modules.session_store import SessionStore
+from test.database_test_case import DatabaseTestCase
+
+
+class SearchCommandTests(unittest.TestCase):
+    """ Suche command test class"""
+
+    @staticmethod
+    def get_values(message):
+        match = msg_cmd_search_command.get_compiled_regex().match(message)
+        return msg_cmd_search_command.get_values({key: value[0] if len(value) != 0 else None for key, value in match.capturesdict().items()})
+
+    def test_name_with_number(self):
+        values = self.get_values("Suche Agent 47")
+        self.assertEqual((values["name"], values["page"]), ("Agent 47", 1))
+
+    def test_page(self):
+        values = self.get_values("Suche Jan Seite 2")
+        self.assertEqual((values["name"], values["page"]), ("Jan", 2))
+        values = self.get_values("search Jan page 3")
+        self.assertEqual((values["name"], values["page"]), ("Jan", 3))
+
+    def test_user_and_field(self):
+        values = self.get_values("Suche @user1 Wesen = Vampir")
+        self.assertEqual((values["user_id"], values["name"]), ("@user1", "Wesen = Vampir"))
+
+
+class ListCommandTests(DatabaseTestCase):
+    """ Liste command test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.controller = mock.Mock(character_persistent_class=self.cpc)
+        self.controller.get_names_of_users.side_effect = lambda user_ids: {user_id: user_id for user_id in user_ids}
+        self.user = User({"user_id": "reader"})
+        for i in range(0, 40):
+            self.add_user("user{:02d}".format(i), 1000 + i)
+
+    def add_user(self, user_id, created):
+        with mock.patch("time.time", return_value=created):
+            self.cpc.add_char(user_id, user_id, "Name: Jan")
+
+    def list_page(self, page):
+        response = CommandMessageResponse(self.controller, TextMessage(from_user="reader", chat_id="chat", body="Liste"), [],
+                                          CharacterPersistentClass.STATUS_NONE, None, self.user, {"command": "Liste", "page": str(page)},
+                                          msg_cmd_list_command)
+        msg_cmd_list(response)
+        # the arrows read the cursor from the status of the user
+        if response.user_command_status is not None:
+            self.user.update_status(response.user_command_status, response.user_command_status_data)
+        return re.findall(r"Nutzername: @(\S+)", "\n".join(response.get_response_messages()))
+
+    def test_pages_by_number(self):
+        self.assertEqual(self.list_page(1), ["user{:02d}".format(i) for i in range(39, 24, -1)])
+        self.assertEqual(json.loads(self.user.status)["data"]["list_cursor"], {"2": ["after", 1025, "user25"]})
+
+    def test_next_page_by_cursor(self):
+        self.list_page(1)
+        # a change moves a user to the first page - the second page still continues after the first one
+        self.add_user("user30", 2000)
+        self.add_user("new", 2001)
+
+        self.assertEqual(self.list_page(2), ["user{:02d}".format(i) for i in range(24, 9, -1)])
+
+    def test_previous_page_by_cursor(self):
+        self.list_page(1)
+        self.list_page(2)
+        self.list_page(3)
+        self.add_user("new", 2000)
+
+        self.assertEqual(self.list_page(2), ["user{:02d}".format(i) for i in range(24, 9, -1)])
+        self.assertEqual(json.loads(self.user.status)["data"]["list_cursor"]["1"], ["before", 1024, "user24"])
+
+
+class SetPictureTests(DatabaseTestCase):
+    """ Bild-setzen command test class"""
+
+    def setUp(self):
+        super().setUp()
+        config_file = os.path.join(self.directory, "config.ini")
+        with open(config_file, "w") as file:
+            file.write("[DEFAULT]\nDatabasePath = {DatabasePath}\nPicturePath = {PicturePath}\n".format(**self.config))
+        self.controller = MessageController("testbot", config_file)
+        self.controller.session_store = SessionStore(self.controller.character_persistent_class, "testbot", flush_interval_ms=3600000)
+        self.controller.picture_ingestor = mock.Mock(**{"submit.return_value": True})
+        # the commands are translated with the locale of the request
+        app = Flask(__name__)
+        Babel(app)
+        self.request_context = app.test_request_context()
+        self.request_context.push()
+
+    def tearDown(self):
+        self.request_context.pop()
+        super().tearDown()
+
+    def process_message(self, message):
+        user = User({"user_id": message.from_user, "bot_id": "testbot", "first_name": "Jan", "is_admin": 0})
+        return [response.body for response in self.controller.process_message(message, user)]
+
+    def send_picture(self):
+        return self.process_message(PictureMessage(from_user="user1", chat_id="direct", chat_type="direct", pic_url="http://example.com/jan.jpg"))
+
+    def test_command_in_group_picture_in_direct_chat(self):
+        self.process_message(TextMessage(from_user="user1", chat_id="group", chat_type="public", participants=["user1", "user2", "user3"],
+                                         body="Bild-setzen 2"))
+
+        self.assertEqual(self.send_picture(), ["Bild wird verarbeitet. Du bekommst eine Nachricht, sobald das Bild gesetzt wurde."])
+        self.assertEqual(self.controller.picture_ingestor.submit.call_args[0][:4], ("user1", "user1", "http://example.com/jan.jpg", 2))
+        # the status ends with the picture
+        self.assertEqual(self.send_picture(), ["Sorry Jan, mit diesem Bild kann ich leider nichts anfangen."])
+
+    def test_picture_without_command(self):
+        self.assertEqual(self.send_picture(), ["Sorry Jan, mit diesem Bild kann ich leider nichts anfangen."])
+        self.controller.picture_ingestor.submit.assert_not_called()
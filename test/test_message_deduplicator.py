@@ -0,0 +1,55 @@
+""" Unittests for the detection of redelivered messages. """
+from kik.messages import TextMessage
+
+from modules.message_deduplicator import MessageDeduplicator
+from test.database_test_case import DatabaseTestCase
+
+
+class MessageDeduplicatorTests(DatabaseTestCase):
+    """ MessageDeduplicator test class"""
+
+    def get_deduplicator(self):
+        return MessageDeduplicator(self.cpc, "testbot", persistent=True)
+
+    @staticmethod
+    def get_message(message_id="message1"):
+        return TextMessage(id=message_id, from_user="user", chat_id="chat", body="Hilfe")
+
+    def test_redelivery_while_processing(self):
+        deduplicator = self.get_deduplicator()
+
+        self.assertFalse(deduplicator.is_duplicate(self.get_message()))
+        self.assertTrue(deduplicator.is_duplicate(self.get_message()))
+        self.assertFalse(deduplicator.is_duplicate(self.get_message("message2")))
+
+    def test_processed_message_after_restart(self):
+        deduplicator = self.get_deduplicator()
+        deduplicator.is_duplicate(self.get_message())
+        deduplicator.mark_processed(self.get_message())
+
+        self.assertTrue(self.cpc.is_processed_message("message1"))
+        self.assertTrue(self.get_deduplicator().is_duplicate(self.get_message()))
+
+    def test_failed_message_is_released(self):
+        deduplicator = self.get_deduplicator()
+        deduplicator.is_duplicate(self.get_message())
+        # processing failed - the redelivery has to be processed
+        deduplicator.release(self.get_message())
+
+        self.assertFalse(self.cpc.is_processed_message("message1"))
+        self.assertFalse(deduplicator.is_duplicate(self.get_message()))
+        self.assertFalse(self.get_deduplicator().is_duplicate(self.get_message()))
+
+    def test_not_persistent(self):
+        deduplicator = MessageDeduplicator(self.cpc, "testbot")
+        deduplicator.is_duplicate(self.get_message())
+        deduplicator.mark_processed(self.get_message())
+
+        self.assertFalse(self.cpc.is_processed_message("message1"))
+        self.assertTrue(deduplicator.is_duplicate(self.get_message()))
+
+    def test_message_without_id(self):
+        deduplicator = self.get_deduplicator()
+
+        self.assertFalse(deduplicator.is_duplicate(self.get_message(None)))
+        self.assertFalse(deduplicator.is_duplicate(self.get_message(None)))
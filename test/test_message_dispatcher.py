@@ -0,0 +1,82 @@
+""" Unittests for the per-chat lanes of the MessageDispatcher. """
+import threading
+import time
+import unittest
+
+from kik.messages import TextMessage
+
+from modules.message_dispatcher import MessageDispatcher
+
+
+class MessageDispatcherTests(unittest.TestCase):
+    """ MessageDispatcher test class"""
+
+    def setUp(self):
+        self.dispatcher = MessageDispatcher("testbot", worker_count=4)
+        self.processed = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def process(self, message, delay=0.0):
+        time.sleep(delay)
+        with self.lock:
+            self.processed.append((message.chat_id, message.body))
+
+    def test_order_per_chat(self):
+        futures = []
+        for i in range(0, 20):
+            for chat_id in ["chat1", "chat2", "chat3"]:
+                message = TextMessage(from_user="user", chat_id=chat_id, body=str(i))
+                # the earlier messages take longer - they still have to be processed first
+                futures.append(self.dispatcher.submit_message(message, self.process, (20 - i) / 2000))
+        for future in futures:
+            future.result(timeout=10)
+
+        for chat_id in ["chat1", "chat2", "chat3"]:
+            self.assertEqual([body for chat, body in self.processed if chat == chat_id], [str(i) for i in range(0, 20)])
+
+    def test_chats_in_parallel(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(message):
+            started.set()
+            release.wait(10)
+
+        chat_ids = ["chat{}".format(i) for i in range(0, 20)]
+        blocked_lane = self.dispatcher.get_lane("blocked")
+        other_chat_id = next(chat_id for chat_id in chat_ids if self.dispatcher.get_lane(chat_id) is not blocked_lane)
+
+        self.dispatcher.submit_message(TextMessage(from_user="user", chat_id="blocked", body="1"), block)
+        self.assertTrue(started.wait(10))
+        future = self.dispatcher.submit_message(TextMessage(from_user="user", chat_id=other_chat_id, body="2"), self.process)
+        future.result(timeout=10)
+        release.set()
+
+        self.assertEqual(self.processed, [(other_chat_id, "2")])
+
+    def test_lane_key_without_chat(self):
+        message = TextMessage(from_user="user", chat_id=None, body="1")
+        self.assertEqual(MessageDispatcher.get_lane_key(message), "user")
+
+    def test_error_doesnt_stop_the_lane(self):
+        def fail(message):
+            raise ValueError("Fehler")
+
+        message = TextMessage(from_user="user", chat_id="chat", body="1")
+        failed = self.dispatcher.submit_message(message, fail)
+        succeeded = self.dispatcher.submit_message(message, self.process)
+
+        with self.assertRaises(ValueError):
+            failed.result(timeout=10)
+        succeeded.result(timeout=10)
+        self.assertEqual(self.processed, [("chat", "1")])
+
+    def test_shutdown_drains_the_lanes(self):
+        for i in range(0, 10):
+            self.dispatcher.submit_message(TextMessage(from_user="user", chat_id="chat", body=str(i)), self.process, 0.001)
+        self.dispatcher.shutdown()
+
+        self.assertEqual(len(self.processed), 10)
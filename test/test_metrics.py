@@ -0,0 +1,70 @@
+""" Unittests for the counters and histograms of the Metrics. """
+import threading
+import unittest
+
+from modules.metrics import Metrics
+
+
+class MetricsTests(unittest.TestCase):
+    """ Metrics test class"""
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_render_counters(self):
+        self.metrics.inc("kikbot_messages_total", {"type": "text"})
+        self.metrics.inc("kikbot_messages_total", {"type": "text"}, 2)
+        self.metrics.inc("kikbot_messages_total", {"type": "picture"})
+        self.metrics.inc("kikbot_errors_total")
+
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[:5], [
+            "# TYPE kikbot_errors_total counter",
+            "kikbot_errors_total{} 1",
+            "# TYPE kikbot_messages_total counter",
+            "kikbot_messages_total{type=\"picture\"} 1",
+            "kikbot_messages_total{type=\"text\"} 3"
+        ])
+
+    def test_render_histogram(self):
+        self.metrics.observe("handler", 0.003, "Liste")
+        self.metrics.observe("handler", 0.2, "Liste")
+        self.metrics.observe("handler", 20, "Liste")
+
+        lines = self.metrics.render().splitlines()
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"0.001\"} 0", lines)
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"0.005\"} 1", lines)
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"0.25\"} 2", lines)
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"10\"} 2", lines)
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"+Inf\"} 3", lines)
+        self.assertIn("kikbot_stage_seconds_count{stage=\"handler\",command=\"Liste\"} 3", lines)
+        sum_line = next(line for line in lines if line.startswith("kikbot_stage_seconds_sum"))
+        self.assertAlmostEqual(float(sum_line.split(" ")[1]), 20.203)
+
+    def test_bucket_bound_is_inclusive(self):
+        self.metrics.observe("handler", 0.01, "Liste")
+
+        self.assertIn("kikbot_stage_seconds_bucket{stage=\"handler\",command=\"Liste\",le=\"0.01\"} 1",
+                      self.metrics.render().splitlines())
+
+    def test_command_per_thread(self):
+        self.metrics.set_command("Liste")
+
+        def observe():
+            self.metrics.observe("handler", 0.1)
+        thread = threading.Thread(target=observe)
+        thread.start()
+        thread.join()
+        self.metrics.observe("handler", 0.1)
+
+        self.assertEqual(sorted(self.metrics.histograms), [("handler", Metrics.NO_COMMAND), ("handler", "Liste")])
+
+    def test_timer(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer("handler", "Liste"):
+                raise ValueError("Fehler")
+
+        self.assertEqual(self.metrics.histograms[("handler", "Liste")][2], 1)
+
+    def test_label_values_are_escaped(self):
+        self.assertEqual(Metrics.format_labels([("command", "a\"b\\c\nd")]), "{command=\"a\\\"b\\\\c\\nd\"}")
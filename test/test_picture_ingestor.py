@@ -0,0 +1,103 @@
+""" Unittests for the background download of the character pictures. """
+import os
+import threading
+
+import mock
+import requests
+
+from modules.picture_ingestor import PictureIngestor
+from test.database_test_case import DatabaseTestCase
+
+
+class FakeResponse:
+    """ Streamed http response, which fails after the given blocks if an error is set"""
+
+    def __init__(self, blocks, status_code=200, headers=None, error=None):
+        self.blocks = blocks
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {"content-type": "image/png"}
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def iter_content(self, chunk_size):
+        for block in self.blocks:
+            yield block
+        if self.error is not None:
+            raise self.error
+
+
+class PictureIngestorTests(DatabaseTestCase):
+    """ PictureIngestor test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.message_sender = mock.Mock()
+        self.ingestor = PictureIngestor(self.cpc, self.message_sender, "testbot", max_pending=1, max_size=10)
+        self.ingestor.http_session = mock.Mock()
+        self.cpc.add_char("user", "user", "Name: Jan")
+        self.cpc.commit()
+
+    def tearDown(self):
+        self.ingestor.shutdown()
+        super().tearDown()
+
+    def ingest(self, response):
+        self.ingestor.http_session.get.return_value = response
+        self.assertTrue(self.ingestor.submit("user", "user", "http://example.com/jan.png", 1, ["success"], ["error"]))
+        self.ingestor.executor.shutdown(wait=True)
+
+    def get_files(self):
+        return sorted(os.path.splitext(filename)[1] for filename in os.listdir(self.directory) if not filename.startswith("database.db"))
+
+    def get_pictures(self):
+        return self.query("SELECT user_id, char_id FROM character_pictures")
+
+    def test_picture_is_set(self):
+        self.ingest(FakeResponse([b"12345", b"67890"]))
+
+        self.assertEqual(self.get_files(), [".png"])
+        self.assertEqual(self.get_pictures(), [("user", 1)])
+        self.message_sender.send.assert_called_once_with(["success"])
+        self.assertEqual(self.ingestor.pending, 0)
+
+    def test_too_large_picture(self):
+        self.ingest(FakeResponse([b"12345", b"67890", b"1"]))
+
+        self.assertEqual(self.get_files(), [])
+        self.assertEqual(self.get_pictures(), [])
+        self.message_sender.send.assert_called_once_with(["error"])
+
+    def test_too_large_content_length(self):
+        self.ingest(FakeResponse([b"1"], headers={"content-length": "11"}))
+
+        self.assertEqual(self.get_files(), [])
+        self.message_sender.send.assert_called_once_with(["error"])
+
+    def test_dropped_connection_removes_the_file(self):
+        self.ingest(FakeResponse([b"12345"], error=requests.ConnectionError("Connection reset")))
+
+        self.assertEqual(self.get_files(), [])
+        self.assertEqual(self.get_pictures(), [])
+        self.message_sender.send.assert_called_once_with(["error"])
+
+    def test_unexpected_error_removes_the_file(self):
+        self.ingest(FakeResponse([b"12345"], error=OSError("No space left on device")))
+
+        self.assertEqual(self.get_files(), [])
+        self.message_sender.send.assert_called_once_with(["error"])
+        self.assertEqual(self.ingestor.pending, 0)
+
+    def test_too_many_pending_pictures(self):
+        released = threading.Event()
+        self.ingestor.http_session.get.side_effect = lambda *args, **kwargs: released.wait(10) and FakeResponse([b"1"])
+        self.assertTrue(self.ingestor.submit("user", "user", "http://example.com/jan.png", 1, ["success"], ["error"]))
+
+        self.assertFalse(self.ingestor.submit("user", "user", "http://example.com/jan.png", 1, ["success"], ["error"]))
+        released.set()
+        self.ingestor.executor.shutdown(wait=True)
+        self.message_sender.send.assert_called_once_with(["success"])
@@ -0,0 +1,53 @@
+""" Unittests for the shared cache of the Kik profiles. """
+import unittest
+
+import mock
+
+from modules.profile_cache import ProfileCache
+
+
+class ProfileCacheTests(unittest.TestCase):
+    """ ProfileCache test class"""
+
+    def setUp(self):
+        self.cache = ProfileCache(max_size=2, ttl=600, failure_ttl=60)
+        self.loaded = []
+
+    def load(self, user_ids):
+        self.loaded.append(user_ids)
+        return {user_id: {"user_id": user_id} for user_id in user_ids if user_id != "nobody"}
+
+    def test_missing_profiles_are_loaded_at_once(self):
+        self.cache.set("user1", {"user_id": "user1", "first_name": "Jan"})
+
+        profiles = self.cache.get_many(["USER1", "User2", "nobody"], self.load)
+        self.assertEqual(profiles, {"user1": {"user_id": "user1", "first_name": "Jan"}, "user2": {"user_id": "user2"}, "nobody": None})
+        self.assertEqual(self.loaded, [["user2", "nobody"]])
+
+    def test_user_without_profile_is_cached(self):
+        self.cache.get_many(["nobody"], self.load)
+
+        self.assertIsNone(self.cache.get("nobody"))
+        self.assertEqual(self.cache.get_many(["nobody"], self.load), {"nobody": None})
+        self.assertEqual(self.loaded, [["nobody"]])
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.get_many(["user1", "user2"], self.load)
+        self.cache.get("user1")
+        self.cache.get_many(["user3"], self.load)
+
+        self.assertIs(self.cache.get("user2"), ProfileCache.MISSING)
+        self.assertEqual(self.cache.get("user1"), {"user_id": "user1"})
+
+    def test_profiles_expire(self):
+        with mock.patch("time.time", return_value=1000):
+            self.cache.set("user1", {"user_id": "user1"})
+        with mock.patch("time.time", return_value=1000 + 601):
+            self.assertIs(self.cache.get("user1"), ProfileCache.MISSING)
+
+    def test_failures_expire(self):
+        with mock.patch("time.time", return_value=1000):
+            self.cache.set_failed("User1")
+            self.assertTrue(self.cache.is_failed("user1"))
+        with mock.patch("time.time", return_value=1000 + 61):
+            self.assertFalse(self.cache.is_failed("user1"))
@@ -0,0 +1,186 @@
+""" Unittests for the background refresh of the Kik profiles. """
+import threading
+import time
+
+import mock
+from kik import KikError, User
+
+from modules.kik_user import LazyKikUser
+from modules.profile_cache import ProfileCache
+from modules.profile_refresher import ProfileRefresher
+from test.database_test_case import DatabaseTestCase
+
+
+class FakeKikApi:
+    """ Kik API which returns the profiles as soon as it is released"""
+
+    def __init__(self):
+        self.released = threading.Event()
+        self.released.set()
+        self.requested = []
+        self.first_name = "Jan"
+
+    def get_user(self, user_id):
+        self.requested.append(user_id)
+        if not self.released.wait(10):
+            raise KikError("Timeout", 504)
+        if user_id == "failing":
+            raise KikError("Not Found", 404)
+        return User(self.first_name, "Janssen")
+
+
+class ProfileRefresherTests(DatabaseTestCase):
+    """ ProfileRefresher test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.kik_api = FakeKikApi()
+        self.profile_cache = ProfileCache()
+        self.refresher = ProfileRefresher(self.kik_api, self.cpc, self.profile_cache, "testbot", wait_timeout=0.2)
+
+    def tearDown(self):
+        self.kik_api.released.set()
+        self.refresher.shutdown()
+        self.refresher.executor.shutdown(wait=True)
+        super().tearDown()
+
+    def test_refresh_stores_the_profile(self):
+        profile = self.refresher.refresh("User1").result(timeout=10)
+
+        self.assertEqual(profile["first_name"], "Jan")
+        self.assertEqual(self.profile_cache.get("user1")["first_name"], "Jan")
+        self.assertEqual(self.cpc.get_kik_users(["user1"])["user1"]["first_name"], "Jan")
+        self.assertEqual(self.refresher.in_flight, {})
+
+    def test_running_request_is_shared(self):
+        self.kik_api.released.clear()
+        future = self.refresher.refresh("user1")
+
+        self.assertIs(self.refresher.refresh("USER1"), future)
+        self.kik_api.released.set()
+        future.result(timeout=10)
+        self.assertEqual(self.kik_api.requested, ["user1"])
+
+    def test_failed_user_isnt_requested_again(self):
+        self.assertEqual(self.refresher.fetch(["failing"]), {})
+
+        self.assertIsNone(self.refresher.refresh("failing"))
+        self.assertEqual(self.kik_api.requested, ["failing"])
+
+    def test_fetch_waits_until_the_deadline(self):
+        self.kik_api.released.clear()
+        start = time.time()
+
+        self.assertEqual(self.refresher.fetch(["user1", "user2"]), {})
+        self.assertLess(time.time() - start, 2)
+
+        # the profiles still arrive for the next requests
+        self.kik_api.released.set()
+        for future in list(self.refresher.in_flight.values()):
+            future.result(timeout=10)
+        self.assertEqual(self.refresher.fetch(["user1"]), {"user1": self.profile_cache.get("user1")})
+
+    def test_stale_profile_is_shown_while_refreshed(self):
+        with mock.patch("time.time", return_value=time.time() - LazyKikUser.max_age - 60):
+            self.cpc.add_kik_user_data("user1", User("Jan", "Janssen"))
+        self.cpc.commit()
+        self.kik_api.first_name = "Jannik"
+        self.kik_api.released.clear()
+
+        with mock.patch.multiple(LazyKikUser, character_persistent_class=self.cpc, profile_cache=self.profile_cache,
+                                 profile_refresher=self.refresher):
+            user = LazyKikUser.init_many(["user1"], load_users=False)["user1"]
+            self.assertEqual(user.kik_user_db["first_name"], "Jan")
+
+            future = self.refresher.in_flight["user1"]
+            self.kik_api.released.set()
+            future.result(timeout=10)
+            user = LazyKikUser.init_many(["user1"], load_users=False)["user1"]
+            self.assertEqual(user.kik_user_db["first_name"], "Jannik")
+        self.assertEqual(self.kik_api.requested, ["user1"])
+
+    def test_missing_profile_is_waited_for(self):
+        with mock.patch.multiple(LazyKikUser, character_persistent_class=self.cpc, profile_cache=self.profile_cache,
+                                 profile_refresher=self.refresher):
+            user = LazyKikUser.init_many(["user1"], load_users=False)["user1"]
+
+        self.assertEqual(user.kik_user_db["first_name"], "Jan")
+
+
+class ProfilePrefetchTests(DatabaseTestCase):
+    """ ProfileRefresher.prefetch test class"""
+
+    def setUp(self):
+        super().setUp()
+        self.kik_api = FakeKikApi()
+        self.profile_cache = ProfileCache()
+        self.refresher = ProfileRefresher(self.kik_api, self.cpc, self.profile_cache, "testbot", max_prefetch=2)
+
+    def tearDown(self):
+        self.kik_api.released.set()
+        self.refresher.shutdown()
+        self.refresher.executor.shutdown(wait=True)
+        super().tearDown()
+
+    def prefetch(self, chat_id, user_ids):
+        self.refresher.prefetch(chat_id, user_ids)
+        # the prefetch executor has one worker - the prefetch is done when the next task runs
+        self.refresher.prefetch_executor.submit(lambda: None).result(timeout=10)
+
+    def wait_for_refreshes(self):
+        for future in list(self.refresher.in_flight.values()):
+            future.result(timeout=10)
+        # the counter is released by a callback of the refresh, which runs after the result is set
+        deadline = time.time() + 10
+        while self.refresher.prefetching != 0 and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_stale_profiles_are_refreshed(self):
+        self.cpc.add_kik_user_data("fresh", User("Jan", "Janssen"))
+        self.cpc.commit()
+        self.prefetch("chat", ["fresh", "user1"])
+        self.wait_for_refreshes()
+
+        self.assertEqual(self.kik_api.requested, ["user1"])
+        self.assertEqual(self.profile_cache.get("user1")["first_name"], "Jan")
+        self.assertEqual(self.refresher.prefetching, 0)
+
+    def test_chat_is_prefetched_once_per_interval(self):
+        self.prefetch("chat", ["user1"])
+        self.wait_for_refreshes()
+        self.profile_cache.profiles.remove("user1")
+        self.prefetch("chat", ["user1", "user2"])
+
+        self.assertEqual(self.kik_api.requested, ["user1"])
+
+    def test_concurrent_prefetches_are_limited(self):
+        self.kik_api.released.clear()
+        self.prefetch("chat", ["user1", "user2", "user3", "user4"])
+
+        self.assertEqual(sorted(self.refresher.in_flight), ["user1", "user2"])
+        self.assertEqual(self.refresher.prefetching, 2)
+        # the chat wasn't done, it is prefetched again with the next message
+        self.assertNotIn("chat", self.refresher.prefetched_chats)
+        self.prefetch("other_chat", ["user5"])
+        self.assertNotIn("user5", self.refresher.in_flight)
+
+        self.kik_api.released.set()
+        self.wait_for_refreshes()
+        self.assertEqual(self.refresher.prefetching, 0)
+        self.prefetch("chat", ["user1", "user2", "user3", "user4"])
+        self.wait_for_refreshes()
+        self.assertEqual(sorted(self.kik_api.requested), ["user1", "user2", "user3", "user4"])
+        self.assertEqual(self.refresher.prefetching, 0)
+
+    def test_failed_and_running_refreshes_release_the_counter(self):
+        self.kik_api.released.clear()
+        running = self.refresher.refresh("user1")
+        self.prefetch("chat", ["failing", "user1"])
+        self.kik_api.released.set()
+        running.result(timeout=10)
+        self.wait_for_refreshes()
+
+        self.assertEqual(self.refresher.prefetching, 0)
+        self.assertTrue(self.profile_cache.is_failed("failing"))
+        self.prefetch("other_chat", ["failing"])
+        self.assertEqual(sorted(self.kik_api.requested), ["failing", "user1"])
@@ -0,0 +1,106 @@
+""" Unittests for the admission control of incoming messages. """
+import unittest
+
+import mock
+from kik.messages import TextMessage
+
+from modules.rate_limiter import RateLimiter, TokenBucket
+
+
+class TokenBucketTests(unittest.TestCase):
+    """ TokenBucket test class"""
+
+    def test_refill_up_to_burst(self):
+        bucket = TokenBucket(2.0, 5.0)
+        bucket.tokens = 0
+        bucket.updated = 100
+
+        bucket.refill(101)
+        self.assertEqual(bucket.tokens, 2.0)
+
+        bucket.refill(200)
+        self.assertEqual(bucket.tokens, 5.0)
+
+
+class RateLimiterTests(unittest.TestCase):
+    """ RateLimiter test class"""
+
+    @staticmethod
+    def get_message(user="user", chat_id="chat"):
+        return TextMessage(from_user=user, chat_id=chat_id, body="Hilfe")
+
+    def test_burst_then_shed_then_drop(self):
+        limiter = RateLimiter("testbot", user_rate=0.001, user_burst=3, chat_rate=0, expensive_rate=0)
+
+        for i in range(0, 3):
+            self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+        # the first rejected message gets a canned reply, the following ones are ignored
+        self.assertEqual(limiter.admit(self.get_message()), RateLimiter.SHED)
+        self.assertEqual(limiter.admit(self.get_message()), RateLimiter.DROP)
+
+    def test_buckets_per_user(self):
+        limiter = RateLimiter("testbot", user_rate=0.001, user_burst=1, chat_rate=0, expensive_rate=0)
+
+        self.assertEqual(limiter.admit(self.get_message("user1")), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message("user2")), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message("user1")), RateLimiter.SHED)
+
+    def test_chat_bucket(self):
+        limiter = RateLimiter("testbot", user_rate=0, chat_rate=0.001, chat_burst=2, expensive_rate=0)
+
+        self.assertEqual(limiter.admit(self.get_message("user1")), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message("user2")), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message("user3")), RateLimiter.SHED)
+        self.assertEqual(limiter.admit(self.get_message("user3", "other chat")), RateLimiter.ADMIT)
+
+    def test_expensive_bucket(self):
+        limiter = RateLimiter("testbot", user_rate=0.001, user_burst=10, chat_rate=0, expensive_rate=0.001, expensive_burst=1)
+
+        self.assertEqual(limiter.admit(self.get_message(), expensive=True), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message(), expensive=True), RateLimiter.SHED)
+        self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+
+    def test_rejected_message_takes_no_tokens(self):
+        limiter = RateLimiter("testbot", user_rate=0.001, user_burst=2, chat_rate=0, expensive_rate=0.001, expensive_burst=1)
+
+        self.assertEqual(limiter.admit(self.get_message(), expensive=True), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message(), expensive=True), RateLimiter.SHED)
+        # the user bucket still has the token the rejected expensive message didn't get
+        self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+
+    def test_drop_when_too_many_pending(self):
+        limiter = RateLimiter("testbot", user_rate=0.001, user_burst=1, chat_rate=0, expensive_rate=0, max_pending=10)
+
+        self.assertEqual(limiter.admit(self.get_message(), pending=10), RateLimiter.ADMIT)
+        self.assertEqual(limiter.admit(self.get_message(), pending=10), RateLimiter.DROP)
+
+    def test_drained_bucket_doesnt_reset(self):
+        limiter = RateLimiter("testbot", user_rate=0.0001, user_burst=2, chat_rate=0, expensive_rate=0)
+
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+            self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+
+        # one token takes 10000 seconds - the bucket is still drained after the sender flooded it for two hours
+        for now in range(1060, 8200, 60):
+            with mock.patch("time.time", return_value=float(now)):
+                self.assertNotEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+
+    def test_other_keys_dont_refill_a_drained_bucket(self):
+        limiter = RateLimiter("testbot", user_rate=0.0001, user_burst=1, chat_rate=0, expensive_rate=0, max_keys=100)
+
+        self.assertEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+        for i in range(0, 1000):
+            limiter.admit(self.get_message("user{}".format(i)))
+        self.assertNotEqual(limiter.admit(self.get_message()), RateLimiter.ADMIT)
+
+    def test_full_buckets_are_removed(self):
+        limiter = RateLimiter("testbot", user_rate=1, user_burst=2, chat_rate=0, expensive_rate=0)
+
+        with mock.patch("time.time", return_value=1000.0):
+            limiter.admit(self.get_message("user1"))
+            limiter.admit(self.get_message("user2"))
+            limiter.admit(self.get_message("user2"))
+        limiter.remove_full_buckets(1001.0)
+
+        self.assertEqual(list(limiter.buckets), [("user", "user2")])
@@ -0,0 +1,86 @@
+""" Unittests for the session states of the users per chat. """
+import time
+
+from modules.character_persistent_class import CharacterPersistentClass
+from modules.session_store import SessionState, SessionStore
+from test.database_test_case import DatabaseTestCase
+
+
+class SessionStoreTests(DatabaseTestCase):
+    """ SessionStore test class"""
+
+    def setUp(self):
+        super().setUp()
+        # flushed by the tests themselves
+        self.store = SessionStore(self.cpc, "testbot", flush_interval_ms=3600000)
+
+    def test_encode_decode(self):
+        state = SessionState(CharacterPersistentClass.STATUS_DYN_MESSAGES, {"left": "Suche Jan Seite 1"}, 100)
+        decoded = SessionState.decode(state.encode(), state.updated)
+
+        self.assertEqual(decoded.get_status_obj(), state.get_status_obj())
+        self.assertEqual(decoded.updated, 100)
+
+    def test_set_and_get(self):
+        self.store.set("User", "chat1", CharacterPersistentClass.STATUS_DYN_MESSAGES, {"left": "Liste 1"})
+
+        state = self.store.get("user", "chat1")
+        self.assertEqual(state.status, CharacterPersistentClass.STATUS_DYN_MESSAGES)
+        self.assertEqual(state.data, {"left": "Liste 1"})
+        self.assertIsNone(self.store.get("user", "chat2"))
+
+    def test_flush(self):
+        self.store.set("user", "chat1", CharacterPersistentClass.STATUS_DYN_MESSAGES, {"left": "Liste 1"})
+        self.assertEqual(self.query("SELECT * FROM sessions"), [])
+
+        self.store.flush()
+        self.assertEqual(len(self.query("SELECT * FROM sessions WHERE user_id = 'user' AND chat_id = 'chat1'")), 1)
+
+        other_store = SessionStore(self.cpc, "testbot", flush_interval_ms=3600000)
+        self.assertEqual(other_store.get("user", "chat1").data, {"left": "Liste 1"})
+
+    def test_empty_state_is_not_written(self):
+        self.store.set("user", "chat1", CharacterPersistentClass.STATUS_NONE)
+        self.store.flush()
+
+        self.assertEqual(self.store.dirty, {})
+        self.assertEqual(self.query("SELECT * FROM sessions"), [])
+
+    def test_reset_state_is_written(self):
+        self.store.set("user", "chat1", CharacterPersistentClass.STATUS_DYN_MESSAGES, {"left": "Liste 1"})
+        self.store.flush()
+        self.store.set("user", "chat1", CharacterPersistentClass.STATUS_NONE)
+        self.store.flush()
+
+        other_store = SessionStore(self.cpc, "testbot", flush_interval_ms=3600000)
+        self.assertTrue(other_store.get("user", "chat1").is_empty())
+
+    def test_expired_state(self):
+        self.cpc.set_sessions([("user", "chat1", SessionState(CharacterPersistentClass.STATUS_DYN_MESSAGES).encode(),
+                                int(time.time()) - self.store.ttl - 1)])
+
+        self.assertIsNone(self.store.get("user", "chat1"))
+        self.store.flush()
+        self.assertEqual(self.query("SELECT * FROM sessions"), [])
+
+    def test_user_status_in_all_chats(self):
+        self.store.set("user", "group", CharacterPersistentClass.STATUS_SET_PICTURE, {"user_id": "user", "char_id": 2})
+
+        self.assertEqual(self.store.get("user", "direct").status, CharacterPersistentClass.STATUS_SET_PICTURE)
+        self.assertEqual(self.store.get("user", "group").data, {"user_id": "user", "char_id": 2})
+        self.assertIsNone(self.store.get("other", "direct"))
+
+    def test_next_status_replaces_the_user_status(self):
+        self.store.set("user", "direct", CharacterPersistentClass.STATUS_DYN_MESSAGES, {"left": "Liste 1"})
+        self.store.set("user", "group", CharacterPersistentClass.STATUS_SET_PICTURE, {"user_id": "user", "char_id": 2})
+        self.store.set("user", "direct", CharacterPersistentClass.STATUS_NONE)
+
+        self.assertTrue(self.store.get("user", "direct").is_empty())
+        self.assertIsNone(self.store.get("user", "group"))
+
+    def test_user_status_is_written(self):
+        self.store.set("user", "group", CharacterPersistentClass.STATUS_SET_PICTURE, {"user_id": "user", "char_id": 2})
+        self.store.flush()
+
+        other_store = SessionStore(self.cpc, "testbot", flush_interval_ms=3600000)
+        self.assertEqual(other_store.get("user", "direct").status, CharacterPersistentClass.STATUS_SET_PICTURE)
@@ -0,0 +1,71 @@
+""" Unittests for the TTLCache. """
+import time
+import unittest
+
+from modules.ttl_cache import TTLCache
+
+
+class TTLCacheTests(unittest.TestCase):
+    """ TTLCache test class"""
+
+    def test_get_and_set(self):
+        cache = TTLCache(10, 60)
+        cache.set("key", None)
+
+        self.assertIsNone(cache.get("key", TTLCache.MISSING))
+        self.assertIs(cache.get("other", TTLCache.MISSING), TTLCache.MISSING)
+        self.assertIn("key", cache)
+
+    def test_expiry(self):
+        cache = TTLCache(10, 60)
+        cache.set("key", "value")
+        cache.entries["key"] = ("value", time.time() - 1)
+
+        self.assertIsNone(cache.get("key"))
+        self.assertNotIn("key", cache)
+        self.assertEqual(len(cache), 0)
+
+    def test_add(self):
+        cache = TTLCache(10, 60)
+
+        self.assertTrue(cache.add("key", 1))
+        self.assertFalse(cache.add("key", 2))
+        self.assertEqual(cache.get("key"), 1)
+
+        cache.entries["key"] = (1, time.time() - 1)
+        self.assertTrue(cache.add("key", 3))
+        self.assertEqual(cache.get("key"), 3)
+
+    def test_size_drops_oldest_set(self):
+        cache = TTLCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertNotIn("a", cache)
+        self.assertIn("b", cache)
+        self.assertIn("c", cache)
+
+    def test_size_drops_least_recently_used(self):
+        cache = TTLCache(2, 60, lru=True)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+
+    def test_remove_and_clear(self):
+        cache = TTLCache(10, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        cache.remove("a")
+        cache.remove("unknown")
+        self.assertNotIn("a", cache)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)